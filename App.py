@@ -2,31 +2,76 @@
 Main api request endpoint
 """
 
+import io
 import os
+import json
+import math
+import hmac
+import time
 import array
 import base64
-import tempfile
+import random
+import hashlib
+import secrets
+import logging
 import datetime
-import traceback
-from copy import deepcopy
 from functools import wraps
 import flask_limiter.errors
 from bson.objectid import ObjectId
-from google.oauth2 import id_token
-from google.auth.transport import requests
+import gridfs
+from pymongo import UpdateOne, ReturnDocument, monitoring
+# aliased, mongoengine exports its own BulkWriteError
+from pymongo.errors import BulkWriteError as PyMongoBulkWriteError, PyMongoError
 from flask_cors import CORS
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
+from werkzeug.wsgi import wrap_file
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.exceptions import HTTPException, RequestedRangeNotSatisfiable
 from flask_mongoengine import MongoEngine
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from Models import Person, Group, Item, TransactionItem, Transaction, Receipt
+from Models import Person, Group, Item, TransactionItem, Transaction, Receipt, ensure_indexes_async
+from Utils import TokenCache, CertStore, WorkerPool, LRUCache, RequestLog, QueryCounter, Metrics, Ledger, \
+    Settlement, ImageProcessing
 from mongoengine import *
 
+
+def rate_limit_key():
+    """
+    rate limit requests by the authenticated subject, or by the client address until its token is verified
+    :return: the key of the request's counters
+    """
+    bearer = request.headers.get('Authorization', '').split()
+    if len(bearer) == 2:
+        # only a token this worker already verified is trusted, the limit is checked before verify_token runs
+        sub = token_cache.get_sub(token_cache.key(bearer[1]))
+        if sub is not None:
+            return f'sub:{sub}'
+    return f'ip:{get_remote_address()}'
+
+
 # setup the Flask server
 app = Flask(__name__)
+
+# number of proxies in front of the api, their X-Forwarded-For entries are trusted for the client address
+proxy_count = int(os.environ.get('PROXY_COUNT', 0))
+if proxy_count:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_count)
+
+# rate limit counters are per worker unless RATELIMIT_STORAGE_URI points to a shared storage
+# (redis://host:6379, memcached://host:11211, mongodb://host:27017), RATELIMIT_STRATEGY is
+# fixed-window, fixed-window-elastic-expiry or moving-window (not supported by memcached)
+rate_limit_storage = os.environ.get('RATELIMIT_STORAGE_URI', 'memory://')
 limiter = Limiter(app,
-                  key_func=get_remote_address,
-                  default_limits=['20/second'])
+                  key_func=rate_limit_key,
+                  default_limits=['20/second'],
+                  storage_uri=rate_limit_storage,
+                  strategy=os.environ.get('RATELIMIT_STRATEGY', 'fixed-window'),
+                  key_prefix='smart-ledger',
+                  # count in memory while the shared storage is unreachable instead of failing the requests
+                  in_memory_fallback_enabled=not rate_limit_storage.startswith('memory://'),
+                  swallow_errors=True,
+                  enabled=os.environ.get('RATELIMIT_ENABLED', '1') != '0')
 
 debug = os.environ.get('DEBUG', False)
 debug = bool(debug)
@@ -35,7 +80,7 @@ print(f"# DEBUG: {debug}")
 
 # If on debug allow cross-origin resource sharing
 if debug:
-    CORS(app)
+    CORS(app, expose_headers=['ETag'])
 
 mongo_host = os.environ.get('MONGO_HOST', 'localhost')
 mongo_port = os.environ.get('MONGO_PORT', 27017)
@@ -50,52 +95,137 @@ if mongo_username is None:
 if mongo_password is None:
     print("WARNING: MongoDB password is None!!")
 
+# one MongoDB pool per worker process, sized for the requests the worker serves at once (set by gunicorn.conf.py)
+# plus the background receipt workers, a request waits at most MONGO_WAIT_QUEUE_TIMEOUT_MS for a free connection
+worker_concurrency = int(os.environ.get('WORKER_CONCURRENCY', 1))
+receipt_workers = int(os.environ.get('RECEIPT_WORKERS', 2))
+mongo_max_pool_size = int(os.environ.get('MONGO_MAX_POOL_SIZE', worker_concurrency + receipt_workers + 2))
+
+# MONGO_DB selects the database the data is kept in (e.g. the benchmarks' BENCH_DB), the API user is always
+# authenticated against smart-ledger, the maintenance scripts under scripts/ read the same variable
 app.config['MONGODB_SETTINGS'] = {
     'host': mongo_host,
     'username': mongo_username,
     'password': mongo_password,
     'authSource': 'smart-ledger',
-    'db': 'smart-ledger'
+    'db': os.environ.get('MONGO_DB', 'smart-ledger'),
+    'maxPoolSize': mongo_max_pool_size,
+    'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', min(2, mongo_max_pool_size))),
+    'waitQueueTimeoutMS': int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
 }
 
+# count and time the commands of every request, listeners must be registered before the client is created
+# commands slower than SLOW_QUERY_MS are logged with the request log
+slow_query_ms = os.environ.get('SLOW_QUERY_MS')
+monitoring.register(QueryCounter(slow_ms=float(slow_query_ms) if slow_query_ms else None,
+                                 on_slow=lambda record: request_log.log(record, logging.WARNING)))
+
 db = MongoEngine()
 db.init_app(app)
 
+# one json line per request, REQUEST_LOG_SAMPLE is the fraction of successful requests that are logged
+request_log = RequestLog(app, sample_rate=float(os.environ.get('REQUEST_LOG_SAMPLE', 1.0)))
+
+# per endpoint metrics served on /metrics, QUERY_HEADER adds the query count and time to every response
+metrics = Metrics(app, query_header=bool(os.environ.get('QUERY_HEADER', debug)))
+
+# bearer token of /metrics, the endpoint is disabled without it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# largest difference between what was paid and what was used that is still accepted
+PRICE_TOLERANCE = 0.005
+
+# page sizes of /group/transactions
+TRANSACTION_PAGE_SIZE = 20
+TRANSACTION_PAGE_MAX = 100
+
+# most transactions /transaction/bulk-create accepts in one request
+TRANSACTION_BULK_MAX = int(os.environ.get('TRANSACTION_BULK_MAX', 1000))
+
+# fields of /transaction/update that only change the transaction document, request key -> field
+TRANSACTION_METADATA = {'title': 'title', 'desc': 'desc', 'vendor': 'vendor', 'date': 'date_purchased'}
+
+# random bytes of a group join code
+JOIN_CODE_BYTES = 12
 
-def print_info(func):
+# most ids in one $in query of the bulk group deletion
+DELETE_BATCH_SIZE = 1000
+
+# a read-modify-write that lost the race to another write is retried, backing off from VERSION_BACKOFF seconds
+VERSION_RETRIES = 5
+VERSION_BACKOFF = 0.005
+
+# mongo stores naive utc datetimes
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# receipts are streamed to and from GridFS one chunk at a time (255 KiB is the GridFS chunk size)
+RECEIPT_CHUNK_SIZE = 255 * 1024
+RECEIPT_MAX_SIZE = int(os.environ.get('RECEIPT_MAX_SIZE', 20 * 1024 * 1024))
+
+# recently used catalog items, (name, desc, unit_price) -> item id, so repeat items skip the key lookup
+item_cache = LRUCache(max_size=int(os.environ.get('ITEM_CACHE_SIZE', 10000)))
+
+# settlements of recently settled groups, (group id, version, exact) -> (transfers, mode), every write to a group
+# moves its version on so a cached settlement is never served for a changed ledger
+settlement_cache = LRUCache(max_size=int(os.environ.get('SETTLEMENT_CACHE_SIZE', 1024)))
+
+# receipts are normalized and thumbnailed in the background, a full backlog processes in the request instead
+receipt_pool = WorkerPool(max_workers=receipt_workers,
+                          max_pending=int(os.environ.get('RECEIPT_QUEUE_SIZE', 32)),
+                          name='receipt')
+
+# build any missing index in the background so a slow build never blocks boot
+ensure_indexes_async()
+
+# google signing certificates, GOOGLE_CERTS_FILE allows verifying against a local JWKS file
+cert_store = CertStore(certs_file=os.environ.get('GOOGLE_CERTS_FILE'))
+
+# cache of verified tokens shared by every request handled by this worker
+token_cache = TokenCache(max_size=int(os.environ.get('TOKEN_CACHE_SIZE', 4096)),
+                         person_ttl=float(os.environ.get('TOKEN_CACHE_PERSON_TTL', 5)))
+
+# token cache hit rates on /metrics, claims and persons are looked up and counted separately
+metrics.register('token_cache_lookups_total', 'Token cache lookups by cached value and result.',
+                 lambda: [({'cache': cache, 'result': result}, count)
+                          for cache, counts in token_cache.stats().items() if cache != 'size'
+                          for result, count in counts.items()])
+metrics.register('token_cache_entries', 'Tokens held by the token cache.',
+                 lambda: [({}, token_cache.stats()['size'])], kind='gauge')
+
+
+@app.errorhandler(flask_limiter.errors.RateLimitExceeded)
+def rate_limit_exceeded(_):
     """
-    verify the given token
-    :return: return a dictionary of the persons info from google
+    answer requests over their rate limit with the usual json body
     """
+    return jsonify({'msg': 'Rate limit exceeded.'}), 429
 
-    @wraps(func)
-    def wrap(*args, **kwargs):
-        """
-        wrap the given function
-        """
-        if request.environ.get('HTTP_X_FORWARDED_FOR') is None:
-            ip = request.environ['REMOTE_ADDR']
-        else:
-            ip = request.environ['HTTP_X_FORWARDED_FOR']
-        path = request.path
 
-        print(f"{ip} : {path} : {request} @ {datetime.datetime.now()}")
-        try:
-            ret = func(*args, **kwargs)
-            print(f"    |--> {ret[0].get_json()['msg']} : {ret[1]}")
-            return ret
-        except flask_limiter.errors.RateLimitExceeded as exp:
-            print(f"{ip} : {path} => Exception: {exp} @ {datetime.datetime.now()}")
-            traceback.print_exc()
-            print(f"    |--> Rate limit exceeded. : 429")
-            return jsonify({'msg': 'Rate limit exceeded.'}), 429
-        except Exception as exp:
-            print(f"{ip} : {path} => Exception: {exp} @ {datetime.datetime.now()}")
-            traceback.print_exc()
-            print(f"    |--> An unexpected error occurred. : 500")
-            return jsonify({'msg': 'An unexpected error occurred.'}), 500
+@app.errorhandler(Exception)
+def unexpected_error(exp):
+    """
+    answer any unhandled exception with a 500, the exception is logged with the request
+    """
+    # routing errors (404, 405, ...) keep their status
+    if isinstance(exp, HTTPException):
+        return exp
 
-    return wrap
+    g.request_error = exp
+    return jsonify({'msg': 'An unexpected error occurred.'}), 500
+
+
+@app.route("/metrics", methods=['GET'])
+@limiter.exempt
+def get_metrics():
+    """
+    per endpoint request and MongoDB metrics of this worker in the Prometheus text format
+    :return: the metrics, or 404 without the METRICS_TOKEN bearer token
+    """
+    given = request.headers.get('Authorization', '').encode()
+    if METRICS_TOKEN is None or not hmac.compare_digest(given, f'Bearer {METRICS_TOKEN}'.encode()):
+        return jsonify({'msg': 'Not found.'}), 404
+
+    return Response(metrics.render(pid=os.getpid()), mimetype='text/plain; version=0.0.4')
 
 
 ###############################################################################################################
@@ -104,7 +234,6 @@ def print_info(func):
 # TEST API ENDPOINTS
 
 @app.route("/test_get", methods=['GET'])
-@print_info
 @limiter.limit("10/second", override_defaults=False)
 def test_get():
     """
@@ -115,7 +244,6 @@ def test_get():
 
 
 @app.route("/test_post", methods=['POST'])
-@print_info
 def test_post():
     """
     Just a test route to verify that the API is working.
@@ -171,27 +299,142 @@ def verify_token(func):
         try:
             # Get the token from the authorization header
             token = get_token(request)
+            key = token_cache.key(token)
 
-            # verify the token
-            token_info = id_token.verify_oauth2_token(token, requests.Request(), os.environ['CLIENT_ID'])
+            # verify the token if it has not been verified yet
+            token_info = token_cache.get_claims(key)
+            if token_info is None:
+                token_info = cert_store.verify(token, os.environ['CLIENT_ID'])
+                token_cache.put_claims(key, token_info)
 
             # verify the subject
             sub = token_info['sub']
+            g.sub = sub
 
             # get the person
-            person = Person.objects.get(sub=sub)
-
-            # call the wrapped function
-            return func(person, *args, **kwargs)
+            person = token_cache.get_person(key, Person)
+            if person is None:
+                person = Person.objects.get(sub=sub)
+                token_cache.put_person(key, person)
 
         except Exception as exp:
             # Invalid token
-            print(f"verify_token() => Exception: {exp} @ {datetime.datetime.now()}")
+            g.auth_error = repr(exp)
             return jsonify({'msg': 'Token is unauthorized or user does not exist.'}), 404
 
+        # call the wrapped function, its errors are answered by unexpected_error
+        return func(person, *args, **kwargs)
+
     return wrap
 
 
+###############################################################################################################
+###############################################################################################################
+###############################################################################################################
+## VERSIONING
+
+
+def _etag(document, variant=''):
+    """
+    helper to get the entity tag of a Group or Transaction, it changes with every write of the document
+    :param document: the versioned document
+    :param variant: distinguishes representations of the same version (e.g. what a non-member sees)
+    :return: the unquoted entity tag
+    """
+    return f'{document.id}-{document.version or 0}{variant}'
+
+
+def _versioned(response, document, variant=''):
+    """
+    helper to set the entity tag of a document on a response
+    :return: the response
+    """
+    response.set_etag(_etag(document, variant))
+    return response
+
+
+def _not_modified(document, variant=''):
+    """
+    helper to answer a request whose If-None-Match still matches the document
+    :return: a 304 response, None if the client's copy is outdated or it sent no If-None-Match
+    """
+    if not request.if_none_match.contains_weak(_etag(document, variant)):
+        return None
+    return _versioned(Response(status=304), document, variant)
+
+
+def _precondition_failed(document):
+    """
+    helper to check the If-Match header of a write against the stored version of a document
+    :return: a 412 response with the current entity tag, None if the write can go ahead
+    """
+    # the tags of /group/info carry a suffix for the member names, only the version has to match
+    current = _etag(document)
+    if not request.if_match or request.if_match.star_tag or any(
+            tag == current or tag.startswith(f'{current}-') for tag in request.if_match.as_set()):
+        return None
+    response = jsonify({'msg': 'Precondition failed, the document was modified.'})
+    return _versioned(response, document), 412
+
+
+def _version_condition(version):
+    """
+    helper to get the filter matching a document still at the given version
+    :return: mongoengine query dictionary
+    """
+    # documents written before versioning have no version field
+    return {'version__in': [0, None]} if not version else {'version': version}
+
+
+def _save_versioned(document):
+    """
+    helper to save the changes made to a loaded document only if nobody wrote it since it was loaded
+    :param document: Group or Transaction loaded from the db and changed in memory
+    :return: True if saved, False if another write came first (the document must be reloaded)
+    """
+    version = document.version or 0
+    document.version = version + 1
+    try:
+        document.save(save_condition=_version_condition(version))
+        return True
+    except SaveConditionError:
+        document.version = version
+        return False
+
+
+def _backoff(attempt):
+    """
+    helper to wait before retrying a write that lost a race, exponential with full jitter
+    :param attempt: number of the failed attempt, starting at 0
+    """
+    time.sleep(random.uniform(0, VERSION_BACKOFF * 2 ** attempt))
+
+
+def _update_group_versioned(query, change):
+    """
+    helper to run a read-modify-write on a group, retried with backoff while other writes come first
+    the If-Match header of the request is checked against every loaded version
+    :param query: filter of the group, e.g. {'id': group_id}
+    :param change: function changing the group in memory, returns a response tuple to abort without saving
+    :return: tuple of (saved group or None, response tuple to return instead or None)
+    """
+    for attempt in range(VERSION_RETRIES):
+        group = Group.objects(**query).first()
+        if group is None:
+            return None, (jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404)
+
+        # the version is only revealed to people allowed to change the group
+        failed = change(group) or _precondition_failed(group)
+        if failed is not None:
+            return None, failed
+
+        if _save_versioned(group):
+            return group, None
+        _backoff(attempt)
+
+    return None, (jsonify({'msg': 'The group is being modified, try again.'}), 409)
+
+
 ###############################################################################################################
 ###############################################################################################################
 ###############################################################################################################
@@ -199,7 +442,6 @@ def verify_token(func):
 
 
 @app.route('/register', methods=['POST'])
-@print_info
 def register():
     """
     used for logging in a user. creates an account if not already exists
@@ -207,9 +449,8 @@ def register():
     """
     token = get_token(request)
     # verify the token
-    token_info = id_token.verify_oauth2_token(
+    token_info = cert_store.verify(
         token,
-        requests.Request(),
         os.environ['CLIENT_ID'],
         clock_skew_in_seconds=5
     )
@@ -244,6 +485,7 @@ def register():
     # save the person object
     person.date.last_login = datetime.datetime.now(datetime.timezone.utc)
     person.save()
+    token_cache.invalidate(person.sub)
 
     # return status message
     return jsonify({'msg': 'User successfully retrieved.', 'data': person}), status_code
@@ -251,7 +493,6 @@ def register():
 
 @app.route('/user/info', methods=['POST'])
 @verify_token
-@print_info
 def user_profile(person):
     """
     get a persons profile information.
@@ -291,7 +532,6 @@ def user_profile(person):
 
 @app.route('/user/update', methods=['POST'])
 @verify_token
-@print_info
 def update_profile(person):
     """
     modify a users profile
@@ -328,12 +568,12 @@ def update_profile(person):
     # save the person
     person.date.updated = datetime.datetime.now(datetime.timezone.utc)
     person.save()
+    token_cache.invalidate(person.sub)
     return jsonify({'msg': 'Successfully updated the user profile.'}), 200
 
 
 @app.route('/user/delete', methods=['POST'])
 @verify_token
-@print_info
 def delete_profile(person):
     """
     delete a users profile
@@ -355,6 +595,7 @@ def delete_profile(person):
 
     # delete the person from the database
     person.delete()
+    token_cache.invalidate(person.sub)
     return jsonify({'msg': 'Successfully deleted the user profile.'}), 200
 
 
@@ -368,7 +609,6 @@ def delete_profile(person):
 
 @app.route('/group/create', methods=['POST'])
 @verify_token
-@print_info
 def create_group(person):
     """
     Create a group add the creator to the group
@@ -391,6 +631,8 @@ def create_group(person):
     group_name = data['name']
     group_desc = data.get('desc')
     invite = data.get('invites')
+    if invite is not None and not _valid_emails(invite):
+        return jsonify({'msg': 'Missing Required Field(s) / Invalid Type(s).'}), 400
 
     # create the group
     group = Group(name=group_name, desc=group_desc, admin=person.sub)
@@ -398,49 +640,31 @@ def create_group(person):
     # add the creating user to the group
     group.members.append(person.sub)
 
-    # add admin to the balances dict
-    group.restricted.balances[person.sub] = {}
-
     # add admin to ledger
     group.restricted.ledger[person.sub] = 0
 
+    # the group is saved with its invite list, the invitees are linked once it has an id
+    results, invited = _invite_results(group, invite or [])
+    group.restricted.invite_list.extend(invited)
+
     # save the group
     group.save()
+    _link_invites(group, invited)
 
-    # add the groups id to the persons list of groups
-    person.groups.append(group.id)
-
-    # save the person object
-    person.date.updated = datetime.datetime.now(datetime.timezone.utc)
-    person.save()
-
-    if invite is not None:
-        if not isinstance(invite, list):
-            return jsonify({'msg': 'Missing Required Field(s) / Invalid Type(s).'}), 400
-        for email in invite:
-            group.restricted.invite_list.append(email)
-
-            # save the invite in the person
-            p = Person.objects(email=email)
-            if len(p) == 0:
-                continue
-            p = p.first()
-            if group.id not in p.invites:
-                p.invites.append(group.id)
-            p.date.updated = datetime.datetime.now(datetime.timezone.utc)
-            p.save()
+    # add the groups id to the persons list of groups, atomically since the cached person may miss links added
+    # by other workers
+    Person.objects(sub=person.sub).update_one(add_to_set__groups=group.id,
+                                              set__date__updated=datetime.datetime.now(datetime.timezone.utc))
+    token_cache.invalidate(person.sub)
 
-    # save the group
-    group.save()
-    return jsonify({'msg': 'Group successfully created.', 'data': group}), 200
+    return jsonify({'msg': 'Group successfully created.', 'data': group, 'invites': results}), 200
 
 
 @app.route('/group/delete', methods=['POST'])
 @verify_token
-@print_info
 def delete_group(person):
     """
-    Create a group add the creator to the group
+    Delete a group with its transactions and unlink its members
     request must contain:
         - token
         - id: group id
@@ -457,35 +681,105 @@ def delete_group(person):
 
     group = group.first()
 
-    # Iterate through people and unlink them from the groups
-    for p_sub in group.members:
+    # drop the group first so nothing new is attached to it while its contents are deleted
+    group.delete()
 
-        # try to get the person from the DB
-        person = Person.objects(sub=p_sub)
-        if len(person) == 0:
-            continue
-        person = person.first()
+    # unlink the members and the invitees at once
+    now = datetime.datetime.now(datetime.timezone.utc)
+    Person.objects(sub__in=group.members).update(pull__groups=group.id, set__date__updated=now)
+    Person.objects(invites=group.id).update(pull__invites=group.id)
+    for sub in group.members:
+        token_cache.invalidate(sub)
 
-        # try to remove person from group
-        person.groups.remove(ObjectId(group_id))
-        person.date.updated = datetime.datetime.now(datetime.timezone.utc)
-        person.save()
+    # delete the transactions and release their items and receipts in bulk
+    deleted = _delete_group_transactions(group.id)
+
+    return jsonify({'msg': 'Group successfully deleted.', 'transactions': deleted}), 200
+
+
+def _delete_group_transactions(group_id):
+    """
+    helper to delete every transaction of a group, the item usages and receipt references they held are
+    counted by aggregation and released with one update per distinct count instead of one per transaction
+    :param group_id: id of the group
+    :return: number of deleted transactions
+    """
+    collection = Transaction._get_collection()
+    item_counts = {r['_id']: r['count'] for r in collection.aggregate([
+        {'$match': {'group': group_id}},
+        {'$unwind': '$items'},
+        {'$group': {'_id': '$items.item_id', 'count': {'$sum': 1}}}
+    ])}
+    receipt_counts = {r['_id']: r['count'] for r in collection.aggregate([
+        {'$match': {'group': group_id, 'receipt': {'$ne': None}}},
+        {'$group': {'_id': '$receipt', 'count': {'$sum': 1}}}
+    ])}
+
+    deleted = collection.delete_many({'group': group_id}).deleted_count
+
+    # item ids are stored as strings in the transactions
+    _release_counts(Item._get_collection(), 'usage_count',
+                    {ObjectId(i): c for i, c in item_counts.items() if ObjectId.is_valid(i)})
+    released = _release_counts(Receipt._get_collection(), 'refs', receipt_counts,
+                               projection={'receipt': 1, 'thumbnails': 1})
+
+    # files of the receipts that were deleted
+    images = [r['receipt'] for r in released if r.get('receipt') is not None]
+    thumbnails = [t for r in released for t in (r.get('thumbnails') or {}).values()]
+    _delete_grid_files(Receipt.receipt.collection_name, images)
+    _delete_grid_files('thumbnails', thumbnails)
+    return deleted
+
+
+def _release_counts(collection, field, counts, projection=None):
+    """
+    helper to decrement a usage counter of many documents and delete the ones no longer used
+    :param collection: pymongo collection
+    :param field: name of the counter
+    :param counts: dictionary of document id -> amount to decrement
+    :param projection: fields of the deleted documents to return
+    :return: list of the deleted documents (with the projection) if a projection is given
+    """
+    by_count = {}
+    for _id, count in counts.items():
+        by_count.setdefault(count, []).append(_id)
+
+    deleted = []
+    for count, ids in by_count.items():
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            batch = ids[start:start + DELETE_BATCH_SIZE]
+            collection.update_many({'_id': {'$in': batch}}, {'$inc': {field: -count}})
+
+            unused = {'_id': {'$in': batch}, field: {'$lte': 0}}
+            if projection is None:
+                collection.delete_many(unused)
+                continue
+
+            # only documents nothing linked to again between the read and the delete are reported
+            candidates = list(collection.find(unused, projection))
+            if candidates:
+                candidate_ids = [c['_id'] for c in candidates]
+                collection.delete_many({'_id': {'$in': candidate_ids}, field: {'$lte': 0}})
+                kept = {d['_id'] for d in collection.find({'_id': {'$in': candidate_ids}}, {'_id': 1})}
+                deleted.extend(c for c in candidates if c['_id'] not in kept)
+    return deleted
 
-    # iterate through transactions and items to decrement the item counts. waiting on items to be implemented
-    for t_id in group.restricted.transactions:
-        # try to get the transaction
-        transaction = Transaction.objects(id=t_id)
-        if len(transaction) == 0:
-            continue
-        transaction = transaction.first()
-        _delete_transaction(group, transaction)
 
-    return jsonify({'msg': 'Group successfully deleted.'}), 200
+def _delete_grid_files(collection, file_ids):
+    """
+    helper to delete many GridFS files with one delete per collection instead of one per file
+    :param collection: name of the GridFS collection
+    :param file_ids: ids of the files
+    """
+    db = Receipt._get_db()
+    for start in range(0, len(file_ids), DELETE_BATCH_SIZE):
+        batch = file_ids[start:start + DELETE_BATCH_SIZE]
+        db[f'{collection}.files'].delete_many({'_id': {'$in': batch}})
+        db[f'{collection}.chunks'].delete_many({'files_id': {'$in': batch}})
 
 
 @app.route('/group/info', methods=['POST'])
 @verify_token
-@print_info
 def get_group(person):
     """
     Return a group the user is in
@@ -505,33 +799,165 @@ def get_group(person):
     # get the group
     group = Group.objects.get(id=group_id)
 
+    # the member names come from the people, the entity tag covers them next to the group's version
+    members = _resolve_members(group.members)
+    names = hashlib.sha256(json.dumps(members, separators=(',', ':')).encode()).hexdigest()[:16]
+
+    # non-members get the group without its restricted part, under their own entity tag
+    variant = f'-{names}' if person.sub in group.members else f'-{names}-public'
+    not_modified = _not_modified(group, variant)
+    if not_modified is not None:
+        return not_modified
+
     # check if user is in group
     if person.sub not in group.members:
         group.restricted = None
 
-    group = group.to_mongo().to_dict()
+    data = group.to_mongo().to_dict()
 
-    members = []
-    for m in group['members']:
+    data['members'] = members
+    data['_id'] = {'$oid': str(data['_id'])}
+    # return the group
+    return _versioned(jsonify({'msg': 'Group successfully retrieved.', 'data': data}), group, variant), 200
+
+
+@app.route('/group/transactions', methods=['POST'])
+@verify_token
+def get_group_transactions(person):
+    """
+    Return a page of a group's transactions, newest purchase first
+    request must contain:
+        - token
+        - id: group id
+        - cursor: [optional] the `next` value of the previous page
+        - limit: [optional] page size
+    :param person: the person making the request
+    :return: returns json with the transactions and the cursor of the next page
+    """
+    # get the request data
+    request_data = request.get_json(force=True, silent=True)
+    group_id = request_data.get('id')
+    cursor = request_data.get('cursor')
+    limit = request_data.get('limit', TRANSACTION_PAGE_SIZE)
+
+    if group_id is None or not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        return jsonify({'msg': 'Missing Required Field(s) / Invalid Type(s).'}), 400
+    limit = min(limit, TRANSACTION_PAGE_MAX)
+
+    # get the group
+    group = Group.objects(id=group_id).only('members').first()
+
+    # check if user is in group
+    if group is None or person.sub not in group.members:
+        return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
+
+    # continue after the last transaction of the previous page
+    query = {'group': group.id}
+    if cursor is not None:
         try:
-            p = Person.objects.get(sub=m)
-            p = {
-                'sub': p.sub,
-                'first_name': p.first_name,
-                'last_name': p.last_name
-            }
-            members.append(p)
-        except:
+            date, last_id = _decode_cursor(cursor)
+        except (TypeError, ValueError, OverflowError):
+            return jsonify({'msg': 'Missing Required Field(s) / Invalid Type(s).'}), 400
+        query['$or'] = [
+            {'date_purchased': {'$lt': date}},
+            {'date_purchased': date, '_id': {'$lt': last_id}}
+        ]
+
+    # fetch one extra transaction to know if there is a next page
+    transactions = list(Transaction.objects(__raw__=query).order_by('-date_purchased', '-id').limit(limit + 1))
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = _encode_cursor(transactions[-1])
+
+    return jsonify({'msg': 'Transactions successfully retrieved.', 'data': transactions, 'next': next_cursor}), 200
+
+
+@app.route('/group/settle', methods=['POST'])
+@verify_token
+def settle_group(person):
+    """
+    Return the transfers that settle every balance of a group
+    request must contain:
+        - token
+        - id: group id
+        - exact: [optional] search for the minimum number of transfers (small groups only)
+    :param person: the person making the request
+    :return: returns json with the list of transfers
+    """
+    # get the request data
+    request_data = request.get_json(force=True, silent=True)
+    group_id = request_data.get('id')
+    exact = request_data.get('exact', False)
+
+    if group_id is None or not isinstance(exact, bool):
+        return jsonify({'msg': 'Missing Required Field(s) / Invalid Type(s).'}), 400
+
+    # the version is enough to find a cached settlement, the ledger is only loaded to compute a new one
+    group = Group.objects(id=group_id).only('members', 'version').first()
+
+    # check if user is in group
+    if group is None or person.sub not in group.members:
+        return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
+
+    settlement = settlement_cache.get((group.id, group.version or 0, exact))
+    if settlement is None:
+        # the ledger and the version it is cached under are read together
+        group = Group.objects(id=group.id).only('restricted.ledger', 'version').first()
+        if group is None:
+            return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
+        settlement = Settlement.settle(group.restricted.ledger, exact=exact)
+        settlement_cache.put((group.id, group.version or 0, exact), settlement)
+
+    transfers, mode = settlement
+    return jsonify({'msg': 'Settlement successfully computed.', 'data': transfers, 'mode': mode}), 200
+
+
+def _encode_cursor(transaction):
+    """
+    helper to build the opaque pagination cursor pointing after a transaction
+    """
+    millis = int((transaction.date_purchased - EPOCH).total_seconds() * 1000)
+    return base64.urlsafe_b64encode(f'{millis}:{transaction.id}'.encode('utf-8')).decode('utf-8')
+
+
+def _decode_cursor(cursor):
+    """
+    helper to read a pagination cursor
+    :return: tuple of (date_purchased, transaction id)
+    """
+    if not isinstance(cursor, str):
+        raise ValueError('Invalid cursor.')
+    millis, last_id = base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8').split(':')
+    if not ObjectId.is_valid(last_id):
+        raise ValueError('Invalid cursor.')
+    return EPOCH + datetime.timedelta(milliseconds=int(millis)), ObjectId(last_id)
+
+
+def _resolve_members(subs):
+    """
+    helper to resolve member subs to their public names with a single query
+    :param subs: list of member subs
+    :return: list of member dictionaries in the same order, subs that no longer exist are dropped
+    """
+    people = Person.objects(sub__in=subs).only('sub', 'first_name', 'last_name').as_pymongo()
+    people = {p['sub']: p for p in people}
+
+    members = []
+    for m in subs:
+        p = people.get(m)
+        if p is None:
             continue
-    group['members'] = members
-    group['_id'] = {'$oid': str(group['_id'])}
-    # return the group
-    return jsonify({'msg': 'Group successfully retrieved.', 'data': group}), 200
+        members.append({
+            'sub': p['sub'],
+            'first_name': p['first_name'],
+            'last_name': p['last_name']
+        })
+    return members
 
 
 @app.route('/group/update', methods=['POST'])
 @verify_token
-@print_info
 def update_group(person):
     """
     Return a group the user is in
@@ -551,40 +977,37 @@ def update_group(person):
     if group_id is None:
         return jsonify({'msg': 'Missing Required Field(s) / Invalid Type(s).'}), 400
 
-    # get the group
-    group = Group.objects(id=group_id)
-    if len(group) == 0:
-        return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
-    group = group.first()
-
-    # check if user is in group
-    if person.sub not in group.members:
-        return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
-
     # weed out bad fields
-    if not set(data.keys()).intersection({'name', 'description', 'restricted'}):
+    if not isinstance(data, dict) or not set(data.keys()).intersection({'name', 'description', 'restricted'}):
         return jsonify({'msg': 'Missing Required Field(s) / Invalid Type(s).'}), 400
 
-    # iterate through all items
-    for k, v in data.items():
-        # if is join code check if authorized
-        if k == 'restricted':
-            for k2, v2 in v.items():
-                if k2 == 'permissions':
-                    if person.sub != group.admin:
-                        return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
-                    for k3, v3 in v2.items():
-                        group[k][k2][k3] = v3
-        else:
-            group[k] = v
-
-    group.restricted.date.update = datetime.datetime.now(datetime.timezone.utc)
-
-    # save the group
-    group.save()
+    def change(group):
+        # check if user is in group
+        if person.sub not in group.members:
+            return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
+
+        # iterate through all items
+        for k, v in data.items():
+            # if is join code check if authorized
+            if k == 'restricted':
+                for k2, v2 in v.items():
+                    if k2 == 'permissions':
+                        if person.sub != group.admin:
+                            return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
+                        for k3, v3 in v2.items():
+                            group[k][k2][k3] = v3
+            else:
+                group[k] = v
+
+        group.restricted.date.update = datetime.datetime.now(datetime.timezone.utc)
+
+    # save the group only if it was not written since it was loaded
+    group, failed = _update_group_versioned({'id': group_id}, change)
+    if failed is not None:
+        return failed
 
     # return the group
-    return jsonify({'msg': 'Group successfully updated.'}), 200
+    return _versioned(jsonify({'msg': 'Group successfully updated.'}), group), 200
 
 
 ###############################################################################################################
@@ -593,63 +1016,67 @@ def update_group(person):
 
 @app.route('/group/join', methods=['POST'])
 @verify_token
-@print_info
 def join_group(person):
     """
     Add a member to the group
     request must contain:
         - token
-        - id: group id
+        - code: join code of the group, or
+        - id: group id (only for invited people once the group has a join code)
     :param person: the person making the request
     """
     # get the request data
     request_data = request.get_json(force=True, silent=True)
     group_id = request_data.get('id')
+    code = request_data.get('code')
 
-    # query the group
-    group = Group.objects(id=group_id)
+    # a code that is not a string could be a query operator
+    if code is not None and (not isinstance(code, str) or not code):
+        return jsonify({'msg': 'Missing Required Field(s) / Invalid Type(s).'}), 400
 
-    if len(group) == 0:
+    # query the group by its join code, or by its id
+    if code is not None:
+        query = {'restricted__join_code': code}
+    elif ObjectId.is_valid(group_id):
+        query = {'id': group_id}
+    else:
         return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
-    group = group.first()
-
-    # check if already a member
-    if person.sub in group.members:
-        return jsonify({'msg': 'User is already a member of the group.'}), 409
 
-    if person.email in group.restricted.invite_list:
-        group.restricted.invite_list.remove(person.email)
+    def change(group):
+        # once a join code was issued the group id only admits invited people
+        if (code is None and group.restricted.join_code is not None
+                and person.email not in group.restricted.invite_list):
+            return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
 
-    # add person to group
-    group.members.append(person.sub)
-    group.updated = datetime.datetime.now(datetime.timezone.utc)
+        # check if already a member
+        if person.sub in group.members:
+            return jsonify({'msg': 'User is already a member of the group.'}), 409
 
-    # add person to the balances dict
-    group.restricted.balances[person.sub] = {}
-    for p in group.members:
-        if p != person.sub:
-            group.restricted.balances[person.sub][p] = 0
-            group.restricted.balances[p][person.sub] = 0
+        if person.email in group.restricted.invite_list:
+            group.restricted.invite_list.remove(person.email)
 
-    # add person to ledger
-    group.restricted.ledger[person.sub] = 0
+        # add person to group
+        group.members.append(person.sub)
+        group.updated = datetime.datetime.now(datetime.timezone.utc)
 
-    # save group
-    group.save()
+        # add person to ledger
+        group.restricted.ledger[person.sub] = 0
 
-    # link group to member
-    person.groups.append(group.id)
+    # save group, a concurrent join or update makes it start over from the stored group
+    group, failed = _update_group_versioned(query, change)
+    if failed is not None:
+        return failed
 
-    # save person
-    person.date.updated = datetime.datetime.now(datetime.timezone.utc)
-    person.save()
+    # link group to member and drop the invite, atomically since the cached person may be outdated
+    Person.objects(sub=person.sub).update_one(add_to_set__groups=group.id, pull__invites=group.id,
+                                              set__date__updated=datetime.datetime.now(datetime.timezone.utc))
+    token_cache.invalidate(person.sub)
 
     return jsonify({'msg': 'User joined group.'}), 200
 
 
 @app.route('/group/invite', methods=['POST'])
 @verify_token
-@print_info
 def invite_group(person):
     """
     invite a member to the group
@@ -673,37 +1100,71 @@ def invite_group(person):
     if group.restricted.permissions.only_admin_invite and person.sub != group.admin:
         return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
 
-    for email in emails:
-        # check if already invited
-        if email in group.restricted.invite_list:
-            return jsonify({'msg': 'User is already a invited.'}), 409
-
-        # check if already in the group
-        for sub in group.members:
-            p = Person.objects.get(sub=sub)
-            if p.email == email:
-                continue
+    if not _valid_emails(emails):
+        return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
 
-        # add person to group invite list
-        group.restricted.invite_list.append(email)
+    results, invited = _invite_results(group, emails)
+    if not invited:
+        return jsonify({'msg': 'Every email is already invited or a member.', 'invites': results}), 409
 
-        # if person exists in the db add this to their invites
-        p = Person.objects(email=email)
-        if len(p) != 0:
-            p = p.first()
-            if group.id not in p.invites:
-                p.invites.append(group.id)
-                p.save()
+    # add every new email to the invite list at once, concurrent invites are merged by $addToSet
+    now = datetime.datetime.now(datetime.timezone.utc)
+    Group.objects(id=group.id).update_one(add_to_set__restricted__invite_list=invited,
+                                          set__restricted__date__updated=now, inc__version=1)
+    _link_invites(group, invited)
+    return jsonify({'msg': 'Invitation(s) successfully created.', 'invites': results}), 200
 
-    # save group
-    group.restricted.date.updated = datetime.datetime.now(datetime.timezone.utc)
-    group.save()
-    return jsonify({'msg': 'Invitation(s) successfully created.'}), 200
+
+def _valid_emails(emails):
+    """
+    helper to check that an invite request holds a list of email strings
+    """
+    return isinstance(emails, list) and all(isinstance(email, str) and email for email in emails)
+
+
+def _invite_results(group, emails):
+    """
+    helper to decide which emails can be invited to a group, members are resolved with a single query
+    :param group: the group the emails are invited to
+    :param emails: list of email strings
+    :return: tuple of (dictionary of email -> 'invited' / 'already_invited' / 'member', emails to invite)
+    """
+    member_emails = set()
+    if group.members:
+        member_emails = {p['email'] for p in Person.objects(sub__in=group.members).only('email').as_pymongo()}
+    invite_list = set(group.restricted.invite_list)
+
+    results, invited = {}, []
+    for email in emails:
+        if email in results:
+            continue
+        if email in member_emails:
+            results[email] = 'member'
+        elif email in invite_list:
+            results[email] = 'already_invited'
+        else:
+            results[email] = 'invited'
+            invited.append(email)
+    return results, invited
+
+
+def _link_invites(group, emails):
+    """
+    helper to add a group to the invites of every registered person among the emails with a single update
+    :param group: the saved group
+    :param emails: list of invited emails
+    """
+    if not emails:
+        return
+    people = Person.objects(email__in=emails)
+    subs = [p['sub'] for p in people.only('sub').as_pymongo()]
+    people.update(add_to_set__invites=group.id, set__date__updated=datetime.datetime.now(datetime.timezone.utc))
+    for sub in subs:
+        token_cache.invalidate(sub)
 
 
 @app.route('/group/remove-member', methods=['POST'])
 @verify_token
-@print_info
 def remove_member(person):
     """
     Add a member to the group
@@ -718,50 +1179,44 @@ def remove_member(person):
     group_id = request_data.get('id')
     sub = request_data.get('userid')
 
-    # query the group
-    group = Group.objects(id=group_id)
-    if len(group) == 0:
-        return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
-    group = group.first()
-
-    # if the user is trying to delete another user in the group
+    # if person is trying to delete themselves from the group
+    removes_other = sub is not None
     if sub is None:
-        # if person is trying to delete themselves from the group
         sub = person.sub
 
-    elif (group.settings.only_admin_remove_user and group.admin != person.sub) or sub == group.admin:
-        return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
-
-    # check if the given sub is not in group
-    if sub not in group.members:
-        return jsonify({'msg': 'User is not a member of the group.'}), 409
+    def change(group):
+        # if the user is trying to delete another user in the group
+        if removes_other and ((group.restricted.permissions.only_admin_remove_user and group.admin != person.sub)
+                              or sub == group.admin):
+            return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
 
-    # remove the person from the group
-    group.members.remove(sub)
+        # check if the given sub is not in group
+        if sub not in group.members:
+            return jsonify({'msg': 'User is not a member of the group.'}), 409
 
-    # save the group
-    group.updated = datetime.datetime.now(datetime.timezone.utc)
-    group.save()
+        # remove the person from the group
+        group.members.remove(sub)
+        group.restricted.date.updated = datetime.datetime.now(datetime.timezone.utc)
 
-    # if group is tied to person object
-    if group_id in person.groups:
-        # remove group from person
-        person.groups.remove(group_id)
+    # save the group only if it was not written since it was loaded
+    group, failed = _update_group_versioned({'id': group_id}, change)
+    if failed is not None:
+        return failed
 
-        # save person
-        person.date.updated = datetime.datetime.now(datetime.timezone.utc)
-        person.save()
+    # unlink the group from the removed member, atomically since cached people may be outdated
+    Person.objects(sub=sub).update_one(pull__groups=group.id,
+                                       set__date__updated=datetime.datetime.now(datetime.timezone.utc))
+    token_cache.invalidate(sub)
 
     return jsonify({'msg': 'Member successfully removed.'}), 200
 
 
 @app.route('/group/refresh-id', methods=['POST'])
 @verify_token
-@print_info
 @limiter.limit("1/second", override_defaults=False)
 def refresh_id(person):
     """
-    refreshes the group id
+    rotates the code new members join the group with, the previous code (or the group id) stops admitting people
     request must contain:
         - token
         - id: group id
@@ -781,34 +1236,14 @@ def refresh_id(person):
     if person.sub != group.admin:
         return jsonify({'msg': 'Token is unauthorized or group does not exist.'}), 404
 
-    old_group = group
-    group = deepcopy(old_group)
-    group.id = None
-
-    # update times
-    time = datetime.datetime.now(datetime.timezone.utc)
-    group.updated = time
-    group.last_refreshed = time
+    # the group keeps its id, only the join code shared with new members is replaced
+    code = secrets.token_urlsafe(JOIN_CODE_BYTES)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    Group.objects(id=group.id).update_one(set__restricted__join_code=code,
+                                          set__restricted__date__last_refreshed=now,
+                                          set__restricted__date__updated=now, inc__version=1)
 
-    # save the group
-    group.save()
-
-    # update all people in the group
-    for p in group.members:
-        person = Person.objects.get(sub=p)
-        person.groups.remove(old_group.id)
-        person.groups.append(group.id)
-        person.save()
-
-    # update all transactions in the group
-    for t in group.restricted.transactions:
-        transac = Transaction.objects.get(id=t)
-        transac.group = group.id
-        transac.save()
-
-    # delete the old group
-    old_group.delete()
-    return jsonify({'msg': "Group's unique identifier successfully refreshed.", 'id': str(group.id)}), 200
+    return jsonify({'msg': "Group's unique identifier successfully refreshed.", 'id': str(group.id), 'code': code}), 200
 
 
 ###############################################################################################################
@@ -819,7 +1254,6 @@ def refresh_id(person):
 
 @app.route('/transaction/create', methods=['POST'])
 @verify_token
-@print_info
 def create_transaction(person):
     """
     Create a transaction in the group
@@ -838,18 +1272,9 @@ def create_transaction(person):
     # get the request data
     request_data = request.get_json(force=True, silent=True)
     group_id = request_data.get('id')
-    title = request_data.get('title')
-    desc = request_data.get('desc')
-    vendor = request_data.get('vendor')
-    who_paid = request_data.get('who_paid')
-    date = request_data.get('date')
-    items = request_data.get('items')
-
-    if group_id is None or title is None or items is None:
-        return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
 
-    if date is None:
-        date = datetime.datetime.now(datetime.timezone.utc)
+    if group_id is None:
+        return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
 
     # query the group to make sure it exists
     group = Group.objects.get(id=group_id)
@@ -858,251 +1283,411 @@ def create_transaction(person):
     if person.sub not in group.members:
         return jsonify({'msg': 'Token is unauthorized.'}), 404
 
-    # can't calculate who_paid later on
-    if items is None and who_paid is None:
+    # validate the whole request before anything is written
+    built = _build_transaction(person, group, request_data)
+    if built is None:
         return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
+    transaction, items = built
 
-    # create the transaction
-    transaction = Transaction(title=title,
-                              group=group_id,
-                              desc=desc,
-                              vendor=vendor,
-                              created_by=person.sub,
-                              modified_by=person.sub,
-                              date_purchased=date,
-                              who_paid=who_paid)
+    # upsert the items and link them to the transaction
+    _link_items(transaction, items, _upsert_items(items))
 
-    # save the transaction
+    # create the transaction with a single insert
     transaction.save()
 
-    # init transaction deltas
-    balance_deltas = {}
-    for p1 in group.members:
-        balance_deltas[p1] = {}
-        for p2 in group.members:
-            if p1 != p2:
-                balance_deltas[p1][p2] = 0
-    transaction.balance_deltas = balance_deltas
-    transaction.save()
+    # atomically add the deltas to the group
+    _update_group_balances(group.id, Ledger.inc_spec(transaction.ledger_deltas, transaction.balance_deltas))
+    return jsonify({'id': str(transaction.id), 'msg': 'Transaction Created Successfully.'}), 200
 
-    # init the ledger deltas
-    for p in group.members:
-        if p in who_paid:
-            transaction.ledger_deltas[p] = who_paid[p]
-        else:
-            transaction.ledger_deltas[p] = 0
-    transaction.save()
 
-    # add all give items
-    total_used = 0
-    if items is not None:
+@app.route('/transaction/bulk-create', methods=['POST'])
+@verify_token
+@limiter.limit("10/minute", override_defaults=False)
+def bulk_create_transactions(person):
+    """
+    Create many transactions in a group at once
+    request must contain either a json body:
+        - id: group id
+        - transactions: array of transactions in the /transaction/create format (without id)
+        - atomic: [optional] create nothing if any transaction is invalid, defaults to false
+    or an application/x-ndjson body with one transaction per line and `id` / `atomic` as query strings
+    :param person: the person making the request
+    :return: returns the result of every transaction, in order
+    """
+    # get the request data
+    if request.mimetype == 'application/x-ndjson':
+        group_id = request.args.get('id')
+        atomic = request.args.get('atomic', 'false').lower() == 'true'
+        rows = _read_ndjson(request.stream, TRANSACTION_BULK_MAX + 1)
+    else:
+        request_data = request.get_json(force=True, silent=True) or {}
+        group_id = request_data.get('id')
+        atomic = request_data.get('atomic', False)
+        rows = request_data.get('transactions')
+
+    if group_id is None or not isinstance(rows, list) or not rows or not isinstance(atomic, bool):
+        return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
+
+    if len(rows) > TRANSACTION_BULK_MAX:
+        return jsonify({'msg': f'At most {TRANSACTION_BULK_MAX} transactions can be created at once.'}), 413
+
+    # query the group to make sure it exists
+    group = Group.objects.get(id=group_id)
+
+    # make sure the user belongs to the group
+    if person.sub not in group.members:
+        return jsonify({'msg': 'Token is unauthorized.'}), 404
+
+    # validate every row before anything is written
+    results, built = [], []
+    for row, data in enumerate(rows):
+        transaction = _build_transaction(person, group, data) if isinstance(data, dict) else None
+        if transaction is None:
+            results.append({'row': row, 'status': 400, 'msg': 'Missing required field(s) or invalid type(s).'})
+        else:
+            results.append({'row': row, 'status': 200})
+            built.append((row, *transaction))
+
+    failed = len(rows) - len(built)
+    if not built or (atomic and failed):
+        return jsonify({'msg': 'No transaction was created.', 'data': results, 'created': 0, 'failed': failed}), 400
+
+    # upsert the items of every transaction in one bulk write
+    item_ids = _upsert_items([item for _, _, items in built for item in items])
+    for _, transaction, items in built:
+        _link_items(transaction, items, item_ids)
+
+    # create every transaction with a single insert_many, the ids are set first to find the ones written on failure
+    for _, transaction, _ in built:
+        transaction.id = ObjectId()
+    ids = [transaction.id for _, transaction, _ in built]
+    collection = Transaction._get_collection()
+    try:
+        collection.insert_many([transaction.to_mongo() for _, transaction, _ in built], ordered=False)
+        inserted = set(ids)
+    except PyMongoError:
+        inserted = {t['_id'] for t in collection.find({'_id': {'$in': ids}}, {'_id': 1})}
+        if atomic:
+            collection.delete_many({'_id': {'$in': list(inserted)}})
+            inserted = set()
+
+    # release the item usages of the transactions that were not written, only the others reach the group
+    counts, inc = {}, {}
+    for row, transaction, items in built:
+        if transaction.id in inserted:
+            results[row]['id'] = str(transaction.id)
+            inc = Ledger.inc_spec(transaction.ledger_deltas, transaction.balance_deltas, spec=inc)
+            continue
+        results[row] = {'row': row, 'status': 500, 'msg': 'Transaction could not be created.'}
         for item in items:
-            person_id = item.get('owed_by')
+            item_id = item_ids[_item_key(item)]
+            counts[item_id] = counts.get(item_id, 0) + 1
+    _release_counts(Item._get_collection(), 'usage_count', counts)
 
-            # get the item data from the request
-            name = item.get('name')
-            desc = item.get('desc')
+    # atomically add the summed deltas of every transaction to the group
+    _update_group_balances(group.id, inc)
 
-            total_price = item.get('total_price')
-            quantity = item.get('quantity')
-            unit_price = item.get('unit_price')
+    failed = len(rows) - len(inserted)
+    if not inserted:
+        return jsonify({'msg': 'No transaction was created.', 'data': results, 'created': 0, 'failed': failed}), 500
+    msg = 'Transactions Created Successfully.' if not failed else 'Some transactions could not be created.'
+    return jsonify({'msg': msg, 'data': results, 'created': len(inserted), 'failed': failed}), \
+        200 if not failed else 207
 
-            if total_price is None and (quantity is None or unit_price is None):
-                transaction.delete()
-                return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
 
-            if (quantity is None and unit_price is None) and total_price is None:
-                transaction.delete()
-                return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
+def _read_ndjson(stream, limit):
+    """
+    helper to parse a newline delimited json body one line at a time
+    :param stream: the request stream
+    :param limit: stop reading after this many rows
+    :return: list of the parsed rows, None for the lines that are not valid json
+    """
+    rows = []
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            rows.append(None)
+        if len(rows) >= limit:
+            break
+    return rows
 
-            if name is None:
-                return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
 
-            if total_price is not None and (quantity is None or unit_price is None):
-                quantity = 1
-                unit_price = total_price
+def _build_transaction(person, group, data):
+    """
+    helper to validate a transaction request and compute its deltas before anything is written
+    :param person: the person making the request
+    :param group: the group the transaction belongs to
+    :param data: the transaction json in the /transaction/create format
+    :return: tuple of (unsaved transaction without items, normalized items) or None if the request is invalid
+    """
+    title = data.get('title')
+    desc = data.get('desc')
+    vendor = data.get('vendor')
+    who_paid = data.get('who_paid')
+    date = data.get('date')
+    items = data.get('items')
 
-            # keep track of the total_used
-            total_used += (quantity * unit_price)
+    if title is None or items is None:
+        return None
 
-            # add the item to the transaction
-            _add_item_to_transaction(person, transaction, quantity, person_id, name, desc, unit_price)
-            transaction.reload()
+    if date is None:
+        date = datetime.datetime.now(datetime.timezone.utc)
 
-    # update the who paid
-    total_paid = 0
+    # validate every item
+    items = _parse_items(person, group, items)
+    if items is None:
+        return None
+    total_used = sum(item['item_cost'] for item in items)
+
+    # if nobody is given as the payer the creator paid for everything
     if who_paid is None:
-        total_paid = total_used
-        transaction.who_paid[person.sub] = total_used
-    else:
-        for k, v in who_paid.items():
-            total_paid += v
-            transaction.who_paid[person.sub] = v
+        who_paid = {person.sub: total_used}
 
-    if total_paid != total_used:
-        _delete_transaction(group, transaction)
-        return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
+    # everyone that paid must be in the group and the amounts must match what was used
+    if not _valid_payers(group, who_paid):
+        return None
+    if abs(sum(who_paid.values()) - total_used) > PRICE_TOLERANCE:
+        return None
 
+    # compute the deltas in memory
+    ledger_deltas, balance_deltas = Ledger.compute_deltas(group.members, who_paid, items)
 
-    # update group with the ledger deltas
-    for k, v in transaction.ledger_deltas.items():
-        group.restricted.ledger[k] += v
+    # build the transaction and make sure it is valid before the items are touched
+    transaction = Transaction(title=title,
+                              group=group.id,
+                              desc=desc,
+                              vendor=vendor,
+                              created_by=person.sub,
+                              modified_by=person.sub,
+                              date_purchased=date,
+                              who_paid=who_paid,
+                              ledger_deltas=ledger_deltas,
+                              balance_deltas=balance_deltas,
+                              total_price=total_used)
+    try:
+        transaction.validate()
+    except ValidationError:
+        return None
+    return transaction, items
 
-    # update group with the balance deltas
-    for p1, d in transaction.balance_deltas.items():
-        for p2, v in d.items():
-            group.restricted.balances[p1][p2] += v
 
-    # save the transaction
-    transaction.save()
+def _valid_payers(group, who_paid):
+    """
+    helper to check that everyone that paid is in the group and paid a finite number
+    :param group: the group of the transaction
+    :param who_paid: dictionary of who paid and how much from the request
+    :return: True if who_paid is valid
+    """
+    if not isinstance(who_paid, dict) or not set(who_paid).issubset(group.members):
+        return False
+    return all(isinstance(amount, (int, float)) and not isinstance(amount, bool) and math.isfinite(amount)
+               for amount in who_paid.values())
 
-    # append the transaction to the group
-    group.restricted.transactions.append(transaction.id)
 
-    # save the group
-    group.save()
-    return jsonify({'id': str(transaction.id), 'msg': 'Transaction Created Successfully.'}), 200
+def _link_items(transaction, items, item_ids):
+    """
+    helper to set the transaction items from the normalized items and their catalog ids
+    :param item_ids: dictionary of item key -> item id, as returned by _upsert_items
+    """
+    transaction.items = [TransactionItem(item_id=str(item_ids[_item_key(item)]),
+                                         person=item['person'],
+                                         quantity=item['quantity'],
+                                         item_cost=item['item_cost']) for item in items]
 
 
 @app.route('/transaction/update', methods=['POST'])
 @verify_token
-@print_info
 def update_transaction(person):
     """
-    Create a transaction in the group
+    Update a transaction in place, only the difference with the stored transaction is written
     request must contain:
         - token
         - id: transaction id
         - data: json containing fields to update
+            - title, desc, vendor, date: [optional] metadata
+            - who_paid: [optional] dictionary of who paid and how much
+            - items: [optional] array replacing the items, in the /transaction/create format
     :param person: the person making the request
-    :return: returns a transaction id used to link items to the transaction
+    :return: returns the id of the transaction, which does not change
     """
     # get the request data
     request_data = request.get_json(force=True, silent=True)
     transaction_id = request_data.get('id')
     transaction_data = request_data.get('data')
 
-    if transaction_id is None or transaction_data is None:
+    if transaction_id is None or not isinstance(transaction_data, dict):
         return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
 
-    # query the transaction
-    transaction = Transaction.objects.get(id=transaction_id)
-
-    # perform a deep copy of the old transaction
-    transaction_new = deepcopy(transaction)
-    transaction_new.id = None
-
-    # query the group to make sure it exists
-    group_id = transaction.group
-    group = Group.objects.get(id=group_id)
-
-    # make sure the user belongs to the group
-    if person.sub not in group.members:
-        return jsonify({'msg': 'Token is unauthorized.'}), 404
+    # the update is computed on the loaded transaction and retried if another update is saved first
+    for attempt in range(VERSION_RETRIES):
+        # query the transaction
+        transaction = Transaction.objects(id=transaction_id).first() if ObjectId.is_valid(transaction_id) else None
+        if transaction is None:
+            return jsonify({'msg': 'Token is unauthorized.'}), 404
+
+        # query the group to make sure it exists
+        group_id = transaction.group
+        group = Group.objects.get(id=group_id)
+
+        # make sure the user belongs to the group
+        if person.sub not in group.members:
+            return jsonify({'msg': 'Token is unauthorized.'}), 404
+
+        # make sure user is authorized
+        if not (
+                group.restricted.permissions.admin_overrule_modify_transaction and group.admin == person.sub
+        ) and not (
+                group.restricted.permissions.only_owner_modify_transaction
+                and transaction.created_by == person.sub
+        ):
+            return jsonify({'msg': 'Token is unauthorized.'}), 404
+
+        # the client's copy must still be the stored one if it sent If-Match
+        failed = _precondition_failed(transaction)
+        if failed is not None:
+            return failed
+
+        # metadata is set on the document, mongoengine only writes the fields that changed
+        for k, field in TRANSACTION_METADATA.items():
+            if k in transaction_data:
+                transaction[field] = transaction_data[k]
+
+        # the ledger and balances only change with the items or the payers
+        inc, items, added, released = {}, None, {}, {}
+        if 'items' in transaction_data or 'who_paid' in transaction_data:
+            changed = _transaction_changes(person, group, transaction, transaction_data)
+            if changed is None:
+                return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
+            items, who_paid, ledger_deltas, balance_deltas, total_used = changed
+
+            inc = Ledger.inc_spec(transaction.ledger_deltas, transaction.balance_deltas, sign=-1)
+            inc = Ledger.inc_spec(ledger_deltas, balance_deltas, spec=inc)
+            transaction.who_paid = who_paid
+            transaction.ledger_deltas = ledger_deltas
+            transaction.balance_deltas = balance_deltas
+            transaction.total_price = total_used
+
+        # update the last modified by
+        transaction.modified_by = person.sub
+        transaction.date_modified = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            transaction.validate()
+        except ValidationError:
+            return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
+
+        # only the catalog items whose usage changed are written
+        if items is not None:
+            item_ids, added, released = _diff_items(transaction.items, items)
+            _link_items(transaction, items, item_ids)
+
+        # a single update of the changed fields, only if the transaction was not written since it was loaded
+        if _save_versioned(transaction):
+            break
+
+        # the deltas were computed on an outdated transaction, give back the usages counted and start over
+        _release_counts(Item._get_collection(), 'usage_count', added)
+        _backoff(attempt)
+    else:
+        return jsonify({'msg': 'The transaction is being modified, try again.'}), 409
 
-    # make sure user is authorized
-    if not (
-            group.restricted.permissions.admin_overrule_modify_transaction and group.admin == person.sub
-    ) and not (
-            group.restricted.permissions.only_owner_modify_transaction
-            and transaction.created_by == person.sub
-    ):
-        return jsonify({'msg': 'Token is unauthorized.'}), 404
+    # atomically apply the net difference of the deltas to the group
+    _update_group_balances(group.id, inc)
+    _release_counts(Item._get_collection(), 'usage_count', released)
 
-    # delete the previous transaction and unlink it from the group
-    group.restricted.transactions.remove(ObjectId(transaction_id))
-    _delete_transaction(group, transaction)
+    return _versioned(jsonify({'id': str(transaction.id), 'msg': 'Transaction updated.'}), transaction), 200
 
-    # save the new transaction
-    transaction_new.save()
 
-    transaction_new.items = []
-    if 'who_paid' in transaction_data:
-        transaction_new.who_paid = transaction_data['who_paid']
+def _transaction_changes(person, group, transaction, data):
+    """
+    helper to validate the new items and payers of a transaction update and compute its new deltas
+    :param person: the person making the request
+    :param group: the group of the transaction
+    :param transaction: the stored transaction
+    :param data: the update json
+    :return: tuple of (normalized items or None if unchanged, who_paid, ledger_deltas, balance_deltas, total_used)
+             or None if the update is invalid
+    """
+    if 'items' in data:
+        items = _parse_items(person, group, data['items'])
+        if items is None:
+            return None
+        deltas_items = items
     else:
-        transaction_new.who_paid = transaction.who_paid
-
-    # init transaction deltas
-    balance_deltas = {}
-    for p1 in group.members:
-        balance_deltas[p1] = {}
-        for p2 in group.members:
-            if p1 != p2:
-                balance_deltas[p1][p2] = 0
-    transaction_new.balance_deltas = balance_deltas
-    transaction_new.save()
-
-    # init the ledger deltas
-    for p in group.members:
-        if p in transaction_new.who_paid:
-            transaction_new.ledger_deltas[p] = transaction_new.who_paid[p]
-        else:
-            transaction_new.ledger_deltas[p] = 0
-    transaction_new.save()
+        # the payers changed, the stored items are enough to compute the deltas
+        items = None
+        deltas_items = [{'person': i.person, 'item_cost': i.item_cost} for i in transaction.items]
+    total_used = sum(item['item_cost'] for item in deltas_items)
 
-    # add it to the group
-    group.restricted.transactions.append(transaction_new.id)
+    who_paid = data.get('who_paid')
+    if who_paid is None:
+        # a single payer keeps paying for everything
+        who_paid = dict(transaction.who_paid)
+        if len(who_paid) == 1:
+            who_paid = {p: total_used for p in who_paid}
 
-    # update the fields from the original transaction within the new transaction
+    # everyone that paid must be in the group and the amounts must match what was used
+    if not _valid_payers(group, who_paid):
+        return None
+    if abs(sum(who_paid.values()) - total_used) > PRICE_TOLERANCE:
+        return None
 
-    for k, v in transaction_data.items():
-        # if the key is equal to items that should not be modified, ignore it
-        if k in ['group', 'date_created', 'created_by', 'date_modified', 'modified_by', 'total_price', 'who_paid']:
-            continue
-        # if normal string field
-        else:
-            transaction_new[k] = v
+    ledger_deltas, balance_deltas = Ledger.compute_deltas(group.members, who_paid, deltas_items)
+    return items, who_paid, ledger_deltas, balance_deltas, total_used
 
-    # re add the items to the transaction
-    if 'items' in transaction_data:
-        items = list(transaction_data['items'])
-    else:
-        items = []
-        for item in list(transaction.items):
-            item = item.to_mongo().to_dict()
-            print(item)
-            i = Item.objects.get(id=item['item_id'])
-            item['unit_price'] = i.unit_price
-            item['name'] = i.name
-            item['desc'] = i.desc
-            _delete_item(i)
-            items.append(item)
-    total_used = 0
-
-    for transaction_item in items:
-        # this assumes the user will pass the item information in the item field rather than the id
-        total_used += (transaction_item['quantity'] * transaction_item['unit_price'])
-        _add_item_to_transaction(person, transaction_new,
-                                 quantity=transaction_item['quantity'],
-                                 person_id=transaction_item['person'],
-                                 name=transaction_item['name'],
-                                 desc=transaction_item['desc'],
-                                 unit_price=transaction_item['unit_price'])
-        transaction_new.reload()
-
-    # update the last modified by
-    transaction_new.modified_by = person.sub
-    transaction_new.date_modified = datetime.datetime.now(datetime.timezone.utc)
-
-    # update group with the ledger deltas
-    for k, v in transaction_new.ledger_deltas.items():
-        group.restricted.ledger[k] += v
-
-    # update group with the balance deltas
-    for p1, d in transaction_new.balance_deltas.items():
-        for p2, v in d.items():
-            group.restricted.balances[p1][p2] += v
-
-    # save the transaction
-    transaction_new.save()
-    group.save()
 
-    return jsonify({'id': str(transaction_new.id), 'msg': 'Transaction updated.'}), 200
+def _diff_items(old_items, items):
+    """
+    helper to count only the catalog usages that differ between the stored and the new items of a transaction
+    :param old_items: the stored TransactionItems
+    :param items: list of new normalized item dictionaries
+    :return: tuple of (dictionary of item key -> item id for the new items, dictionary of item id -> usages added,
+             dictionary of item id -> usages released)
+    """
+    old_counts = {}
+    for item in old_items:
+        if ObjectId.is_valid(item.item_id):
+            old_counts[ObjectId(item.item_id)] = old_counts.get(ObjectId(item.item_id), 0) + 1
+
+    # the keys of the stored items, one query
+    old_ids = {}
+    if old_counts:
+        projection = {'name': 1, 'desc': 1, 'unit_price': 1}
+        for i in Item._get_collection().find({'_id': {'$in': list(old_counts)}}, projection):
+            old_ids[_item_key(i)] = i['_id']
+
+    new_counts, representative = {}, {}
+    for item in items:
+        key = _item_key(item)
+        new_counts[key] = new_counts.get(key, 0) + 1
+        representative.setdefault(key, item)
+
+    # usages to add, for new items and for items used more often than before
+    added = {}
+    for key, count in new_counts.items():
+        more = count - old_counts[old_ids[key]] if key in old_ids else count
+        if more > 0:
+            added[key] = more
+
+    item_ids = {key: old_ids[key] for key in new_counts if key in old_ids}
+    if added:
+        item_ids.update(_upsert_items([representative[key] for key in added], usages=added))
+
+    # usages to release, for items dropped or used less often than before
+    released = {}
+    kept = {old_ids[key]: count for key, count in new_counts.items() if key in old_ids}
+    for item_id, count in old_counts.items():
+        fewer = count - kept.get(item_id, 0)
+        if fewer > 0:
+            released[item_id] = fewer
+    return item_ids, {item_ids[key]: count for key, count in added.items()}, released
 
 
 @app.route('/transaction/delete', methods=['POST'])
 @verify_token
-@print_info
 def delete_transaction(person):
     """
     Create a transaction in the group
@@ -1118,183 +1703,125 @@ def delete_transaction(person):
     if transaction_id is None:
         return jsonify({'msg': 'Missing required field(s) or invalid type(s).'}), 400
 
-    # query the transaction
-    transaction = Transaction.objects.get(id=transaction_id)
-    group_id = transaction.group
-
-    # query the group to make sure it exists
-    group = Group.objects.get(id=group_id)
-
-    # make sure the user belongs to the group
-    if person.sub not in group.members:
-        return jsonify({'msg': 'Token is unauthorized.'}), 404
-
-    # make sure user is authorized
-    if (
-            not (
-                    group.restricted.permissions.admin_overrule_delete_transaction
-                    and group.admin == person.sub
-            )
-            and not group.settings.user_delete_transaction
-            and not (
-            group.settings.only_owner_delete_transaction
-            and transaction.created_by == person.sub
-    )
-    ):
-        return jsonify({'msg': 'Token is unauthorized.'}), 404
-
-    # check if transaction is the group
-    if transaction_id not in group.transactions:
-        return jsonify({'msg': 'Token is unauthorized.'}), 404
-
-    # remove the transaction from the group
-    group.transactions.remove(transaction_id)
-
-    # delete the transaction
-    _delete_transaction(group, transaction)
+    # retried if the transaction is updated between loading and deleting it
+    for attempt in range(VERSION_RETRIES):
+        # query the transaction
+        transaction = Transaction.objects(id=transaction_id).first()
+        if transaction is None:
+            return jsonify({'msg': 'Token is unauthorized.'}), 404
+        group_id = transaction.group
+
+        # query the group to make sure it exists
+        group = Group.objects.get(id=group_id)
+
+        # make sure the user belongs to the group
+        if person.sub not in group.members:
+            return jsonify({'msg': 'Token is unauthorized.'}), 404
+
+        # make sure user is authorized
+        if (
+                not (
+                        group.restricted.permissions.admin_overrule_delete_transaction
+                        and group.admin == person.sub
+                )
+                and not group.restricted.permissions.user_delete_transaction
+                and not (
+                group.restricted.permissions.only_owner_delete_transaction
+                and transaction.created_by == person.sub
+        )
+        ):
+            return jsonify({'msg': 'Token is unauthorized.'}), 404
+
+        # the client's copy must still be the stored one if it sent If-Match
+        failed = _precondition_failed(transaction)
+        if failed is not None:
+            return failed
+
+        # delete the transaction
+        if _delete_transaction(group, transaction):
+            break
+        _backoff(attempt)
+    else:
+        return jsonify({'msg': 'The transaction is being modified, try again.'}), 409
 
     return jsonify({'msg': 'Transaction deleted.'}), 200
 
 
-def _delete_transaction(group, transaction):
+def _update_group_balances(group_id, inc, update=None, query=None):
     """
-    helper to delete transaction from db
+    helper to atomically apply ledger and balance increments to a group
+    concurrent workers never overwrite each other because nothing is read back and saved
+    :param group_id: id of the group
+    :param inc: `$inc` document built by Ledger.inc_spec
+    :param update: optional extra update operators applied in the same write
+    :param query: optional extra filter conditions
+    :return: True if the group was matched
     """
-    # get data from the transaction
-    balance_deltas = transaction.balance_deltas
-    ledger_deltas = transaction.ledger_deltas
-    people_involved = balance_deltas.keys()
-
-    # revert ledger and balances
-    for p1 in people_involved:
-        for p2 in people_involved:
-            if p1 != p2:
-                group.restricted.balances[p1][p2] -= balance_deltas[p1][p2]
-        group.restricted.ledger[p1] -= ledger_deltas[p1]
-
-    # iterate through all transaction items
-    for transaction_item in transaction.items:
-        # get the item id
-        item_id = transaction_item.item_id
-
-        # try to get the item
-        item = Item.objects(id=item_id)
-        if len(item) == 0:
-            continue
-        item = item.first()
-
-        # delete the item
-        _delete_item(item)
-
-    group.save()
-    # delete the transaction
-    transaction.delete()
-
-
-def _delete_item(item):
+    update = dict(update or {})
+    if inc:
+        update['$inc'] = inc
+    if not update:
+        return True
+    # every write moves the version on, so read-modify-write saves that loaded the group before it start over
+    update['$inc'] = dict(update.get('$inc', {}), version=1)
+    query = dict(query or {}, _id=group_id)
+    if Group._get_collection().update_one(query, update).matched_count != 1:
+        return False
+    _prune_balances(group_id, [path for path in inc or {} if path.startswith('restricted.balances.')])
+    return True
+
+
+def _prune_balances(group_id, paths):
     """
-    unlink an item and delete if necessary
+    helper to unset the balance pairs an increment brought to zero, and the rows it left empty, so only non-zero
+    pairs stay stored. Each unset is conditional, a pair another worker already moved off zero is kept
+    :param group_id: id of the group
+    :param paths: dotted `restricted.balances` paths that were incremented
     """
-    # decrement the items usage count
-    item.usage_count -= 1
-
-    # if the usage count is 0 delete it
-    if item.usage_count <= 0:
-        item.delete()
-    else:
-        item.save()
+    if not paths:
+        return
+    zero = {'$gt': -Ledger.EPSILON, '$lt': Ledger.EPSILON}
+    requests = [UpdateOne({'_id': group_id, path: zero}, {'$unset': {path: ''}}) for path in paths]
+    requests += [UpdateOne({'_id': group_id, row: {}}, {'$unset': {row: ''}})
+                 for row in {path.rsplit('.', 1)[0] for path in paths}]
+    # missing pairs read as zero, the balances are unchanged so the version is not moved on
+    Group._get_collection().bulk_write(requests, ordered=True)
 
 
-def _add_item_to_transaction(person, transaction, quantity, person_id, name, desc, unit_price):
+def _delete_transaction(group, transaction, update_group=True, release_receipt=True):
     """
-    helper function to add item to transaction
+    helper to delete transaction from db
+    :param update_group: revert the deltas of the transaction on the group
+    :param release_receipt: drop the transaction's reference to its receipt
+    :return: True if deleted, False if the transaction was written since it was loaded (it must be reloaded)
     """
-    # get the group id
-    group_id = transaction.group
-
-    # query the group to make sure it exists
-    group = Group.objects.get(id=group_id)
-
-    # get what person id the transaction item will belong to
-    sub = person_id if person_id is not None else person.sub
-
-    # make sure the user belongs to the group
-    if person.sub not in group.members or sub not in group.members:
-        raise Exception('Person does not belong to group')
+    # deleted first and only in the loaded version, so the deltas reverted are the ones applied to the group
+    if Transaction.objects(id=transaction.id, **_version_condition(transaction.version)).delete() == 0:
+        return False
 
-    # check quantity for proper value
-    if quantity < 1:
-        raise Exception('Quantity cannot be less than 1.')
+    # atomically revert ledger and balances
+    if update_group:
+        _update_group_balances(group.id,
+                               Ledger.inc_spec(transaction.ledger_deltas, transaction.balance_deltas, sign=-1))
 
-    # query the item to make sure it exists
-    item = _create_item(name, desc, unit_price)
-    item_cost = item.unit_price * quantity
-
-    # create the transaction item
-    transaction_item = TransactionItem(item_id=str(item.id),
-                                       person=sub,
-                                       quantity=quantity,
-                                       item_cost=item_cost)
-
-    # add the transaction item to the transaction
-    transaction.items.append(transaction_item)
-
-    # save the transaction
-    transaction.save()
+    # release the catalog items with atomic decrements, the ones no longer used are deleted
+    counts = {}
+    for transaction_item in transaction.items:
+        if ObjectId.is_valid(transaction_item.item_id):
+            item_id = ObjectId(transaction_item.item_id)
+            counts[item_id] = counts.get(item_id, 0) + 1
+    _release_counts(Item._get_collection(), 'usage_count', counts)
 
-    # increment usage count
-    item.usage_count += 1
-
-    # save the item
-    item.save()
-
-    # increment the ledger and the balance
-    who_paid = transaction.who_paid
-    ledger_deltas = transaction.ledger_deltas
-    balance_deltas = transaction.balance_deltas
-
-    # deduct how much the person used from the ledger deltas
-    ledger_deltas[sub] -= item_cost
-
-    # iterate through everyone that has paid in this transaction
-    # this is so we can calculate who owes what in this transaction
-    for p_paid in who_paid.keys():
-        paid = ledger_deltas[p_paid]
-        used = ledger_deltas[sub]
-
-        # if person that paid is not the user
-        if p_paid != sub:
-            # if the person used more than the have paid in this transaction
-            if used < 0:
-                # if the amount paid is greater than the amount used
-                if used + paid > 0:
-                    balance_deltas[p_paid][sub] -= used
-                    balance_deltas[sub][p_paid] += used
-                # if the amount paid is equal to or less than the amount used
-                else:
-                    paid = paid if paid > 0 else -paid
-                    balance_deltas[p_paid][sub] += paid
-                    balance_deltas[sub][p_paid] -= paid
-
-    transaction.ledger_deltas = ledger_deltas
-    transaction.balance_deltas = balance_deltas
-    transaction.save()
+    # the receipt goes with the last transaction referencing it
+    if release_receipt and transaction.receipt is not None:
+        _release_receipt(transaction.receipt)
+    return True
 
-    # # update group with the ledger deltas
-    # for k, v in ledger_deltas.items():
-    #     group.restricted.ledger[k] += v
-    #
-    # # update group with the balance deltas
-    # for p1, d in balance_deltas.items():
-    #     for p2, v in d.items():
-    #         group.restricted.balances[p1][p2] += v
 
-    # group.save()
 #
 #
 # @app.route('/transaction/remove-item', methods=['POST'])
 # @verify_token
-# @print_info
 # def remove_item_from_transaction(person):
 #     """
 #     Create a transaction in the group
@@ -1338,7 +1865,6 @@ def _add_item_to_transaction(person, transaction, quantity, person_id, name, des
 
 @app.route('/transaction/info', methods=['POST'])
 @verify_token
-@print_info
 def get_transaction(person):
     """
     get a transaction in the group
@@ -1352,21 +1878,20 @@ def get_transaction(person):
 
     # query the transaction
     transaction = Transaction.objects.get(id=transaction_id)
-    group_id = transaction.group
 
-    # query the group to make sure it exists
-    group = Group.objects.get(id=group_id)
-
-    # make sure the user belongs to the group
-    if person.sub not in group.members:
+    # make sure the user belongs to the group, only the group id is read
+    if Group.objects(id=transaction.group, members=person.sub).only('id').first() is None:
         return jsonify({'msg': 'Token is unauthorized or transaction does not exist.'}), 404
 
-    return jsonify({'msg': 'Retrieved transaction.', 'data': transaction}), 200
+    not_modified = _not_modified(transaction)
+    if not_modified is not None:
+        return not_modified
+
+    return _versioned(jsonify({'msg': 'Retrieved transaction.', 'data': transaction}), transaction), 200
 
 
 @app.route('/receipt/add', methods=['POST'])
 @verify_token
-@print_info
 @limiter.limit("10/minute", override_defaults=False)
 def add_receipt(person):
     """
@@ -1383,44 +1908,342 @@ def add_receipt(person):
     request_data = request.get_json(force=True, silent=True)
     transaction_id = request_data['id']
 
-    # retrieve receipt string and convert to bytearray for ImageField
-    img_data_decoded = request_data['receipt'].encode('utf-8')
-    file_like = base64.b64decode(img_data_decoded)
-    receiptBytes = bytearray(file_like)
+    # query the transaction and make sure the user belongs to its group
+    transaction = _receipt_transaction(person, transaction_id)
+    if transaction is None:
+        return jsonify({'msg': 'Token is unauthorized or transaction does not exist.'}), 404
 
-    # query the transaction
-    transaction = Transaction.objects.get(id=transaction_id)
-    group_id = transaction.group
+    # decode the receipt string, the decoded bytes are streamed to GridFS without further copies
+    stream = io.BytesIO(base64.b64decode(request_data['receipt']))
+    first_chunk = stream.read(RECEIPT_CHUNK_SIZE)
+    if not first_chunk:
+        return jsonify({'msg': 'Receipt is empty.'}), 400
 
-    # query the group to make sure it exists
-    group = Group.objects.get(id=group_id)
+    receipt_id = _store_receipt(person, transaction, first_chunk, stream, 'application/octet-stream')
+    if receipt_id is None:
+        return jsonify({'msg': 'Receipt is too large.'}), 413
 
-    # make sure the user belongs to the group
-    if person.sub not in group.members:
+    return jsonify({'id': str(receipt_id), 'msg': 'Receipt was successfully added.'}), 200
+
+
+@app.route('/receipt/upload', methods=['POST'])
+@verify_token
+@limiter.limit("10/minute", override_defaults=False)
+def upload_receipt(person):
+    """
+    Stream a receipt image into GridFS and attach it to a transaction
+    request must contain:
+        - token
+        - id: transaction id, as a query string or multipart form field
+        - the image, either as the raw body (image/* or application/octet-stream)
+          or as the `receipt` part of a multipart/form-data body
+    :param person: the person making the request
+    """
+    if request.content_length is not None and request.content_length > RECEIPT_MAX_SIZE:
+        return jsonify({'msg': 'Receipt is too large.'}), 413
+
+    # multipart bodies are spooled to disk by werkzeug, raw bodies are read straight from the socket
+    if request.mimetype == 'multipart/form-data':
+        transaction_id = request.args.get('id', request.form.get('id'))
+        upload = request.files.get('receipt')
+        stream = upload.stream if upload else None
+        content_type = upload.mimetype if upload else None
+    else:
+        transaction_id = request.args.get('id')
+        stream = request.stream
+        content_type = request.mimetype
+
+    if transaction_id is None or stream is None:
+        return jsonify({'msg': 'Missing Required Field(s) / Invalid Type(s).'}), 400
+
+    if not (content_type.startswith('image/') or content_type == 'application/octet-stream'):
+        return jsonify({'msg': 'Receipt must be an image.'}), 415
+
+    # query the transaction and make sure the user belongs to its group
+    transaction = _receipt_transaction(person, transaction_id)
+    if transaction is None:
         return jsonify({'msg': 'Token is unauthorized or transaction does not exist.'}), 404
 
-    receiptObject = Receipt()
+    # nothing is written to GridFS for an empty upload
+    first_chunk = stream.read(RECEIPT_CHUNK_SIZE)
+    if not first_chunk:
+        return jsonify({'msg': 'Receipt is empty.'}), 400
+
+    receipt_id = _store_receipt(person, transaction, first_chunk, stream, content_type)
+    if receipt_id is None:
+        return jsonify({'msg': 'Receipt is too large.'}), 413
+
+    return jsonify({'id': str(receipt_id), 'msg': 'Receipt was successfully added.'}), 200
+
+
+@app.route('/receipt/download', methods=['GET'])
+@verify_token
+def download_receipt(person):
+    """
+    Stream a transaction's receipt image out of GridFS
+    supports conditional requests (If-None-Match) and byte ranges (Range)
+    request must contain:
+        - token
+        - id: transaction id, as a query string
+    :param person: the person making the request
+    """
+    transaction_id = request.args.get('id')
+    if transaction_id is None:
+        return jsonify({'msg': 'Missing Required Field(s) / Invalid Type(s).'}), 400
+
+    # query the transaction and make sure the user belongs to its group
+    transaction = _receipt_transaction(person, transaction_id)
+    if transaction is None or transaction.receipt is None:
+        return jsonify({'msg': 'Token is unauthorized or transaction does not exist.'}), 404
+
+    receipt = Receipt.objects(id=transaction.receipt).first()
+    grid_out = receipt.receipt.get() if receipt else None
+    if grid_out is None:
+        return jsonify({'msg': 'Receipt does not exist.'}), 404
+
+    return _send_grid_out(grid_out)
+
+
+@app.route('/receipt/thumbnail', methods=['GET'])
+@verify_token
+def get_receipt_thumbnail(person):
+    """
+    Stream a thumbnail of a transaction's receipt
+    request must contain:
+        - token
+        - id: transaction id, as a query string
+        - size: [optional] longest side of the thumbnail in pixels, as a query string
+    :param person: the person making the request
+    """
+    transaction_id = request.args.get('id')
+    size = request.args.get('size', min(ImageProcessing.THUMBNAIL_SIZES), type=int)
+    if transaction_id is None:
+        return jsonify({'msg': 'Missing Required Field(s) / Invalid Type(s).'}), 400
+
+    # query the transaction and make sure the user belongs to its group
+    transaction = _receipt_transaction(person, transaction_id)
+    if transaction is None or transaction.receipt is None:
+        return jsonify({'msg': 'Token is unauthorized or transaction does not exist.'}), 404
+
+    receipt = Receipt.objects(id=transaction.receipt).only('status', 'thumbnails').first()
+    if receipt is None:
+        return jsonify({'msg': 'Receipt does not exist.'}), 404
+    if receipt.status == 'pending':
+        return jsonify({'msg': 'Receipt is still being processed.'}), 202
+
+    thumbnail_id = receipt.thumbnails.get(str(size))
+    if thumbnail_id is None:
+        return jsonify({'msg': 'Thumbnail does not exist.'}), 404
+
+    return _send_grid_out(_thumbnail_fs().get(thumbnail_id))
+
+
+def _send_grid_out(grid_out):
+    """
+    build a streaming response of a GridFS file
+    supports conditional requests (If-None-Match) and byte ranges (Range)
+    :param grid_out: the GridFS file
+    :return: tuple of (response, status)
+    """
+    # stored files never change, older receipts without a digest use their file id
+    etag = getattr(grid_out, 'sha256', None) or str(grid_out._id)
+
+    # werkzeug seeks into the file for ranges and only reads the chunks it sends
+    response = Response(wrap_file(request.environ, grid_out, RECEIPT_CHUNK_SIZE),
+                        mimetype=grid_out.content_type or 'application/octet-stream',
+                        direct_passthrough=True)
+    response.content_length = grid_out.length
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.accept_ranges = 'bytes'
+    try:
+        response.make_conditional(request, accept_ranges=True, complete_length=grid_out.length)
+    except RequestedRangeNotSatisfiable:
+        grid_out.close()
+        response = jsonify({'msg': 'Requested range not satisfiable.'})
+        response.headers['Content-Range'] = f'bytes */{grid_out.length}'
+        return response, 416
+
+    return response, response.status_code
+
+
+def _image_fs():
+    """
+    get the GridFS collection holding the receipt images
+    """
+    return gridfs.GridFS(Receipt._get_db(), Receipt.receipt.collection_name)
 
-    with tempfile.TemporaryFile() as f:
-        f.write(receiptBytes)
-        f.flush()
-        f.seek(0)
-        receiptObject.receipt.put(f)
 
-    receiptObject.save()
+def _thumbnail_fs():
+    """
+    get the GridFS collection holding the receipt thumbnails
+    """
+    return gridfs.GridFS(Receipt._get_db(), 'thumbnails')
+
+
+def _process_receipt(receipt_id):
+    """
+    normalize an uploaded receipt and store its thumbnails, runs on the receipt worker pool
+    the normalized image replaces the raw upload once everything is stored
+    :param receipt_id: id of the receipt
+    """
+    receipt = Receipt.objects(id=receipt_id).first()
+    if receipt is None or receipt.receipt.grid_id is None:
+        return
+    original_id = receipt.receipt.grid_id
+
+    try:
+        with receipt.receipt.get() as original:
+            normalized, thumbnails = ImageProcessing.normalize(original)
+    except Exception as exp:
+        # not an image Pillow can read, keep serving the upload as is
+        request_log.log({'msg': 'receipt processing failed', 'receipt': str(receipt_id)}, logging.WARNING,
+                        exc_info=exp)
+        Receipt.objects(id=receipt_id, status='pending').update_one(set__status='failed')
+        return
+
+    images, thumbnail_fs = _image_fs(), _thumbnail_fs()
+    normalized_id = images.put(normalized, content_type=ImageProcessing.CONTENT_TYPE, thumbnail_id=None,
+                               sha256=hashlib.sha256(normalized).hexdigest())
+    thumbnail_ids = {str(size): thumbnail_fs.put(data, content_type=ImageProcessing.CONTENT_TYPE,
+                                                 sha256=hashlib.sha256(data).hexdigest())
+                     for size, data in thumbnails.items()}
+
+    # only swap the file if the receipt still holds the upload that was processed
+    updated = Receipt._get_collection().update_one(
+        {'_id': receipt_id, 'receipt': original_id},
+        {'$set': {'receipt': normalized_id, 'status': 'ready', 'thumbnails': thumbnail_ids}})
+
+    if updated.matched_count:
+        images.delete(original_id)
+    else:
+        images.delete(normalized_id)
+        for thumbnail_id in thumbnail_ids.values():
+            thumbnail_fs.delete(thumbnail_id)
+
+
+def _receipt_transaction(person, transaction_id):
+    """
+    get a transaction whose receipt the person may access
+    :param person: the person making the request
+    :param transaction_id: id of the transaction
+    :return: the transaction, None if it does not exist or the person is not in its group
+    """
+    transaction = Transaction.objects(id=transaction_id).first()
+    if transaction is None:
+        return None
+
+    if Group.objects(id=transaction.group, members=person.sub).only('id').first() is None:
+        return None
+    return transaction
+
+
+def _store_receipt(person, transaction, first_chunk, stream, content_type):
+    """
+    stream a receipt into GridFS one chunk at a time and attach it to the transaction
+    receipts are keyed on the SHA-256 of the uploaded bytes, uploading the same bytes again links to the stored copy
+    :param person: the person making the request
+    :param transaction: the transaction to attach the receipt to
+    :param first_chunk: the non-empty first chunk already read from the stream, so empty uploads are refused
+                        before anything is written
+    :param stream: file-like object to read the rest of the image from
+    :param content_type: mime type of the image
+    :return: id of the attached receipt, None if it exceeds RECEIPT_MAX_SIZE
+    """
+    receipt = Receipt()
+
+    # thumbnail_id is expected by ImageField when the file is deleted
+    receipt.receipt.new_file(content_type=content_type, thumbnail_id=None)
+    grid_in = receipt.receipt.newfile
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        chunk = first_chunk
+        while chunk:
+            size += len(chunk)
+            if size > RECEIPT_MAX_SIZE:
+                grid_in.abort()
+                return None
+            digest.update(chunk)
+            grid_in.write(chunk)
+            chunk = stream.read(RECEIPT_CHUNK_SIZE)
+    except Exception:
+        grid_in.abort()
+        raise
+
+    # set before closing so it is stored on the file document
+    receipt.digest = grid_in.sha256 = digest.hexdigest()
+    receipt.receipt.close()
+
+    receipt_id, created = _link_receipt(receipt)
+
+    # normalize and thumbnail the image without holding up the response
+    if created:
+        receipt_pool.submit(_process_receipt, receipt_id)
 
     # attach receipt id to transaction and update transaction modification
-    transaction.receipt = receiptObject.id
-    transaction.modified_by = person.sub
-    transaction.date_modified = datetime.datetime.utcnow()
-    transaction.save()
+    previous = Transaction._get_collection().find_one_and_update(
+        {'_id': transaction.id},
+        {'$set': {'receipt': receipt_id, 'modified_by': person.sub, 'date_modified': datetime.datetime.utcnow()},
+         '$inc': {'version': 1}},
+        projection={'receipt': 1})
+
+    # drop the reference of the replaced receipt (or ours if the transaction was deleted meanwhile)
+    if previous is None:
+        _release_receipt(receipt_id)
+    elif previous.get('receipt') is not None:
+        _release_receipt(previous['receipt'])
+    return receipt_id
 
-    return jsonify({'id': str(receiptObject.id), 'msg': 'Receipt was successfully added.'}), 200
+
+def _link_receipt(receipt):
+    """
+    reference the stored receipt holding the same bytes, or save the new one if there is none
+    :param receipt: unsaved receipt whose file was just written and whose digest is set
+    :return: tuple of (id of the referenced receipt, whether the new receipt was saved)
+    """
+    collection = Receipt._get_collection()
+    while True:
+        existing = collection.find_one_and_update({'digest': receipt.digest}, {'$inc': {'refs': 1}},
+                                                  projection={'_id': 1})
+        if existing is not None:
+            receipt.receipt.delete()
+            return existing['_id'], False
+
+        # the unique digest index makes a concurrent upload of the same bytes fail here and link on the next pass
+        try:
+            receipt.refs = 1
+            receipt.save()
+            return receipt.id, True
+        except NotUniqueError:
+            continue
+
+
+def _release_receipt(receipt_id):
+    """
+    drop one reference to a receipt, the receipt and its files are deleted with the last one
+    :param receipt_id: id of the receipt
+    """
+    collection = Receipt._get_collection()
+    receipt = collection.find_one_and_update({'_id': receipt_id}, {'$inc': {'refs': -1}},
+                                             return_document=ReturnDocument.AFTER)
+    if receipt is None or receipt.get('refs', 0) > 0:
+        return
+
+    # only delete if no upload of the same bytes linked to it in the meantime
+    if collection.delete_one({'_id': receipt_id, 'refs': {'$lte': 0}}).deleted_count == 0:
+        return
+
+    if receipt.get('receipt') is not None:
+        _image_fs().delete(receipt['receipt'])
+    thumbnail_fs = _thumbnail_fs()
+    for thumbnail_id in (receipt.get('thumbnails') or {}).values():
+        thumbnail_fs.delete(thumbnail_id)
 
 
 @app.route('/receipt/get', methods=['POST'])
 @verify_token
-@print_info
 def get_receipt(person):
     """
     Get receipt item and return jsonified image id
@@ -1464,47 +2287,143 @@ def get_receipt(person):
 ## ITEM
 
 
-def _create_item(name: str, desc: str, unit_price: float):
+def _item_query(key, item_id=None):
     """
-    Create an item
-    request must contain:
-        - token
-        - name
-        - desc
-        - unit_price
-    :return: returns a item id used to link items to the transaction
-    """
-
-    # check quantity for proper value
-    if unit_price <= 0:
-        raise Exception('Unit price cannot be less than 0.')
-
-    # initial declarations
-    item = None
-
-    # try to get the item if exists
-    item = Item.objects(name=name,
-                        desc=desc,
-                        unit_price=unit_price)
-
-    # if the item does not exist
-    if len(item) == 0:
-        # create the item
-        item = Item(name=name,
-                    desc=desc,
-                    unit_price=unit_price)
-    else:
-        item = item.first()
+    helper to build the upsert filter of a catalog item
+    with a remembered id the item is matched on its _id, and an item deleted since is recreated under the same id
+    :param key: tuple of (name, desc, unit_price)
+    :param item_id: remembered id of the item
+    """
+    name, desc, unit_price = key
+    query = {'name': name, 'desc': desc, 'unit_price': unit_price}
+    if item_id is not None:
+        query['_id'] = item_id
+    return query
+
+
+def _item_key(item):
+    """
+    helper to get the catalog key of an item
+    """
+    return item['name'], item['desc'], item['unit_price']
+
 
-    # save item
-    item.save()
+def _parse_items(person, group, items):
+    """
+    helper to validate the items of a transaction request before anything is written
+    :param person: the person making the request
+    :param group: the group the transaction belongs to
+    :param items: list of item jsons from the request
+    :return: list of normalized item dictionaries or None if an item is invalid
+    """
+    if not isinstance(items, list):
+        return None
+
+    parsed = []
+    for item in items:
+        if not isinstance(item, dict):
+            return None
+
+        # get the item data from the request
+        name = item.get('name')
+        desc = item.get('desc') or ''
+        total_price = item.get('total_price')
+        quantity = item.get('quantity')
+        unit_price = item.get('unit_price')
+
+        # get what person the transaction item will belong to
+        sub = item.get('owed_by', item.get('person'))
+        sub = sub if sub is not None else person.sub
+
+        if not isinstance(name, str) or not isinstance(desc, str) or len(name) > 60:
+            return None
+
+        if total_price is None and (quantity is None or unit_price is None):
+            return None
 
-    return item
+        if quantity is None or unit_price is None:
+            quantity = 1
+            unit_price = total_price
+
+        try:
+            quantity = int(quantity)
+            unit_price = float(unit_price)
+        except (TypeError, ValueError):
+            return None
+
+        # check for proper values, nan and inf would stay in the ledger once added to it
+        if quantity < 1 or unit_price <= 0 or not math.isfinite(unit_price * quantity) or sub not in group.members:
+            return None
+
+        parsed.append({
+            'name': name,
+            'desc': desc,
+            'unit_price': unit_price,
+            'quantity': quantity,
+            'person': sub,
+            'item_cost': unit_price * quantity
+        })
+    return parsed
+
+
+def _upsert_items(items, usages=None):
+    """
+    helper to create or reuse the catalog items of a transaction with one bulk write
+    :param items: list of normalized item dictionaries
+    :param usages: dictionary of item key -> usages to add, defaults to one per item
+    :return: dictionary of item key -> item id
+    """
+    if not items:
+        return {}
+
+    # one usage per transaction item
+    if usages is None:
+        usages = {}
+        for item in items:
+            usages[_item_key(item)] = usages.get(_item_key(item), 0) + 1
+
+    item_ids = {key: item_cache.get(key) for key in usages}
+    keys = list(usages)
+    collection = Item._get_collection()
+    try:
+        result = collection.bulk_write([
+            UpdateOne(_item_query(key, item_ids[key]), {'$inc': {'usage_count': usages[key]}}, upsert=True)
+            for key in keys
+        ], ordered=False)
+        upserted, failed = result.upserted_ids, []
+    except PyMongoBulkWriteError as exp:
+        upserted = {u['index']: u['_id'] for u in exp.details['upserted']}
+        errors = exp.details['writeErrors']
+        failed = [keys[e['index']] for e in errors]
+        if any(e['code'] != 11000 for e in errors) or any(item_ids[key] is None for key in failed):
+            raise
+
+    # remembered items deleted and recreated under another id since, count them by their key
+    if failed:
+        for key in failed:
+            item_cache.pop(key)
+            item_ids[key] = None
+        retried = collection.bulk_write([
+            UpdateOne(_item_query(key), {'$inc': {'usage_count': usages[key]}}, upsert=True) for key in failed
+        ], ordered=False)
+        upserted.update({keys.index(failed[i]): _id for i, _id in retried.upserted_ids.items()})
+
+    for index, _id in upserted.items():
+        item_ids[keys[index]] = _id
+
+    # read back the ids of the items that already existed and were not remembered
+    missing = [_item_query(key) for key, item_id in item_ids.items() if item_id is None]
+    if missing:
+        for i in collection.find({'$or': missing}, {'name': 1, 'desc': 1, 'unit_price': 1}):
+            item_ids[_item_key(i)] = i['_id']
+
+    for key, item_id in item_ids.items():
+        item_cache.put(key, item_id)
+    return item_ids
 
 
 @app.route('/item/info', methods=['POST'])
 @verify_token
-@print_info
 def get_item(_):
     """
     get an item
@@ -44,12 +44,16 @@ class GroupRestricted(EmbeddedDocument):
     """
     EmbeddedDocument for the GroupRestricted model.
     """
+    # not strict so groups still holding the old transactions list load until they are migrated
+    meta = {'strict': False}
+
     permissions = EmbeddedDocumentField(GroupPermissions, default=GroupPermissions)
     balances = DictField(default={})
     ledger = DictField(default={})
-    transactions = ListField(default=[])
     date = EmbeddedDocumentField(GroupDate, default=GroupDate)
     invite_list = ListField(default=[])
+    # code letting anyone join the group, None until the admin first rotates it (the group id is used until then)
+    join_code = StringField(required=False)
 
 
 class Group(Document):
@@ -61,7 +65,15 @@ class Group(Document):
     admin = StringField(max_length=255, required=True)
     members = ListField(default=[])
     restricted = EmbeddedDocumentField(GroupRestricted, default=GroupRestricted)
+    # incremented by every write, saves are conditional on it and it is served as the ETag
+    version = IntField(default=0)
     # TODO: add time when person joined group ( embedded document or map )
     #   - date group was created
     #   - group settings
     #      - who can modify transactions (just creator or everyone, etc.)
+
+    # groups are looked up by member and by join code, indexes are built by Models.ensure_indexes at startup
+    meta = {
+        'indexes': ['members', {'fields': ['restricted.join_code'], 'unique': True, 'sparse': True}],
+        'auto_create_index': False
+    }
@@ -0,0 +1,36 @@
+"""
+Startup check for the MongoDB indexes declared on the models.
+"""
+import threading
+from .Group import Group
+from .Person import Person
+from .Transaction import Transaction, Item, Receipt
+
+MODELS = [Person, Group, Item, Transaction, Receipt]
+
+
+def ensure_indexes(models=None):
+    """
+    create any missing index declared in the models meta
+    :param models: list of Document classes, defaults to every model
+    :return: list of the models whose indexes could not be created
+    """
+    failed = []
+    for model in models or MODELS:
+        try:
+            model.ensure_indexes()
+        except Exception as exp:
+            print(f"ensure_indexes({model.__name__}) => Exception: {exp}")
+            failed.append(model)
+    return failed
+
+
+def ensure_indexes_async(models=None):
+    """
+    create the missing indexes from a background thread so booting the API never waits on an index build
+    :param models: list of Document classes, defaults to every model
+    :return: the started thread
+    """
+    thread = threading.Thread(target=ensure_indexes, args=(models,), name='ensure-indexes', daemon=True)
+    thread.start()
+    return thread
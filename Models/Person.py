@@ -39,3 +39,9 @@ class Person(Document):
     invites = ListField(default=[])
     date = EmbeddedDocumentField(PersonDate, default=PersonDate)
     pay_with = EmbeddedDocumentField(PayWith, default=PayWith)
+
+    # invites look people up by email, indexes are built by Models.ensure_indexes at startup
+    meta = {
+        'indexes': ['email'],
+        'auto_create_index': False
+    }
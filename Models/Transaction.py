@@ -17,6 +17,12 @@ class Item(Document):
     # if the usage_count turns to 0 we delete it from the db
     usage_count = IntField(default=0)
 
+    # items are matched on all three fields when they are created, each combination is stored once
+    meta = {
+        'indexes': [{'fields': ('name', 'desc', 'unit_price'), 'unique': True}],
+        'auto_create_index': False
+    }
+
 
 class TransactionItem(EmbeddedDocument):
     """
@@ -68,10 +74,37 @@ class Transaction(Document):
     # TODO - make required=true for final product
     receipt = ObjectIdField(required=False)
 
+    # incremented by every write, saves are conditional on it and it is served as the ETag
+    version = IntField(default=0)
+
+    # transactions are listed per group, newest purchase first
+    meta = {
+        'indexes': [('group', '-date_purchased', '-id')],
+        'auto_create_index': False
+    }
+
 
 class Receipt(Document):
     """
-    TODO - add docstring
+    Receipt class
     """
     receipt = ImageField(required=False)
 
+    # uploads are normalized in the background, the raw upload is served until then
+    status = StringField(default='pending', choices=('pending', 'ready', 'failed'))
+
+    # longest side in pixels -> file id in the `thumbnails` GridFS collection
+    thumbnails = DictField(default={})
+
+    # SHA-256 of the uploaded bytes, the same upload is stored once and shared by every transaction attaching it
+    digest = StringField(required=False)
+
+    # number of transactions referencing the receipt, it is deleted with the last one
+    refs = IntField(default=0)
+
+    # receipts stored before deduplication have no digest
+    meta = {
+        'indexes': [{'fields': ['digest'], 'unique': True, 'sparse': True}],
+        'auto_create_index': False
+    }
+
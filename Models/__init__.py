@@ -2,7 +2,9 @@
 Module containing the models for the application.
 """
 __all__ = ["Group", "GroupRestricted", "GroupDate", "GroupPermissions",
-           "Person", "TransactionItem", "Transaction", "Item", 'PayWith', 'PersonDate', 'Receipt']
+           "Person", "TransactionItem", "Transaction", "Item", 'PayWith', 'PersonDate', 'Receipt',
+           'ensure_indexes', 'ensure_indexes_async']
 from .Group import Group, GroupRestricted, GroupDate, GroupPermissions
 from .Person import Person, PayWith, PersonDate
 from .Transaction import Transaction, TransactionItem,  Item, Receipt
+from .Indexes import ensure_indexes, ensure_indexes_async
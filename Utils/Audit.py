@@ -0,0 +1,154 @@
+"""
+Vectorized recomputation of a group's ledger and balances from its transactions.
+"""
+import numpy as np
+
+from .Ledger import EPSILON
+
+# largest difference between a stored and a recomputed amount that is not reported as drift
+TOLERANCE = 1e-6
+
+
+def _indices(subs, index):
+    """
+    map subs to their position in the index without a python level loop
+    :param subs: list of subs
+    :param index: dictionary of sub -> position
+    :return: integer array
+    """
+    return np.fromiter(map(index.__getitem__, subs), dtype=np.int64, count=len(subs))
+
+
+def _lookup(keys, values, query_keys):
+    """
+    look up the value of every queried key, missing keys are zero
+    :param keys: integer array of unique keys
+    :param values: float array of their values
+    :param query_keys: integer array of the keys looked up
+    :return: float array
+    """
+    order = np.argsort(keys)
+    keys, values = keys[order], values[order]
+    found = np.minimum(np.searchsorted(keys, query_keys), len(keys) - 1)
+    return np.where(keys[found] == query_keys, values[found], 0.0)
+
+
+def _usage(keys, costs, query_keys, query_positions):
+    """
+    how much was used under a key up to and including a position, for many queries at once
+    :param keys: transaction and person code of every item, in stored order
+    :param costs: cost of every item
+    :param query_keys: transaction and person codes looked up
+    :param query_positions: item positions looked up
+    :return: float array of the used amounts
+    """
+    # running totals per key, items of one key stay in stored order since the sort is stable
+    order = np.argsort(keys, kind='stable')
+    keys, positions, costs = keys[order], order, costs[order]
+    totals = np.cumsum(costs)
+    totals -= np.concatenate(([0.0], totals))[np.searchsorted(keys, keys, side='left')]
+
+    # last item of the key at or before the queried position
+    span = len(order)
+    found = np.searchsorted(keys * span + positions, query_keys * span + query_positions, side='right') - 1
+    hit = (found >= 0) & (keys[np.maximum(found, 0)] == query_keys)
+    return np.where(hit, totals[np.maximum(found, 0)], 0.0)
+
+
+def recompute(transactions):
+    """
+    rebuild a group's ledger and balances from scratch out of what was paid and what every item's consumer used,
+    following Ledger.add_item_deltas item by item for every transaction at once
+    :param transactions: iterable of raw transaction documents holding `who_paid` and `items`
+    :return: tuple of (ledger, sparse balances, number of transactions read)
+    """
+    # flatten everything into parallel lists, one entry per payer and one per item
+    payer_transactions, payers, paid = [], [], []
+    item_transactions, consumers, costs = [], [], []
+    count = 0
+    for transaction in transactions:
+        who_paid = transaction.get('who_paid') or {}
+        payer_transactions += [count] * len(who_paid)
+        payers += who_paid.keys()
+        paid += who_paid.values()
+
+        items = transaction.get('items') or []
+        item_transactions += [count] * len(items)
+        consumers += [item['person'] for item in items]
+        costs += [item['item_cost'] for item in items]
+        count += 1
+
+    # number every sub once, then sum each of them with a single bincount, paid counts positive and used negative
+    people = list(dict.fromkeys(payers + consumers))
+    index = {p: i for i, p in enumerate(people)}
+    payer_codes, consumer_codes = _indices(payers, index), _indices(consumers, index)
+    paid, costs = np.asarray(paid, dtype=np.float64), np.asarray(costs, dtype=np.float64)
+
+    totals = np.bincount(np.concatenate((payer_codes, consumer_codes)), weights=np.concatenate((paid, -costs)),
+                         minlength=len(people))
+    ledger = dict(zip(people, totals.tolist()))
+
+    balances = {}
+    if not len(paid) or not len(costs):
+        return ledger, balances, count
+
+    # pair every item with every payer of its transaction
+    payer_transactions = np.asarray(payer_transactions, dtype=np.int64)
+    item_transactions = np.asarray(item_transactions, dtype=np.int64)
+    first_payer = np.searchsorted(payer_transactions, np.arange(count), side='left')
+    payer_count = np.bincount(payer_transactions, minlength=count)
+    per_item = payer_count[item_transactions]
+    item = np.repeat(np.arange(len(costs)), per_item)
+    payer = np.repeat(first_payer[item_transactions], per_item) + \
+        np.arange(len(item)) - np.repeat(np.cumsum(per_item) - per_item, per_item)
+    transaction, consumer, payer_code = item_transactions[item], consumer_codes[item], payer_codes[payer]
+
+    # what the consumer and the payer have left in the transaction's ledger deltas once the item is used
+    keys = item_transactions * len(people) + consumer_codes
+    consumer_keys, payer_keys = transaction * len(people) + consumer, transaction * len(people) + payer_code
+    used = _lookup(payer_transactions * len(people) + payer_codes, paid, consumer_keys) - \
+        _usage(keys, costs, consumer_keys, item)
+    left = paid[payer] - _usage(keys, costs, payer_keys, item)
+
+    # the payer is owed what the consumer is short of, at most what the payer has left
+    keep = (payer_code != consumer) & (used < 0)
+    amounts = np.where(used + left > 0, -used, np.abs(left))[keep]
+    rows = np.concatenate((payer_code[keep], consumer[keep]))
+    cols = np.concatenate((consumer[keep], payer_code[keep]))
+    values = np.concatenate((amounts, -amounts))
+
+    # a dense people x people bincount would not fit large groups, only the pairs that occur are numbered
+    codes, pairs = np.unique(rows * len(people) + cols, return_inverse=True)
+    totals = np.bincount(pairs, weights=values, minlength=len(codes))
+    keep = np.abs(totals) >= EPSILON
+    for code, total in zip(codes[keep].tolist(), totals[keep].tolist()):
+        p1, p2 = divmod(code, len(people))
+        balances.setdefault(people[p1], {})[people[p2]] = total
+
+    return ledger, balances, count
+
+
+def diff(restricted, ledger, balances, tolerance=TOLERANCE):
+    """
+    compare the stored ledger and balances of a group against recomputed ones
+    :param restricted: the group's raw `restricted` document
+    :param ledger: recomputed ledger
+    :param balances: recomputed sparse balances
+    :param tolerance: largest difference that is not reported
+    :return: list of (dotted path, stored value, recomputed value) for every drifted amount
+    """
+    drift = []
+    stored = restricted.get('ledger') or {}
+    for p in sorted(stored.keys() | ledger.keys()):
+        old, new = stored.get(p, 0), ledger.get(p, 0)
+        if abs(old - new) > tolerance:
+            drift.append((f'restricted.ledger.{p}', old, new))
+
+    stored = restricted.get('balances') or {}
+    for p1 in sorted(stored.keys() | balances.keys()):
+        old_row, new_row = stored.get(p1) or {}, balances.get(p1) or {}
+        for p2 in sorted(old_row.keys() | new_row.keys()):
+            old, new = old_row.get(p2, 0), new_row.get(p2, 0)
+            if abs(old - new) > tolerance:
+                drift.append((f'restricted.balances.{p1}.{p2}', old, new))
+    return drift
@@ -0,0 +1,186 @@
+"""
+Process-wide store of Google's id token signing certificates.
+"""
+import os
+import re
+import json
+import time
+import base64
+import threading
+from google.auth import jwt
+from google.auth import exceptions
+from google.auth.transport import requests
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_ISSUERS = ['accounts.google.com', 'https://accounts.google.com']
+
+
+def _b64_int(value):
+    """
+    decode a base64url encoded big endian integer from a JWK
+    """
+    value += '=' * (-len(value) % 4)
+    return int.from_bytes(base64.urlsafe_b64decode(value), 'big')
+
+
+def _jwk_to_pem(jwk):
+    """
+    convert an RSA JWK into a PEM encoded public key google.auth can verify with
+    :param jwk: dictionary holding at least the `n` and `e` members
+    :return: PEM string
+    """
+    n, e = _b64_int(jwk['n']), _b64_int(jwk['e'])
+    try:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa as crypto_rsa
+        key = crypto_rsa.RSAPublicNumbers(e, n).public_key()
+        pem = key.public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.PKCS1)
+    except ImportError:
+        import rsa
+        pem = rsa.PublicKey(n, e).save_pkcs1('PEM')
+    return pem.decode('utf-8')
+
+
+def load_certs(data):
+    """
+    normalize a certificate document into a mapping of key id to PEM
+    :param data: either Google's `{kid: x509}` format or a JWK set
+    :return: dictionary of key id to PEM
+    """
+    if 'keys' in data:
+        return {k['kid']: _jwk_to_pem(k) for k in data['keys'] if k.get('kty') == 'RSA'}
+    return dict(data)
+
+
+class CertStore:
+    """
+    Fetches Google's signing certificates once, keeps them for the Cache-Control max-age
+    and refreshes them from a background thread before they expire. Tokens are then
+    verified locally against the cached keys.
+    """
+
+    def __init__(self, certs_url=GOOGLE_CERTS_URL, certs_file=None, refresh_margin=300, retry_delay=30):
+        """
+        :param certs_url: url serving the signing certificates
+        :param certs_file: optional local JWKS / certificate file used instead of the url
+        :param refresh_margin: seconds before expiry at which the background refresh runs
+        :param retry_delay: seconds to wait before retrying a failed refresh
+        """
+        self.certs_url = certs_url
+        self.certs_file = certs_file
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self.fetches = 0
+        self._certs = None
+        self._expires = 0.0
+        self._fetched = 0.0
+        self._refresh_at = 0.0
+        self._request = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _fetch(self):
+        """
+        load the certificates from the file or the url
+        :return: tuple of certificates and seconds they stay valid
+        """
+        self.fetches += 1
+        if self.certs_file is not None:
+            with open(self.certs_file, 'r', encoding='UTF-8') as f:
+                return load_certs(json.load(f)), float('inf')
+
+        # reuse one session so the TLS connection to Google is kept alive
+        if self._request is None:
+            self._request = requests.Request()
+        response = self._request(self.certs_url, method='GET')
+        if response.status != 200:
+            raise exceptions.TransportError(f'Could not fetch certificates at {self.certs_url}')
+
+        max_age = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+        max_age = int(max_age.group(1)) if max_age else 0
+        return load_certs(json.loads(response.data.decode('utf-8'))), max_age
+
+    def refresh(self):
+        """
+        fetch the certificates now and replace the cached ones
+        """
+        certs, max_age = self._fetch()
+        with self._lock:
+            self._certs = certs
+            self._fetched = time.time()
+            # without a usable max-age the keys are still kept retry_delay, not refetched on every request
+            self._expires = self._fetched + max(max_age, self.retry_delay)
+            # refresh_margin before expiry, but never sooner than half the lifetime or retry_delay after this fetch
+            self._refresh_at = self._fetched + max(max_age - self.refresh_margin, max_age / 2, self.retry_delay)
+
+    def _refresh_once(self, stale):
+        """
+        refresh under a lock so concurrent requests fetch only once and the others use its result
+        :param stale: function telling if the certificates still need the refresh once the lock is held
+        """
+        with self._refresh_lock:
+            if stale():
+                self.refresh()
+
+    def _refresh_loop(self):
+        """
+        background thread body that refreshes the certificates before they expire
+        """
+        while True:
+            time.sleep(max(self._refresh_at - time.time(), 1))
+            try:
+                self.refresh()
+            except Exception as exp:
+                print(f"CertStore.refresh() => Exception: {exp}")
+                time.sleep(self.retry_delay)
+
+    def _ensure_thread(self):
+        """
+        start the refresh thread on first use in this process
+        """
+        if self.certs_file is not None:
+            return
+        if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._refresh_loop, name='cert-refresh', daemon=True)
+            self._thread.start()
+
+    def certs(self):
+        """
+        get the cached certificates, fetching them if they are missing or expired
+        :return: dictionary of key id to PEM
+        """
+        if self._certs is None:
+            self._refresh_once(lambda: self._certs is None)
+        elif self._expires <= time.time():
+            # keep serving the expired keys if Google cannot be reached, until the next attempt retry_delay later
+            try:
+                self._refresh_once(lambda: self._expires <= time.time())
+            except exceptions.TransportError as exp:
+                print(f"CertStore.certs() => Exception: {exp}")
+                self._expires = time.time() + self.retry_delay
+        self._ensure_thread()
+        return self._certs
+
+    def verify(self, token, audience=None, clock_skew_in_seconds=0):
+        """
+        verify a Google id token against the cached certificates
+        :param token: raw id token
+        :param audience: expected audience (the oauth client id)
+        :param clock_skew_in_seconds: allowed clock skew for iat and exp
+        :return: the decoded claims
+        """
+        certs = self.certs()
+
+        # the keys may have rotated before our copy expired, refetch at most once per retry_delay
+        kid = jwt.decode_header(token).get('kid')
+        if kid not in certs and self.certs_file is None and time.time() - self._fetched > self.retry_delay:
+            self._refresh_once(lambda: time.time() - self._fetched > self.retry_delay)
+            certs = self._certs
+
+        claims = jwt.decode(token, certs=certs, audience=audience, clock_skew_in_seconds=clock_skew_in_seconds)
+        if claims['iss'] not in GOOGLE_ISSUERS:
+            raise exceptions.GoogleAuthError(f"Wrong issuer. 'iss' should be one of the following: {GOOGLE_ISSUERS}")
+        return claims
@@ -0,0 +1,58 @@
+"""
+Normalization of uploaded receipt photos and thumbnail generation.
+"""
+import io
+from PIL import Image, ImageOps
+
+# longest side of a stored receipt, phone photos are usually 3000-4000 pixels
+MAX_SIZE = 2048
+
+# longest side of every thumbnail stored next to the receipt
+THUMBNAIL_SIZES = (256,)
+
+# receipts are re-encoded as progressive JPEG
+FORMAT = 'JPEG'
+CONTENT_TYPE = 'image/jpeg'
+QUALITY = 85
+THUMBNAIL_QUALITY = 75
+
+
+def _encode(image, quality):
+    """
+    encode an image in the storage format
+    :param image: PIL image
+    :param quality: JPEG quality
+    :return: the encoded bytes
+    """
+    out = io.BytesIO()
+    image.save(out, FORMAT, quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def normalize(fp, max_size=MAX_SIZE, thumbnail_sizes=THUMBNAIL_SIZES):
+    """
+    auto-orient a photo through its EXIF data, downsample it and re-encode it with its thumbnails
+    :param fp: file-like object holding the uploaded image
+    :param max_size: longest side of the normalized image
+    :param thumbnail_sizes: longest side of every thumbnail
+    :return: tuple of (normalized bytes, dictionary of thumbnail size -> bytes)
+    """
+    with Image.open(fp) as image:
+        # draft lets the JPEG decoder downscale while decoding, a large photo is never fully decoded
+        image.draft('RGB', (max_size, max_size))
+        image = ImageOps.exif_transpose(image)
+
+        # JPEG has no alpha channel, drop it (and any palette) before encoding
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        normalized = _encode(image, QUALITY)
+
+        thumbnails = {}
+        for size in sorted(thumbnail_sizes, reverse=True):
+            # each thumbnail is made from the previous (larger) one, which is cheaper than starting over
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            thumbnails[size] = _encode(image, THUMBNAIL_QUALITY)
+
+    return normalized, thumbnails
@@ -0,0 +1,67 @@
+"""
+Small thread safe least recently used cache.
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Mapping of at most `max_size` entries, the least recently used entry is evicted first.
+    """
+
+    def __init__(self, max_size=1024):
+        """
+        :param max_size: maximum number of entries kept
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        get an entry and mark it as recently used
+        :param key: key of the entry
+        :param default: returned if the key is not cached
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key, value):
+        """
+        add or replace an entry, evicting the least recently used one if full
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """
+        drop an entry if cached
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        drop every entry
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        get the hit / miss counters
+        :return: dictionary of hits, misses and size
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
@@ -0,0 +1,117 @@
+"""
+In-memory computation of the ledger and balance deltas of a transaction.
+"""
+
+
+# amounts closer to zero than this are treated as settled and not stored
+EPSILON = 1e-9
+
+
+def get_balance(balances, p1, p2):
+    """
+    read a pairwise balance from a sparse matrix, missing pairs are zero
+    :param balances: dictionary of dictionaries holding only the non-zero pairs
+    :return: how much p2 owes p1
+    """
+    return balances.get(p1, {}).get(p2, 0)
+
+
+def add_balance(balances, p1, p2, value):
+    """
+    add onto a pairwise balance of a sparse matrix, dropping the pair once it reaches zero
+    :param balances: dictionary of dictionaries holding only the non-zero pairs
+    """
+    row = balances.setdefault(p1, {})
+    value = row.get(p2, 0) + value
+    if abs(value) < EPSILON:
+        row.pop(p2, None)
+        if not row:
+            del balances[p1]
+    else:
+        row[p2] = value
+
+
+def compact(balances):
+    """
+    drop the zero pairs and empty rows of a balance matrix
+    :param balances: dictionary of dictionaries
+    :return: a new sparse matrix
+    """
+    sparse = {}
+    for p1, row in balances.items():
+        row = {p2: v for p2, v in row.items() if abs(v) >= EPSILON}
+        if row:
+            sparse[p1] = row
+    return sparse
+
+
+def add_item_deltas(who_paid, ledger_deltas, balance_deltas, sub, item_cost):
+    """
+    update the deltas of a transaction in place for one of its items
+    :param who_paid: dictionary of sub -> amount paid
+    :param ledger_deltas: the transaction's ledger deltas, must hold every payer and `sub`
+    :param balance_deltas: the transaction's sparse balance deltas
+    :param sub: who used the item
+    :param item_cost: the item's total cost
+    """
+    # deduct how much the person used from the ledger deltas
+    ledger_deltas[sub] -= item_cost
+
+    # iterate through everyone that has paid in this transaction
+    # this is so we can calculate who owes what in this transaction
+    for p_paid in who_paid.keys():
+        paid = ledger_deltas[p_paid]
+        used = ledger_deltas[sub]
+
+        # if person that paid is not the user
+        if p_paid != sub:
+            # if the person used more than the have paid in this transaction
+            if used < 0:
+                # if the amount paid is greater than the amount used
+                if used + paid > 0:
+                    add_balance(balance_deltas, p_paid, sub, -used)
+                    add_balance(balance_deltas, sub, p_paid, used)
+                # if the amount paid is equal to or less than the amount used
+                else:
+                    paid = paid if paid > 0 else -paid
+                    add_balance(balance_deltas, p_paid, sub, paid)
+                    add_balance(balance_deltas, sub, p_paid, -paid)
+
+
+def compute_deltas(members, who_paid, items):
+    """
+    compute how a transaction changes the group's ledger and balances
+    :param members: list of member subs of the group
+    :param who_paid: dictionary of sub -> amount paid
+    :param items: list of dictionaries holding at least `person` and `item_cost`, in the order they are added
+    :return: tuple of (ledger_deltas, sparse balance_deltas)
+    """
+    ledger_deltas = {p: who_paid.get(p, 0) for p in members}
+    balance_deltas = {}
+
+    for item in items:
+        add_item_deltas(who_paid, ledger_deltas, balance_deltas, item['person'], item['item_cost'])
+
+    return ledger_deltas, balance_deltas
+
+
+def inc_spec(ledger_deltas, balance_deltas, sign=1, spec=None):
+    """
+    build the `$inc` document that applies (or with sign=-1 reverts) transaction deltas on a group
+    :param ledger_deltas: the transaction's ledger deltas
+    :param balance_deltas: the transaction's balance deltas
+    :param sign: 1 to apply, -1 to revert
+    :param spec: optional `$inc` document to add onto, used to net several transactions into one write
+    :return: dictionary of dotted `restricted.ledger` / `restricted.balances` paths to increments, zeros dropped
+    """
+    spec = {} if spec is None else spec
+    for p, v in ledger_deltas.items():
+        path = f'restricted.ledger.{p}'
+        spec[path] = spec.get(path, 0) + sign * v
+
+    for p1, d in balance_deltas.items():
+        for p2, v in d.items():
+            path = f'restricted.balances.{p1}.{p2}'
+            spec[path] = spec.get(path, 0) + sign * v
+
+    return {k: v for k, v in spec.items() if abs(v) >= EPSILON}
@@ -0,0 +1,165 @@
+"""
+Per endpoint request and database metrics, rendered in the Prometheus text format.
+"""
+import time
+import threading
+from collections import deque
+from flask import g, request
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _quantile(samples, q):
+    """
+    nearest rank quantile of a sorted list
+    """
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def _labels(pairs):
+    """
+    render a label set in the Prometheus text format
+    :param pairs: dictionary of label name -> value
+    """
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for v in pairs.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(pairs, escaped)) + '}'
+
+
+class _Endpoint:
+    """
+    Totals of one endpoint and a window of its most recent samples.
+    """
+
+    def __init__(self, window):
+        self.requests = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.db_docs = 0
+        self.latencies = deque(maxlen=window)
+        self.db_times = deque(maxlen=window)
+
+
+class Metrics:
+    """
+    Flask extension keeping per endpoint totals (requests, errors, latency, MongoDB commands, time and
+    documents) and the latency / database time quantiles of the last `window` requests of each endpoint.
+    The MongoDB figures are collected by Utils.RequestLog.QueryCounter.
+    Every gunicorn worker keeps its own metrics, they are labelled with the worker pid.
+    """
+
+    def __init__(self, app=None, window=1024, query_header=False, prefix='smart_ledger'):
+        """
+        :param app: Flask app
+        :param window: number of recent requests of each endpoint the quantiles are computed on
+        :param query_header: add the X-DB-Queries / X-DB-Time headers to every response
+        :param prefix: prefix of the metric names
+        """
+        self.window = window
+        self.query_header = query_header
+        self.prefix = prefix
+        self._endpoints = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        register the request hooks on the app
+        """
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def register(self, name, help_text, collect, kind='counter'):
+        """
+        add a metric that is read from elsewhere when the metrics are rendered, like the counters of a cache
+        :param name: metric name without the prefix
+        :param help_text: description of the metric
+        :param collect: function returning a list of (dictionary of labels, value)
+        :param kind: Prometheus metric type, counter or gauge
+        """
+        self._collectors.append((name, help_text, collect, kind))
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+
+    def _after_request(self, response):
+        latency = time.perf_counter() - g.get('metrics_start', time.perf_counter())
+        db_queries, db_time = g.get('db_queries', 0), g.get('db_time', 0.0)
+
+        # the route pattern keeps the label set bounded, unlike the path
+        rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        with self._lock:
+            endpoint = self._endpoints.get((request.method, rule))
+            if endpoint is None:
+                endpoint = self._endpoints[(request.method, rule)] = _Endpoint(self.window)
+            endpoint.requests += 1
+            endpoint.errors += response.status_code >= 500
+            endpoint.latency += latency
+            endpoint.db_queries += db_queries
+            endpoint.db_time += db_time
+            endpoint.db_docs += g.get('db_docs', 0)
+            endpoint.latencies.append(latency)
+            endpoint.db_times.append(db_time)
+
+        if self.query_header:
+            response.headers['X-DB-Queries'] = str(db_queries)
+            response.headers['X-DB-Time'] = f'{db_time * 1000:.2f}ms'
+        return response
+
+    def snapshot(self):
+        """
+        get a copy of the metrics
+        :return: dictionary of (method, rule) -> dictionary of totals and quantiles
+        """
+        with self._lock:
+            endpoints = {key: (vars(e).copy(), sorted(e.latencies), sorted(e.db_times))
+                         for key, e in self._endpoints.items()}
+
+        snapshot = {}
+        for key, (totals, latencies, db_times) in endpoints.items():
+            del totals['latencies'], totals['db_times']
+            totals['latency_quantiles'] = {q: _quantile(latencies, q) for q in QUANTILES}
+            totals['db_time_quantiles'] = {q: _quantile(db_times, q) for q in QUANTILES}
+            snapshot[key] = totals
+        return snapshot
+
+    def render(self, pid=None):
+        """
+        render the metrics in the Prometheus text exposition format
+        :param pid: value of the pid label
+        :return: the text
+        """
+        snapshot = sorted(self.snapshot().items())
+        p = self.prefix
+        lines = []
+
+        def labels(method, rule, **extra):
+            return _labels({'method': method, 'endpoint': rule, **({'pid': pid} if pid is not None else {}), **extra})
+
+        counters = (('requests_total', 'requests', 'Requests handled.'),
+                    ('errors_total', 'errors', 'Requests answered with a 5xx status.'),
+                    ('db_queries_total', 'db_queries', 'MongoDB commands issued.'),
+                    ('db_documents_total', 'db_docs', 'MongoDB documents returned or written.'),
+                    ('db_seconds_total', 'db_time', 'Time spent in MongoDB commands.'))
+        for name, field, help_text in counters:
+            lines += [f'# HELP {p}_{name} {help_text}', f'# TYPE {p}_{name} counter']
+            lines += [f'{p}_{name}{labels(*key)} {totals[field]}' for key, totals in snapshot]
+
+        summaries = (('request_seconds', 'latency', 'latency_quantiles', 'requests', 'Request latency.'),
+                     ('request_db_seconds', 'db_time', 'db_time_quantiles', 'requests',
+                      'Time spent in MongoDB commands per request.'))
+        for name, total, quantiles, count, help_text in summaries:
+            lines += [f'# HELP {p}_{name} {help_text}', f'# TYPE {p}_{name} summary']
+            for key, totals in snapshot:
+                lines += [f'{p}_{name}{labels(*key, quantile=q)} {v:.6f}' for q, v in totals[quantiles].items()]
+                lines.append(f'{p}_{name}_sum{labels(*key)} {totals[total]:.6f}')
+                lines.append(f'{p}_{name}_count{labels(*key)} {totals[count]}')
+
+        worker = {'pid': pid} if pid is not None else {}
+        for name, help_text, collect, kind in self._collectors:
+            lines += [f'# HELP {p}_{name} {help_text}', f'# TYPE {p}_{name} {kind}']
+            lines += [f'{p}_{name}{_labels({**worker, **extra})} {value}' for extra, value in collect()]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,211 @@
+"""
+Structured request logging: one JSON line per request, written from a background thread.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import datetime
+import threading
+import traceback
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, request, has_request_context
+from pymongo import monitoring
+
+
+class QueryCounter(monitoring.CommandListener):
+    """
+    Attributes every MongoDB command, with its duration and number of documents, to the request that issued it.
+    pymongo calls listeners in the thread that runs the command, so `flask.g` is the issuing request's.
+    Must be registered before the MongoClient is created.
+    """
+
+    def __init__(self, slow_ms=None, on_slow=None):
+        """
+        :param slow_ms: commands taking longer than this many milliseconds are passed to on_slow
+        :param on_slow: called with a dictionary describing every slow command
+        """
+        self.slow_ms = slow_ms
+        self.on_slow = on_slow
+
+    def started(self, event):
+        if not has_request_context():
+            return
+        g.db_queries = g.get('db_queries', 0) + 1
+        if self.slow_ms is not None:
+            # the collection is only known when the command starts
+            pending = g.setdefault('db_pending', {})
+            pending[event.request_id] = event.command.get(event.command_name)
+
+    def _finished(self, event, docs):
+        if not has_request_context():
+            return
+        g.db_time = g.get('db_time', 0.0) + event.duration_micros / 1e6
+        g.db_docs = g.get('db_docs', 0) + docs
+
+        if self.slow_ms is None:
+            return
+        collection = g.get('db_pending', {}).pop(event.request_id, None)
+        if event.duration_micros / 1000 >= self.slow_ms and self.on_slow is not None:
+            self.on_slow({'slow_query': event.command_name,
+                          'collection': collection if isinstance(collection, str) else None,
+                          'duration_ms': round(event.duration_micros / 1000, 2),
+                          'docs': docs,
+                          'path': request.path})
+
+    def succeeded(self, event):
+        # documents returned by a cursor or affected by a write
+        reply = event.reply
+        cursor = reply.get('cursor') or {}
+        docs = len(cursor.get('firstBatch', cursor.get('nextBatch', ()))) + reply.get('n', 0)
+        self._finished(event, docs)
+
+    def failed(self, event):
+        self._finished(event, 0)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records whose message is a dictionary as one JSON line.
+    """
+
+    def format(self, record):
+        data = {'ts': datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+                'level': record.levelname}
+        if isinstance(record.msg, dict):
+            data.update(record.msg)
+        else:
+            data['msg'] = record.getMessage()
+        if record.exc_info:
+            data['error'] = repr(record.exc_info[1])
+            data['traceback'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, separators=(',', ':'))
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """
+    Queue handler that never blocks the request: records are dropped (and counted) once the queue is full.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # formatting is left to the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RequestLog:
+    """
+    Flask extension logging every request as one JSON line with its method, path, status, latency,
+    authenticated sub and number of MongoDB commands. Records go through a bounded queue and are
+    written by a background thread, successful requests can be sampled.
+    """
+
+    def __init__(self, app=None, sample_rate=1.0, stream=None, max_queue=10000, name='smart-ledger.requests'):
+        """
+        :param app: Flask app
+        :param sample_rate: fraction of the successful (< 400) requests that are logged, errors are always logged
+        :param stream: where the lines are written, defaults to stdout
+        :param max_queue: most records waiting to be written before new ones are dropped
+        :param name: name of the logger
+        """
+        self.sample_rate = sample_rate
+        self.stream = stream
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        # instances on the same logger (e.g. the app imported twice) share one handler, a second one would
+        # write every line twice
+        self._handler = next((h for h in self.logger.handlers if isinstance(h, _DroppingQueueHandler)), None)
+        if self._handler is None:
+            self._handler = _DroppingQueueHandler(queue.Queue(max_queue))
+            self.logger.addHandler(self._handler)
+        self._queue = self._handler.queue
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    @property
+    def dropped(self):
+        """
+        number of records dropped because the queue was full
+        """
+        return self._handler.dropped
+
+    def init_app(self, app):
+        """
+        register the request hooks on the app
+        """
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _ensure_listener(self):
+        """
+        start the writer thread on first use in this process
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                handler = logging.StreamHandler(self.stream or sys.stdout)
+                handler.setFormatter(JsonFormatter())
+                self._listener = QueueListener(self._queue, handler)
+                self._listener.start()
+                self._pid = os.getpid()
+                atexit.register(self._listener.stop)
+
+    def log(self, record, level=logging.INFO, exc_info=None):
+        """
+        write any other structured record through the same queue
+        :param record: dictionary logged as one json line
+        :param exc_info: exception (or True for the one being handled) whose traceback is added to the line
+        """
+        self._ensure_listener()
+        self.logger.log(level, record, exc_info=exc_info)
+
+    def _before_request(self):
+        g.request_start = time.perf_counter()
+        g.db_queries = 0
+
+    def _after_request(self, response):
+        error = g.get('request_error')
+        if error is None and response.status_code < 400 and random.random() >= self.sample_rate:
+            return response
+
+        self._ensure_listener()
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'latency_ms': round((time.perf_counter() - g.get('request_start', time.perf_counter())) * 1000, 2),
+            'sub': g.get('sub'),
+            # set from X-Forwarded-For by ProxyFix only for the trusted proxies, the raw header is client controlled
+            'ip': request.remote_addr,
+            'db_queries': g.get('db_queries', 0),
+            'db_ms': round(g.get('db_time', 0.0) * 1000, 2),
+            'db_docs': g.get('db_docs', 0)
+        }
+        if g.get('auth_error') is not None:
+            record['auth_error'] = g.auth_error
+        if error is not None:
+            record['error'] = repr(error)
+            record['traceback'] = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+        if response.status_code >= 500:
+            self.logger.error(record)
+        else:
+            self.logger.info(record)
+        return response
@@ -0,0 +1,106 @@
+"""
+Debt simplification: turn a group's ledger into a small set of transfers that settles it.
+"""
+import heapq
+
+# the exact search is exponential in the number of members with a non-zero balance
+EXACT_MAX_MEMBERS = 15
+
+
+def _to_cents(ledger):
+    """
+    convert a ledger to integer cents, dropping settled members
+    :param ledger: dictionary of sub -> amount owed to them (negative if they owe)
+    :return: dictionary of sub -> cents
+    """
+    cents = {p: int(round(v * 100)) for p, v in ledger.items()}
+    return {p: v for p, v in cents.items() if v != 0}
+
+
+def _greedy(cents):
+    """
+    match the largest debtor with the largest creditor until everything is settled
+    :param cents: dictionary of sub -> cents, should sum to zero
+    :return: list of (debtor, creditor, cents)
+    """
+    # heapq is a min heap so amounts are negated, the sub breaks ties deterministically
+    creditors = [(-v, p) for p, v in cents.items() if v > 0]
+    debtors = [(v, p) for p, v in cents.items() if v < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+
+        # push back whatever is left over
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
+
+
+def _exact(cents):
+    """
+    find the minimum number of transfers by splitting the members into as many zero-sum subsets
+    as possible, each subset of k members then settles with k - 1 transfers
+    :param cents: dictionary of sub -> cents, should sum to zero
+    :return: list of (debtor, creditor, cents)
+    """
+    people = sorted(cents)
+    amounts = [cents[p] for p in people]
+    n = len(people)
+    full = (1 << n) - 1
+
+    # sum of every subset
+    sums = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = (mask & -mask).bit_length() - 1
+        sums[mask] = sums[mask & (mask - 1)] + amounts[low]
+
+    # best[mask] = most zero-sum groups the members of mask can be split into
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        best[mask] = max(best[mask & ~(1 << i)] for i in range(n) if mask & (1 << i)) + (sums[mask] == 0)
+
+    # walk back through the table to recover an order in which every zero-sum prefix closes a group
+    order = []
+    mask = full
+    while mask:
+        for i in range(n):
+            bit = 1 << i
+            if mask & bit and best[mask & ~bit] + (sums[mask] == 0) == best[mask]:
+                order.append(i)
+                mask &= ~bit
+                break
+    order.reverse()
+
+    # settle every group on its own
+    transfers = []
+    group, total = {}, 0
+    for i in order:
+        group[people[i]] = amounts[i]
+        total += amounts[i]
+        if total == 0:
+            transfers += _greedy(group)
+            group = {}
+    return transfers + _greedy(group)
+
+
+def settle(ledger, exact=False):
+    """
+    compute the transfers that settle a group's ledger
+    :param ledger: dictionary of sub -> amount owed to them (negative if they owe)
+    :param exact: search for the minimum number of transfers, only used for groups of up to EXACT_MAX_MEMBERS
+    :return: tuple of (list of transfer dictionaries, mode used)
+    """
+    cents = _to_cents(ledger)
+    if exact and len(cents) <= EXACT_MAX_MEMBERS:
+        mode, transfers = 'exact', _exact(cents)
+    else:
+        mode, transfers = 'greedy', _greedy(cents)
+    return [{'from': debtor, 'to': creditor, 'amount': amount / 100} for debtor, creditor, amount in transfers], mode
@@ -0,0 +1,145 @@
+"""
+Bounded TTL cache for verified Google id tokens.
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class TokenCache:
+    """
+    Caches the verified claims of a token until the token's `exp` and the
+    resolved Person for a short window. Entries are keyed by the sha256 of the
+    raw token so the token itself is never kept in memory.
+    """
+
+    def __init__(self, max_size=4096, person_ttl=5.0):
+        """
+        :param max_size: maximum number of tokens kept, least recently used are evicted first
+        :param person_ttl: seconds a resolved Person is reused before it is read from the DB again
+        """
+        self.max_size = max_size
+        self.person_ttl = person_ttl
+        # claims and persons are counted apart, a request looks up both but only misses the claims once per token
+        self.claim_hits = 0
+        self.claim_misses = 0
+        self.person_hits = 0
+        self.person_misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        """
+        get the cache key of a raw token
+        :param token: raw id token string
+        :return: hex digest of the token
+        """
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get_claims(self, key):
+        """
+        get the verified claims of a token
+        :param key: cache key of the token
+        :return: the claims dictionary or None if not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['exp'] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.claim_misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.claim_hits += 1
+            return entry['claims']
+
+    def put_claims(self, key, claims):
+        """
+        cache the verified claims of a token until it expires
+        :param key: cache key of the token
+        :param claims: claims returned by id_token.verify_oauth2_token
+        """
+        with self._lock:
+            self._entries[key] = {
+                'claims': claims,
+                'exp': float(claims.get('exp', 0)),
+                'sub': claims.get('sub'),
+                'person': None,
+                'person_expires': 0.0
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_sub(self, key):
+        """
+        get the subject of an already verified token, without touching the counters or the eviction order
+        :param key: cache key of the token
+        :return: the subject or None if not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['exp'] <= time.time():
+                return None
+            return entry['sub']
+
+    def get_person(self, key, document):
+        """
+        get the Person resolved for a token
+        :param key: cache key of the token
+        :param document: Document class used to rebuild the cached person
+        :return: a fresh Person instance or None if not cached or stale
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['person'] is None or entry['person_expires'] <= time.monotonic():
+                self.person_misses += 1
+                return None
+            self.person_hits += 1
+            son = entry['person']
+
+        # rebuild per request so handlers never share a mutable document
+        return document._from_son(son)
+
+    def put_person(self, key, person):
+        """
+        cache the Person resolved for a token
+        :param key: cache key of the token
+        :param person: Person document
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry['person'] = person.to_mongo()
+            entry['person_expires'] = time.monotonic() + self.person_ttl
+
+    def invalidate(self, sub):
+        """
+        drop the cached Person of every token belonging to the given subject
+        :param sub: subject whose person document changed
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                if entry['sub'] == sub:
+                    entry['person'] = None
+                    entry['person_expires'] = 0.0
+
+    def clear(self):
+        """
+        drop every cached token
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        get the cache counters
+        :return: dictionary of the claims and persons hits and misses, and the current size
+        """
+        with self._lock:
+            return {'claims': {'hits': self.claim_hits, 'misses': self.claim_misses},
+                    'persons': {'hits': self.person_hits, 'misses': self.person_misses},
+                    'size': len(self._entries)}
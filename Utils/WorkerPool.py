@@ -0,0 +1,73 @@
+"""
+Bounded pool of background worker threads.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WorkerPool:
+    """
+    Runs jobs on a fixed number of threads with a bounded backlog. When the backlog is full the
+    job runs in the calling thread instead, so a burst slows requests down rather than piling up
+    unbounded work in memory.
+    """
+
+    def __init__(self, max_workers=2, max_pending=32, name='worker'):
+        """
+        :param max_workers: number of worker threads
+        :param max_pending: most jobs queued or running at once
+        :param name: prefix of the thread names
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.name = name
+        self._executor = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+
+    def _ensure_executor(self):
+        """
+        create the executor on first use in this process
+        """
+        with self._lock:
+            if self._pid != os.getpid() or self._executor is None:
+                self._pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix=self.name)
+            return self._executor
+
+    def submit(self, func, *args, **kwargs):
+        """
+        run a job in the background, or right away if the backlog is full
+        :param func: the job
+        :return: True if the job was queued, False if it ran in the calling thread
+        """
+        executor = self._ensure_executor()
+        if not self._slots.acquire(blocking=False):
+            func(*args, **kwargs)
+            return False
+
+        slots = self._slots
+
+        def run():
+            try:
+                func(*args, **kwargs)
+            except Exception as exp:
+                print(f"WorkerPool({self.name}) => Exception: {exp}")
+            finally:
+                slots.release()
+
+        executor.submit(run)
+        return True
+
+    def shutdown(self, wait=True):
+        """
+        stop the worker threads
+        :param wait: wait for the queued jobs to finish
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,14 @@
+"""
+Module containing the helpers shared by the application.
+"""
+__all__ = ["TokenCache", "CertStore", "Ledger", "Settlement", "Audit", "WorkerPool", "LRUCache", "RequestLog", "QueryCounter", "Metrics", "ImageProcessing"]
+from .TokenCache import TokenCache
+from .CertStore import CertStore
+from .WorkerPool import WorkerPool
+from .LRUCache import LRUCache
+from .RequestLog import RequestLog, QueryCounter
+from .Metrics import Metrics
+from . import Ledger
+from . import Settlement
+from . import Audit
+from . import ImageProcessing
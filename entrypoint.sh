@@ -37,7 +37,8 @@ $INTERPRETER ./scripts/CreateApiUser.py $ADMIN_USER $ADMIN_PASS || exit 1;
 # TODO: Adding test data to MongoDB if DEBUG env variable is set
 
 echo "## 4. Starting API Server with Gunicorn"
-gunicorn --bind 0.0.0.0:5000 App:app
+# workers, worker class and the MongoDB pool are configured through the environment, see gunicorn.conf.py
+gunicorn -c gunicorn.conf.py App:app
 
 echo "#################################################################"
 echo "## END                   entrypoint.sh                         ##"
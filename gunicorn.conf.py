@@ -0,0 +1,56 @@
+"""
+Gunicorn launch configuration of the API: gunicorn -c gunicorn.conf.py App:app
+
+Every setting can be changed through the environment:
+- GUNICORN_BIND: address to listen on (0.0.0.0:5000)
+- GUNICORN_WORKERS: number of worker processes (2 * CPU + 1)
+- GUNICORN_WORKER_CLASS: sync, gthread or gevent (gthread)
+- GUNICORN_THREADS: threads of every gthread worker (4)
+- GUNICORN_WORKER_CONNECTIONS: greenlets of every gevent worker (100)
+- GUNICORN_TIMEOUT / GUNICORN_KEEPALIVE: seconds before a silent worker is restarted / a keep-alive connection is closed
+
+The concurrency of one worker is exported as WORKER_CONCURRENCY so App.py sizes the MongoDB pool to match.
+"""
+import os
+import multiprocessing
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# gevent is optional, fall back to threads when it is not installed
+if worker_class == 'gevent':
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        print("WARNING: gevent is not installed, using the gthread worker class")
+        worker_class = 'gthread'
+
+if worker_class == 'gevent':
+    concurrency = worker_connections
+elif worker_class == 'gthread':
+    concurrency = threads
+else:
+    concurrency = 1
+
+# the app is imported by every worker after the fork, a MongoClient or thread pool must never be shared. Threads do not
+# survive a fork, so WorkerPool, CertStore and RequestLog start theirs on first use in each worker process
+preload_app = False
+
+# one json line per request is already written by the request log
+accesslog = None
+errorlog = '-'
+
+os.environ['WORKER_CONCURRENCY'] = str(concurrency)
+
+
+def on_starting(server):
+    """
+    print the launch configuration
+    """
+    print(f"# gunicorn: {workers} x {worker_class} workers, {concurrency} concurrent requests each")
@@ -0,0 +1,109 @@
+"""
+Audit the ledger and balances of every group.
+
+Recomputes each group's ledger and balances from what was paid and what every item's consumer used
+in its transactions, then reports every stored amount that drifted.
+Groups are checked in parallel, one MongoDB connection per worker process.
+
+With --fix the difference is applied to the group as one $inc, run it while the API is idle
+so no transaction is created between the recomputation and the fix.
+"""
+import os
+import sys
+import time
+import argparse
+from multiprocessing import Pool
+
+import path
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+
+directory = path.Path(__file__).abspath()
+sys.path.append(directory.parent.parent)
+from Utils.Audit import recompute, diff, TOLERANCE
+
+# only the fields the recomputation reads
+PROJECTION = {'_id': 0, 'who_paid': 1, 'items.person': 1, 'items.item_cost': 1}
+
+db = None
+
+
+def connect():
+    """
+    open this process's connection, pymongo clients must not be shared across a fork
+    """
+    global db
+    client = MongoClient(host=os.environ['MONGO_HOST'],
+                         username=os.environ['API_USERNAME'],
+                         password=os.environ['API_PASSWORD'],
+                         authSource='smart-ledger')
+    # the database the API writes to, MONGO_DB like App.py, the API user itself lives in smart-ledger
+    db = client[os.environ.get('MONGO_DB', 'smart-ledger')]
+
+
+def recompute_balances(group_id, fix=False, tolerance=TOLERANCE):
+    """
+    recompute one group's ledger and balances and compare them to the stored ones
+    :param group_id: ObjectId of the group
+    :param fix: apply the difference to the group
+    :param tolerance: largest difference that is not reported
+    :return: tuple of (group id, transactions read, list of drifted amounts)
+    """
+    group = db['group'].find_one({'_id': group_id}, {'restricted.ledger': 1, 'restricted.balances': 1})
+    if group is None:
+        return group_id, 0, []
+
+    # one cursor over the group's transactions, served by the (group, date_purchased, _id) index
+    cursor = db['transaction'].find({'group': group_id}, PROJECTION, batch_size=10000)
+    ledger, balances, count = recompute(cursor)
+    drift = diff(group.get('restricted') or {}, ledger, balances, tolerance)
+
+    if fix and drift:
+        # the version moves on like on every API write, cached settlements and ETags of the group are dropped
+        db['group'].update_one({'_id': group_id}, {'$inc': {**{p: new - old for p, old, new in drift}, 'version': 1}})
+    return group_id, count, drift
+
+
+def _recompute(args):
+    """
+    Pool.imap_unordered only passes one argument
+    """
+    return recompute_balances(*args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit the ledger and balances of every group.')
+    parser.add_argument('groups', nargs='*', help='group ids to check, every group if omitted')
+    parser.add_argument('--fix', action='store_true', help='apply the recomputed values')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='largest difference not reported')
+    args = parser.parse_args()
+
+    print("Attempting to connect to MongoDB...")
+    connect()
+    if args.groups:
+        groups = [ObjectId(g) for g in args.groups]
+    else:
+        groups = [g['_id'] for g in db['group'].find({}, {'_id': 1})]
+
+    start = time.perf_counter()
+    drifted, transactions = 0, 0
+    with Pool(args.workers, initializer=connect) as pool:
+        jobs = [(g, args.fix, args.tolerance) for g in groups]
+        for group_id, count, drift in pool.imap_unordered(_recompute, jobs, chunksize=16):
+            transactions += count
+            if not drift:
+                continue
+            drifted += 1
+            print(f"group {group_id}: {len(drift)} amounts drifted{' (fixed)' if args.fix else ''}")
+            for field, old, new in drift:
+                print(f"  {field}: stored {old:.6f}, recomputed {new:.6f}")
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(groups)} groups, {transactions} transactions checked in {elapsed:.2f}s "
+          f"({transactions / max(elapsed, 1e-9):,.0f} transactions/s), {drifted} groups drifted")
+    sys.exit(1 if drifted and not args.fix else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Reference count the receipts and delete the orphaned ones.
+
+Receipts used to be left behind when their transaction was deleted or given a new receipt.
+Sets Receipt.refs to the number of transactions referencing each receipt, deletes the receipts no
+transaction references and every GridFS file (image or thumbnail) no receipt references.
+Run it while the API is idle, an upload in progress has a file but no receipt yet.
+"""
+import os
+import sys
+
+import gridfs
+from pymongo import MongoClient, UpdateOne
+
+if len(sys.argv) > 2:
+    print('Usage: python3 CleanupReceipts.py [--dry-run]')
+    sys.exit()
+
+DRY_RUN = len(sys.argv) == 2 and sys.argv[1] == '--dry-run'
+BATCH_SIZE = 1000
+
+# create the connection
+print("Attempting to connect to MongoDB...")
+client = MongoClient(host=os.environ['MONGO_HOST'],
+                     username=os.environ['API_USERNAME'],
+                     password=os.environ['API_PASSWORD'],
+                     authSource='smart-ledger')
+
+# the database the API writes to, MONGO_DB like App.py
+db = client[os.environ.get('MONGO_DB', 'smart-ledger')]
+
+# number of transactions referencing every receipt
+refs = {r['_id']: r['count'] for r in db['transaction'].aggregate([
+    {'$match': {'receipt': {'$ne': None}}},
+    {'$group': {'_id': '$receipt', 'count': {'$sum': 1}}}
+])}
+
+counted, deleted = 0, 0
+files = {'images': set(), 'thumbnails': set()}
+requests = []
+for receipt in db['receipt'].find({}, {'refs': 1, 'receipt': 1, 'thumbnails': 1}):
+    count = refs.get(receipt['_id'], 0)
+    if count == 0:
+        deleted += 1
+        if not DRY_RUN:
+            db['receipt'].delete_one({'_id': receipt['_id']})
+        continue
+
+    # files of the receipts that are kept
+    if receipt.get('receipt') is not None:
+        files['images'].add(receipt['receipt'])
+    files['thumbnails'].update((receipt.get('thumbnails') or {}).values())
+
+    if receipt.get('refs') != count:
+        counted += 1
+        requests.append(UpdateOne({'_id': receipt['_id']}, {'$set': {'refs': count}}))
+    if len(requests) >= BATCH_SIZE and not DRY_RUN:
+        db['receipt'].bulk_write(requests, ordered=False)
+        requests = []
+
+if requests and not DRY_RUN:
+    db['receipt'].bulk_write(requests, ordered=False)
+print(f"receipt: {counted} reference counts fixed, {deleted} orphaned receipts deleted")
+
+# files left behind by the deleted receipts (and by receipts deleted before this script existed)
+for collection, kept in files.items():
+    fs = gridfs.GridFS(db, collection)
+    orphans, size = 0, 0
+    for f in db[f'{collection}.files'].find({}, {'_id': 1, 'length': 1}):
+        if f['_id'] in kept:
+            continue
+        orphans += 1
+        size += f.get('length', 0)
+        if not DRY_RUN:
+            fs.delete(f['_id'])
+    print(f"{collection}: {orphans} orphaned files deleted ({size / 1024 / 1024:.1f} MiB)")
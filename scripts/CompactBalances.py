@@ -0,0 +1,78 @@
+"""
+Compact the balance matrices to the sparse representation.
+
+Drops every zero pair from Group.restricted.balances and Transaction.balance_deltas, missing
+pairs read as zero. Prints the total document size of both collections before and after.
+"""
+import os
+import sys
+
+import bson
+import path
+from pymongo import MongoClient, UpdateOne
+
+directory = path.Path(__file__).abspath()
+sys.path.append(directory.parent.parent)
+from Utils.Ledger import compact
+
+if len(sys.argv) > 2:
+    print('Usage: python3 CompactBalances.py [--dry-run]')
+    sys.exit()
+
+DRY_RUN = len(sys.argv) == 2 and sys.argv[1] == '--dry-run'
+BATCH_SIZE = 1000
+
+# create the connection
+print("Attempting to connect to MongoDB...")
+client = MongoClient(host=os.environ['MONGO_HOST'],
+                     username=os.environ['API_USERNAME'],
+                     password=os.environ['API_PASSWORD'],
+                     authSource='smart-ledger')
+
+# the database the API writes to, MONGO_DB like App.py
+db = client[os.environ.get('MONGO_DB', 'smart-ledger')]
+
+
+def compact_collection(collection, field):
+    """
+    compact one balance field of every document in a collection
+    :param collection: pymongo collection
+    :param field: dotted path of the balance matrix
+    :return: tuple of (documents changed, total bytes before, total bytes after)
+    """
+    changed, size_before, size_after = 0, 0, 0
+    requests = []
+    for document in collection.find({}):
+        before = len(bson.encode(document))
+        size_before += before
+
+        # walk down to the matrix
+        parent, key = document, field
+        for part in field.split('.')[:-1]:
+            parent = parent.get(part) or {}
+        key = field.split('.')[-1]
+        balances = parent.get(key) or {}
+
+        sparse = compact(balances)
+        if sparse == balances:
+            size_after += before
+            continue
+
+        parent[key] = sparse
+        size_after += len(bson.encode(document))
+        changed += 1
+        requests.append(UpdateOne({'_id': document['_id']}, {'$set': {field: sparse}}))
+
+        if len(requests) >= BATCH_SIZE and not DRY_RUN:
+            collection.bulk_write(requests, ordered=False)
+            requests = []
+
+    if requests and not DRY_RUN:
+        collection.bulk_write(requests, ordered=False)
+    return changed, size_before, size_after
+
+
+for name, field in [('group', 'restricted.balances'), ('transaction', 'balance_deltas')]:
+    changed, size_before, size_after = compact_collection(db[name], field)
+    print(f"{name}: {changed} documents compacted, "
+          f"{size_before / 1024:.1f} KiB -> {size_after / 1024:.1f} KiB")
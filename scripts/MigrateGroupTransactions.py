@@ -0,0 +1,50 @@
+"""
+Move Group.restricted.transactions out of the group documents.
+
+Transactions are looked up through the indexed Transaction.group field, so the embedded
+list is only kept in sync with it and then removed.
+"""
+import os
+import sys
+
+from pymongo import MongoClient, UpdateMany
+
+if len(sys.argv) > 2:
+    print('Usage: python3 MigrateGroupTransactions.py [--dry-run]')
+    sys.exit()
+
+DRY_RUN = len(sys.argv) == 2 and sys.argv[1] == '--dry-run'
+
+# create the connection
+print("Attempting to connect to MongoDB...")
+client = MongoClient(host=os.environ['MONGO_HOST'],
+                     username=os.environ['API_USERNAME'],
+                     password=os.environ['API_PASSWORD'],
+                     authSource='smart-ledger')
+
+# the database the API writes to, MONGO_DB like App.py
+db = client[os.environ.get('MONGO_DB', 'smart-ledger')]
+
+# point every listed transaction at its group, in case the two ever disagreed
+groups = db['group'].find({'restricted.transactions': {'$exists': True}}, {'restricted.transactions': 1})
+requests = []
+num_groups = 0
+for group in groups:
+    num_groups += 1
+    transaction_ids = group['restricted'].get('transactions') or []
+    if transaction_ids:
+        requests.append(UpdateMany({'_id': {'$in': transaction_ids}, 'group': {'$ne': group['_id']}},
+                                   {'$set': {'group': group['_id']}}))
+
+print(f"Groups to migrate: {num_groups}")
+if DRY_RUN:
+    sys.exit()
+
+if requests:
+    result = db['transaction'].bulk_write(requests, ordered=False)
+    print(f"Transactions re-linked to their group: {result.modified_count}")
+
+# drop the embedded lists
+result = db['group'].update_many({'restricted.transactions': {'$exists': True}},
+                                 {'$unset': {'restricted.transactions': ''}})
+print(f"Groups migrated: {result.modified_count}")
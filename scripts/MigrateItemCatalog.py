@@ -0,0 +1,65 @@
+"""
+Merge the duplicated catalog items and make (name, desc, unit_price) unique.
+
+Items used to be looked up and saved in two steps, so concurrent requests could store the same
+item twice. Every duplicate is merged into the oldest copy (summing the usage counts and relinking
+the transaction items), then the plain index is replaced by a unique one.
+"""
+import os
+import sys
+
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import OperationFailure
+
+if len(sys.argv) > 2:
+    print('Usage: python3 MigrateItemCatalog.py [--dry-run]')
+    sys.exit()
+
+DRY_RUN = len(sys.argv) == 2 and sys.argv[1] == '--dry-run'
+KEY = [('name', ASCENDING), ('desc', ASCENDING), ('unit_price', ASCENDING)]
+
+# create the connection
+print("Attempting to connect to MongoDB...")
+client = MongoClient(host=os.environ['MONGO_HOST'],
+                     username=os.environ['API_USERNAME'],
+                     password=os.environ['API_PASSWORD'],
+                     authSource='smart-ledger')
+
+# the database the API writes to, MONGO_DB like App.py
+db = client[os.environ.get('MONGO_DB', 'smart-ledger')]
+
+duplicates = db['item'].aggregate([
+    {'$sort': {'_id': 1}},
+    {'$group': {'_id': {'name': '$name', 'desc': '$desc', 'unit_price': '$unit_price'},
+                'ids': {'$push': '$_id'}, 'usage_count': {'$sum': '$usage_count'}}},
+    {'$match': {'ids.1': {'$exists': True}}}
+], allowDiskUse=True)
+
+merged, removed = 0, 0
+for duplicate in duplicates:
+    keep, drop = duplicate['ids'][0], duplicate['ids'][1:]
+    merged += 1
+    removed += len(drop)
+    if DRY_RUN:
+        continue
+
+    # transaction items store the item id as a string
+    drop_str = [str(i) for i in drop]
+    db['transaction'].update_many({'items.item_id': {'$in': drop_str}},
+                                  {'$set': {'items.$[item].item_id': str(keep)}},
+                                  array_filters=[{'item.item_id': {'$in': drop_str}}])
+    db['item'].update_one({'_id': keep}, {'$set': {'usage_count': duplicate['usage_count']}})
+    db['item'].delete_many({'_id': {'$in': drop}})
+
+print(f"item: {merged} items had duplicates, {removed} duplicates merged")
+
+if not DRY_RUN:
+    # an index on the same keys with other options has to be dropped first
+    for name, index in db['item'].index_information().items():
+        if index['key'] == KEY and not index.get('unique'):
+            db['item'].drop_index(name)
+    try:
+        db['item'].create_index(KEY, unique=True)
+        print("item: unique (name, desc, unit_price) index created")
+    except OperationFailure as exp:
+        print(f"item: could not create the unique index: {exp}")
@@ -0,0 +1,312 @@
+"""
+ApiMixBench: requests per second and latency percentiles per endpoint under a realistic request mix.
+
+Runs fully offline: id tokens are signed with a local key the API verifies through GOOGLE_CERTS_FILE.
+Starts the API with gunicorn on the benchmark database, seeds it through the API with FillDB-like
+people, groups and transactions, then drives a weighted mix of calls from concurrent clients.
+The result table is appended to BENCH_JSON like every other benchmark.
+"""
+import io
+import os
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+import names
+import randomname
+from PIL import Image
+from BenchUtils import TokenSigner, connect, drop, free_port, start_server, worker_class_available, percentile, \
+    report
+
+# relative weight of every operation in the mix
+MIX = {
+    'register': 1,
+    'user_info': 4,
+    'group_info': 6,
+    'group_transactions': 3,
+    'transaction_create': 3,
+    'transaction_update': 1,
+    'transaction_update_items': 1,
+    'transaction_info': 2,
+    'receipt_upload': 1,
+    'receipt_download': 1,
+}
+
+parser = argparse.ArgumentParser(description='Drive a weighted request mix against the API.')
+parser.add_argument('--users', type=int, default=50, help='people seeded')
+parser.add_argument('--groups', type=int, default=10, help='groups seeded')
+parser.add_argument('--group-size', type=int, default=5, help='members of every group')
+parser.add_argument('--transactions', type=int, default=20, help='transactions seeded per group')
+parser.add_argument('--clients', type=int, default=16, help='concurrent client connections')
+parser.add_argument('--duration', type=float, default=20.0, help='seconds of load')
+parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+parser.add_argument('--worker-class', default='gthread', help='gunicorn worker class')
+parser.add_argument('--mix', help='weights overriding the default mix, e.g. group_info=10,receipt_upload=0')
+parser.add_argument('--seed', type=int, default=0, help='seed of the generated data and of the mix')
+args = parser.parse_args()
+
+if args.mix:
+    for entry in args.mix.split(','):
+        op, _, weight = entry.partition('=')
+        if op not in MIX:
+            parser.error(f'unknown operation {op}, expected one of {", ".join(MIX)}')
+        MIX[op] = int(weight)
+
+if not worker_class_available(args.worker_class):
+    parser.error(f'{args.worker_class} is not installed, gunicorn would run gthread workers instead')
+
+random.seed(args.seed)
+
+
+class Api:
+    """
+    Keep-alive connection to the API of one client thread.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    def call(self, method, route, token, body=None, content_type='application/json'):
+        """
+        send one request
+        :return: tuple of (status, response bytes), status 0 on a connection error
+        """
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        headers = {'Authorization': f'Bearer {token}', 'Content-Type': content_type}
+        try:
+            self.conn.request(method, route, body=body, headers=headers)
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            return 0, b''
+
+
+class State:
+    """
+    Seeded people, groups and transactions shared by the clients.
+    """
+
+    def __init__(self):
+        self.people = []          # list of (sub, token)
+        self.groups = {}          # sub -> list of (group id, members)
+        self.transactions = {}    # (sub, group id) -> list of transaction ids created by sub
+        self.receipts = {}        # sub -> transaction ids with an uploaded receipt
+        self.lock = threading.Lock()
+
+    def add_transaction(self, sub, group_id, transaction_id):
+        with self.lock:
+            self.transactions.setdefault((sub, group_id), []).append(transaction_id)
+
+    def pick_transaction(self, sub):
+        with self.lock:
+            owned = [(g, ids) for (s, g), ids in self.transactions.items() if s == sub and ids]
+            if not owned:
+                return None, None
+            group_id, ids = random.choice(owned)
+            return group_id, random.choice(ids)
+
+
+def random_items(members, rng):
+    """
+    FillDB-like random items owed by the group members
+    """
+    return [{'name': randomname.generate('n/food'),
+             'desc': randomname.generate('a/taste'),
+             'quantity': rng.randint(1, 4),
+             'unit_price': round(rng.uniform(0.5, 40), 2),
+             'owed_by': rng.choice(members)} for _ in range(rng.randint(1, 5))]
+
+
+def receipt_image():
+    """
+    small JPEG standing in for a receipt photo
+    """
+    out = io.BytesIO()
+    Image.new('RGB', (1200, 1600), (240, 240, 230)).save(out, 'JPEG', quality=80)
+    return out.getvalue()
+
+
+def seed(port, signer):
+    """
+    create the people, groups and transactions through the API
+    :return: the seeded State
+    """
+    state = State()
+    for i in range(args.users):
+        first, last = names.get_first_name(), names.get_last_name()
+        sub = f'bench-{i}'
+        state.people.append((sub, signer.token(sub, first, last, f'{first}.{last}.{i}@example.com'.lower())))
+    tokens = dict(state.people)
+
+    local = threading.local()
+
+    def api():
+        if not hasattr(local, 'api'):
+            local.api = Api(port)
+        return local.api
+
+    with ThreadPoolExecutor(args.clients) as pool:
+        list(pool.map(lambda p: api().call('POST', '/register', p[1], {}), state.people))
+
+        def seed_group(g):
+            rng = random.Random(args.seed * 7919 + g)
+            members = rng.sample([sub for sub, _ in state.people], min(args.group_size, len(state.people)))
+            name = randomname.generate('a/appearance', 'a/size', 'n/dogs').replace('-', ' ')
+            status, body = api().call('POST', '/group/create', tokens[members[0]], {'data': {'name': name}})
+            if status != 200:
+                raise RuntimeError(f'seeding failed: /group/create answered {status} {body[:200]}')
+            group_id = json.loads(body)['data']['_id']['$oid']
+            for sub in members[1:]:
+                api().call('POST', '/group/join', tokens[sub], {'id': group_id})
+            for _ in range(args.transactions):
+                sub = rng.choice(members)
+                status, body = api().call('POST', '/transaction/create', tokens[sub], {
+                    'id': group_id,
+                    'title': randomname.generate('ipsum/hipster', 'n/food').replace('-', ' '),
+                    'vendor': randomname.generate('a/taste', 'n/shopping', 'n/buildings').replace('-', ' '),
+                    'items': random_items(members, rng)})
+                if status == 200:
+                    state.add_transaction(sub, group_id, json.loads(body)['id'])
+            return group_id, members
+
+        for group_id, members in pool.map(seed_group, range(args.groups)):
+            for sub in members:
+                state.groups.setdefault(sub, []).append((group_id, members))
+    return state
+
+
+def members_of(state, group_id):
+    """
+    get the seeded members of a group
+    """
+    for groups in state.groups.values():
+        for g, members in groups:
+            if g == group_id:
+                return members
+    return []
+
+
+def operation(api, state, op, receipt):
+    """
+    run one operation of the mix as a random seeded person
+    :return: tuple of (status, endpoint) or None if the person has nothing to run it on
+    """
+    sub, token = random.choice(state.people)
+    groups = state.groups.get(sub)
+    if op == 'register':
+        return api.call('POST', '/register', token, {})[0], '/register'
+    if op == 'user_info':
+        return api.call('POST', '/user/info', token, {})[0], '/user/info'
+    if not groups:
+        return None
+    group_id, members = random.choice(groups)
+
+    if op == 'group_info':
+        return api.call('POST', '/group/info', token, {'id': group_id})[0], '/group/info'
+    if op == 'group_transactions':
+        return api.call('POST', '/group/transactions', token, {'id': group_id})[0], '/group/transactions'
+    if op == 'transaction_create':
+        status, body = api.call('POST', '/transaction/create', token, {
+            'id': group_id, 'title': randomname.generate('n/food'), 'items': random_items(members, random)})
+        if status == 200:
+            state.add_transaction(sub, group_id, json.loads(body)['id'])
+        return status, '/transaction/create'
+
+    group_id, transaction_id = state.pick_transaction(sub)
+    if transaction_id is None:
+        return None
+    if op == 'transaction_update':
+        # metadata only, the ledger and the items are left alone
+        return api.call('POST', '/transaction/update', token, {
+            'id': transaction_id, 'data': {'title': randomname.generate('n/food')}})[0], '/transaction/update'
+    if op == 'transaction_update_items':
+        # the items are replaced, the group's ledger and balances move with them
+        return api.call('POST', '/transaction/update', token, {
+            'id': transaction_id, 'data': {'items': random_items(members_of(state, group_id), random)}
+        })[0], '/transaction/update (items)'
+    if op == 'transaction_info':
+        return api.call('POST', '/transaction/info', token, {'id': transaction_id})[0], '/transaction/info'
+    if op == 'receipt_upload':
+        status, _ = api.call('POST', f'/receipt/upload?id={transaction_id}', token, receipt, content_type='image/jpeg')
+        if status == 200:
+            with state.lock:
+                state.receipts.setdefault(sub, []).append(transaction_id)
+        return status, '/receipt/upload'
+    if op == 'receipt_download':
+        # only transactions with a receipt
+        with state.lock:
+            if not state.receipts.get(sub):
+                return None
+            transaction_id = random.choice(state.receipts[sub])
+        return api.call('GET', f'/receipt/download?id={transaction_id}', token)[0], '/receipt/download'
+    raise ValueError(op)
+
+
+def client(port, state, stop, samples, receipt):
+    """
+    run random operations of the mix until stop is set
+    """
+    api = Api(port)
+    ops, weights = zip(*((op, w) for op, w in MIX.items() if w > 0))
+    while not stop.is_set():
+        op = random.choices(ops, weights)[0]
+        start = time.perf_counter()
+        result = operation(api, state, op, receipt)
+        if result is not None:
+            samples.append((result[1], result[0], time.perf_counter() - start))
+
+
+def main():
+    signer = TokenSigner()
+    database = connect()
+    drop()
+
+    port = free_port()
+    server = start_server(port, args.workers, args.worker_class, env={**signer.env(), 'MONGO_DB': database})
+    try:
+        start = time.perf_counter()
+        state = seed(port, signer)
+        print(f"# seeded {len(state.people)} people, {args.groups} groups, "
+              f"{sum(len(t) for t in state.transactions.values())} transactions in {time.perf_counter() - start:.1f}s")
+
+        samples, stop = [], threading.Event()
+        receipt = receipt_image()
+        threads = [threading.Thread(target=client, args=(port, state, stop, samples, receipt))
+                   for _ in range(args.clients)]
+        for t in threads:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in threads:
+            t.join()
+    finally:
+        server.terminate()
+        server.wait()
+        drop()
+        os.remove(signer.certs_file)
+
+    ms = lambda s: round(s * 1000, 2)
+    endpoints = {}
+    for endpoint, status, latency in samples:
+        endpoints.setdefault(endpoint, []).append((status, latency))
+    endpoints['total'] = [(status, latency) for _, status, latency in samples]
+
+    rows = []
+    for endpoint, results in sorted(endpoints.items()):
+        latencies = [latency for _, latency in results]
+        errors = sum(status == 0 or status >= 400 for status, _ in results)
+        rows.append([endpoint, len(results), round(len(results) / args.duration, 1), ms(percentile(latencies, 50)),
+                     ms(percentile(latencies, 95)), ms(percentile(latencies, 99)), errors])
+    report(f"ApiMixBench {args.worker_class} x{args.workers}, {args.clients} clients",
+           ['endpoint', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'], rows)
+
+
+main()
@@ -0,0 +1,60 @@
+"""
+AuditBench: throughput of the vectorized ledger and balance recomputation (no database needed).
+"""
+import random
+import sys
+
+from BenchUtils import measure, percentile, report
+from Utils import Audit, Ledger
+
+SIZES = [(10, 1000), (10, 100000), (50, 100000), (200, 100000)]
+REPEAT = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+
+def random_transactions(members, count):
+    """
+    build raw transaction documents the way /transaction/create stores them
+    """
+    subs = [f'member-{i}' for i in range(members)]
+    transactions = []
+    for _ in range(count):
+        items = [{'person': random.choice(subs), 'item_cost': round(random.uniform(1, 50), 2)}
+                 for _ in range(random.randint(1, 6))]
+        # one payer, or the bill split between two
+        total = round(sum(i['item_cost'] for i in items), 2)
+        payers = random.sample(subs, random.randint(1, 2))
+        who_paid = {payers[0]: total} if len(payers) == 1 else {payers[0]: round(total / 2, 2),
+                                                                 payers[1]: total - round(total / 2, 2)}
+        ledger_deltas, balance_deltas = Ledger.compute_deltas(subs, who_paid, items)
+        transactions.append({'who_paid': who_paid, 'items': items, 'balance_deltas': balance_deltas})
+    return transactions
+
+
+def check(transactions):
+    """
+    the recomputed values must match applying every transaction one by one
+    """
+    restricted = {'ledger': {}, 'balances': {}}
+    for t in transactions:
+        for p, v in t['who_paid'].items():
+            restricted['ledger'][p] = restricted['ledger'].get(p, 0) + v
+        for item in t['items']:
+            restricted['ledger'][item['person']] = restricted['ledger'].get(item['person'], 0) - item['item_cost']
+        for p1, row in t['balance_deltas'].items():
+            for p2, v in row.items():
+                Ledger.add_balance(restricted['balances'], p1, p2, v)
+
+    ledger, balances, _ = Audit.recompute(transactions)
+    assert not Audit.diff(restricted, ledger, balances)
+
+
+random.seed(0)
+rows = []
+for members, count in SIZES:
+    transactions = random_transactions(members, count)
+    check(transactions)
+    _, latencies = measure(lambda: Audit.recompute(transactions), REPEAT)
+    p50 = percentile(latencies, 50)
+    rows.append([members, count, f'{p50 * 1000:.1f}', f'{count / p50:,.0f}'])
+
+report('audit recompute', ['members', 'transactions', 'p50 ms', 'transactions/s'], rows)
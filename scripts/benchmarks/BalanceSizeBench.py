@@ -0,0 +1,55 @@
+"""
+BalanceSizeBench: BSON size of the balance matrices in the dense N x N layout and the sparse layout, on groups and
+transactions generated like FillDB does.
+"""
+import sys
+
+import bson
+from bson.objectid import ObjectId
+from BenchUtils import ROOT, report
+from Utils import Ledger
+
+sys.path.append(ROOT / 'scripts')
+import FillDB
+
+SIZES = [2, 10, 50, 100, 200]
+
+# FillDB's config, the group size is taken from SIZES instead
+CONFIG = FillDB.load_config(sys.argv[1] if len(sys.argv) > 1 else ROOT / 'scripts/example_data/data_gen_config.json')
+
+
+def dense(balances, members):
+    """
+    the full N x N matrix of a sparse balance matrix
+    """
+    return {p1: {p2: Ledger.get_balance(balances, p1, p2) for p2 in members if p2 != p1} for p1 in members}
+
+
+FillDB.seed(CONFIG)
+rows = []
+for size in SIZES:
+    members = [str(ObjectId()) for _ in range(size)]
+    transactions_dense, transactions_sparse = 0, 0
+    group_balances = {}
+
+    # FillDB's transactions, paid in full by their creator
+    count = FillDB.random_transaction_count(CONFIG)
+    for _ in range(count):
+        payer = FillDB.random_transaction(members)['created_by']
+        items = FillDB.random_transaction_items(CONFIG, members)
+        ledger_deltas, balance_deltas = Ledger.compute_deltas(members, {payer: sum(i['item_cost'] for i in items)},
+                                                              items)
+        transactions_dense += len(bson.encode({'balance_deltas': dense(balance_deltas, members)}))
+        transactions_sparse += len(bson.encode({'balance_deltas': balance_deltas}))
+        for p1, row in balance_deltas.items():
+            for p2, value in row.items():
+                Ledger.add_balance(group_balances, p1, p2, value)
+
+    group_dense = len(bson.encode({'balances': dense(group_balances, members)}))
+    group_sparse = len(bson.encode({'balances': group_balances}))
+    rows.append([size, count, transactions_dense, transactions_sparse,
+                 f'{transactions_dense / transactions_sparse:.1f}x', group_dense, group_sparse,
+                 f'{group_dense / group_sparse:.1f}x'])
+
+report('balance matrix size', ['members', 'transactions', 'transactions dense bytes', 'transactions sparse bytes',
+                               'ratio', 'group dense bytes', 'group sparse bytes', 'ratio'], rows)
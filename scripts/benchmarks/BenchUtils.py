@@ -0,0 +1,273 @@
+"""
+Shared helpers for the benchmark scripts.
+"""
+import os
+import sys
+import time
+import json
+import base64
+import socket
+import tempfile
+import subprocess
+import http.client
+import importlib.util
+import path
+import mongoengine
+from pymongo import monitoring
+
+# add the project root to the path so App and Models can be imported
+directory = path.Path(__file__).abspath()
+ROOT = directory.parent.parent.parent
+sys.path.append(ROOT)
+
+# commands issued by the driver itself that should not count as queries
+IGNORED_COMMANDS = {'isMaster', 'ismaster', 'hello', 'ping', 'endSessions', 'saslStart', 'saslContinue',
+                    'buildInfo', 'getnonce', 'killCursors'}
+
+# commands that modify data
+WRITE_COMMANDS = {'insert', 'update', 'delete', 'findAndModify'}
+
+
+class CommandCounter(monitoring.CommandListener):
+    """
+    Counts the commands sent to MongoDB, must be registered before the client is created.
+    """
+
+    def __init__(self):
+        self.counts = {}
+
+    def reset(self):
+        """
+        reset all counters
+        """
+        self.counts = {}
+
+    @property
+    def total(self):
+        """
+        total number of commands since the last reset
+        """
+        return sum(self.counts.values())
+
+    @property
+    def writes(self):
+        """
+        number of write commands since the last reset
+        """
+        return sum(v for k, v in self.counts.items() if k in WRITE_COMMANDS)
+
+    def started(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            self.counts[event.command_name] = self.counts.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+counter = CommandCounter()
+monitoring.register(counter)
+
+
+def connect():
+    """
+    (re)connect mongoengine to the benchmark database
+    :return: the name of the benchmark database
+    """
+    name = os.environ.get('BENCH_DB', 'smart-ledger-bench')
+    mongoengine.disconnect_all()
+    mongoengine.connect(db=name,
+                        host=os.environ.get('MONGO_HOST', 'localhost'),
+                        username=os.environ.get('API_USERNAME'),
+                        password=os.environ.get('API_PASSWORD'),
+                        authSource=os.environ.get('BENCH_AUTH_SOURCE', 'smart-ledger'))
+    return name
+
+
+def api_client():
+    """
+    import the API with token verification stubbed out and rate limiting disabled, the bearer token is used
+    as the subject
+    :return: tuple of (App module, flask test client)
+    """
+    os.environ.setdefault('CLIENT_ID', 'bench')
+    os.environ.setdefault('RATELIMIT_ENABLED', '0')
+    import App
+
+    def verify(token, audience=None, clock_skew_in_seconds=0):
+        return {'sub': token, 'exp': time.time() + 3600, 'given_name': token, 'family_name': 'Bench',
+                'email': f'{token}@example.com', 'picture': ''}
+
+    App.cert_store.verify = verify
+    return App, App.app.test_client()
+
+
+class TokenSigner:
+    """
+    Signs Google-like id tokens with a local RSA key. The public key is written as a JWKS file the API
+    verifies against through GOOGLE_CERTS_FILE, so the real verification path runs without Google.
+    """
+
+    def __init__(self, audience='bench', kid='bench'):
+        """
+        :param audience: CLIENT_ID the tokens are issued for
+        :param kid: key id of the signing key
+        """
+        from google.auth import crypt
+        self.audience = audience
+        try:
+            from cryptography.hazmat.primitives import serialization
+            from cryptography.hazmat.primitives.asymmetric import rsa as crypto_rsa
+            key = crypto_rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                    serialization.NoEncryption())
+            n, e = key.public_key().public_numbers().n, key.public_key().public_numbers().e
+        except ImportError:
+            import rsa
+            public, private = rsa.newkeys(2048)
+            pem, n, e = private.save_pkcs1('PEM'), public.n, public.e
+
+        b64 = lambda i: base64.urlsafe_b64encode(i.to_bytes((i.bit_length() + 7) // 8, 'big')).rstrip(b'=').decode()
+        jwks = {'keys': [{'kty': 'RSA', 'kid': kid, 'alg': 'RS256', 'use': 'sig', 'n': b64(n), 'e': b64(e)}]}
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(jwks, f)
+        self.certs_file = f.name
+        self._signer = crypt.RSASigner.from_string(pem, kid)
+
+    def token(self, sub, first_name='Bench', last_name='User', email=None, ttl=3600):
+        """
+        sign an id token for the given subject
+        :return: the encoded token
+        """
+        from google.auth import jwt
+        now = int(time.time())
+        claims = {'iss': 'accounts.google.com', 'aud': self.audience, 'sub': sub, 'iat': now, 'exp': now + ttl,
+                  'given_name': first_name, 'family_name': last_name, 'email': email or f'{sub}@example.com',
+                  'picture': ''}
+        return jwt.encode(self._signer, claims).decode()
+
+    def env(self):
+        """
+        environment the API needs to accept the tokens
+        """
+        return {'GOOGLE_CERTS_FILE': self.certs_file, 'CLIENT_ID': self.audience}
+
+
+def free_port():
+    """
+    get a local port nothing listens on
+    """
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def worker_class_available(worker_class):
+    """
+    check that gunicorn really runs the worker class, gunicorn.conf.py falls back to gthread when gevent is missing
+    :param worker_class: gunicorn worker class
+    :return: True if the worker class can be used
+    """
+    return worker_class != 'gevent' or importlib.util.find_spec('gevent') is not None
+
+
+def start_server(port, workers=2, worker_class='gthread', env=None):
+    """
+    start the API with gunicorn.conf.py and wait until it answers, rate limiting and request logs are disabled
+    :param port: local port to listen on
+    :param workers: number of worker processes
+    :param worker_class: gunicorn worker class
+    :param env: extra environment variables
+    :return: the gunicorn process
+    """
+    env = {**os.environ,
+           'GUNICORN_WORKER_CLASS': worker_class,
+           'GUNICORN_WORKERS': str(workers),
+           'GUNICORN_BIND': f'127.0.0.1:{port}',
+           'RATELIMIT_ENABLED': '0',
+           'REQUEST_LOG_SAMPLE': '0',
+           **(env or {})}
+    # gunicorn 20.0 has no __main__, start the script installed next to this interpreter
+    gunicorn = os.path.join(os.path.dirname(sys.executable), 'gunicorn')
+    if not os.path.exists(gunicorn):
+        gunicorn = 'gunicorn'
+    server = subprocess.Popen([gunicorn, '-c', 'gunicorn.conf.py', 'App:app'], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/test_get')
+            conn.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f'gunicorn ({worker_class}) did not start')
+
+
+def post(client, endpoint, data, sub):
+    """
+    post to the API as the given subject
+    :return: tuple of (status code, json body)
+    """
+    response = client.post(endpoint, json=data, headers={'Authorization': f'Bearer {sub}'})
+    return response.status_code, response.get_json()
+
+
+def drop():
+    """
+    drop the benchmark database
+    """
+    conn = mongoengine.get_connection()
+    conn.drop_database(mongoengine.get_db().name)
+
+
+def percentile(samples, pct):
+    """
+    get the given percentile of a list of samples
+    :param samples: list of numbers
+    :param pct: percentile between 0 and 100
+    :return: the sample at that percentile
+    """
+    samples = sorted(samples)
+    index = min(len(samples) - 1, max(0, int(round(pct / 100 * len(samples))) - 1))
+    return samples[index]
+
+
+def measure(func, repeat):
+    """
+    run a function several times
+    :param func: function taking no arguments
+    :param repeat: number of runs
+    :return: tuple of (average commands per run, list of latencies in seconds)
+    """
+    latencies = []
+    counter.reset()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return counter.total / repeat, latencies
+
+
+def report(title, headers, rows):
+    """
+    print a result table and dump it as json if BENCH_JSON is set
+    :param title: name of the benchmark
+    :param headers: column names
+    :param rows: list of row lists
+    """
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    print(f"## {title}")
+    print(' | '.join(str(h).rjust(w) for h, w in zip(headers, widths)))
+    print('-+-'.join('-' * w for w in widths))
+    for row in rows:
+        print(' | '.join(str(c).rjust(w) for c, w in zip(row, widths)))
+
+    out = os.environ.get('BENCH_JSON')
+    if out:
+        with open(out, 'a', encoding='UTF-8') as f:
+            f.write(json.dumps({'benchmark': title, 'headers': headers, 'rows': rows}) + '\n')
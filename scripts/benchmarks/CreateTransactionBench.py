@@ -0,0 +1,36 @@
+"""
+CreateTransactionBench: database writes and latency of /transaction/create against the number of items.
+"""
+import sys
+from BenchUtils import api_client, connect, counter, drop, measure, percentile, post, report
+
+ITEM_COUNTS = [1, 5, 10, 20, 50, 100]
+REPEAT = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+App, client = api_client()
+connect()
+
+# two people sharing a group
+post(client, '/register', {}, 'bench-a')
+post(client, '/register', {}, 'bench-b')
+_, group = post(client, '/group/create', {'data': {'name': 'bench'}}, 'bench-a')
+group_id = group['data']['_id']['$oid']
+post(client, '/group/join', {'id': group_id}, 'bench-b')
+
+rows = []
+for count in ITEM_COUNTS:
+    items = [{'name': f'item {i}', 'desc': 'bench', 'quantity': 1, 'unit_price': 1.0,
+              'owed_by': 'bench-a' if i % 2 else 'bench-b'} for i in range(count)]
+    payload = {'id': group_id, 'title': 'bench', 'who_paid': {'bench-a': float(count)}, 'items': items}
+
+    def create():
+        status, body = post(client, '/transaction/create', payload, 'bench-a')
+        assert status == 200, body
+
+    queries, latencies = measure(create, REPEAT)
+    writes = counter.writes / REPEAT
+    rows.append([count, writes, queries, f'{percentile(latencies, 50) * 1000:.2f}',
+                 f'{percentile(latencies, 95) * 1000:.2f}'])
+
+report('transaction/create', ['items', 'writes', 'commands', 'p50 ms', 'p95 ms'], rows)
+drop()
@@ -0,0 +1,80 @@
+"""
+DeleteGroupBench: commands and latency of /group/delete against the number of transactions of the group.
+
+Compares the bulk pipeline of the route with the previous approach of saving every member and deleting the
+transactions one at a time through _delete_transaction.
+"""
+import sys
+import time
+from BenchUtils import api_client, connect, counter, drop, post, report
+
+SIZES = [int(a) for a in sys.argv[1:]] or [1000, 10000]
+MEMBERS = 10
+ITEMS_PER_TRANSACTION = 3
+CATALOG_SIZE = 200
+
+App, client = api_client()
+connect()
+from Models import Person, Group, Transaction
+
+subs = [f'bench-{i}' for i in range(MEMBERS)]
+for sub in subs:
+    post(client, '/register', {}, sub)
+
+
+def seed(size):
+    """
+    create a group of MEMBERS people holding `size` transactions drawn from a shared item catalog
+    :return: the group id
+    """
+    _, group = post(client, '/group/create', {'data': {'name': 'bench'}}, subs[0])
+    group_id = group['data']['_id']['$oid']
+    for sub in subs[1:]:
+        post(client, '/group/join', {'id': group_id}, sub)
+
+    transactions = []
+    for t in range(size):
+        items = [{'name': f'item {(t * ITEMS_PER_TRANSACTION + i) % CATALOG_SIZE}', 'desc': 'bench', 'quantity': 1,
+                  'unit_price': 1.0, 'owed_by': subs[(t + i) % MEMBERS]} for i in range(ITEMS_PER_TRANSACTION)]
+        transactions.append({'title': f'bench {t}', 'items': items})
+
+    for start in range(0, size, App.TRANSACTION_BULK_MAX):
+        status, body = post(client, '/transaction/bulk-create',
+                            {'id': group_id, 'transactions': transactions[start:start + App.TRANSACTION_BULK_MAX]},
+                            subs[0])
+        assert status == 200, body
+    return group_id
+
+
+def legacy(group_id):
+    """
+    the deletion before the bulk pipeline: one save per member and one _delete_transaction per transaction
+    """
+    group = Group.objects.get(id=group_id)
+    for sub in group.members:
+        person = Person.objects.get(sub=sub)
+        person.groups.remove(group.id)
+        person.save()
+    for transaction in Transaction.objects(group=group.id):
+        App._delete_transaction(group, transaction)
+    group.delete()
+
+
+def bulk(group_id):
+    status, body = post(client, '/group/delete', {'id': group_id}, subs[0])
+    assert status == 200, body
+
+
+rows = []
+for size in SIZES:
+    for name, delete in (('legacy', legacy), ('bulk', bulk)):
+        group_id = seed(size)
+        counter.reset()
+        start = time.perf_counter()
+        delete(group_id)
+        elapsed = time.perf_counter() - start
+        assert Transaction.objects(group=group_id).count() == 0
+        rows.append([size, name, counter.total, counter.writes, f'{elapsed:.2f}'])
+
+report('group/delete', ['transactions', 'mode', 'commands', 'writes', 'seconds'], rows)
+drop()
@@ -0,0 +1,40 @@
+"""
+GroupInfoBench: query count and latency of resolving group members for /group/info.
+"""
+import sys
+from BenchUtils import connect, drop, measure, percentile, report
+from App import _resolve_members
+from Models import Person
+
+SIZES = [1, 5, 10, 25, 50, 100, 200]
+REPEAT = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+
+def legacy_resolve_members(subs):
+    """
+    the previous implementation, one query per member
+    """
+    members = []
+    for m in subs:
+        try:
+            p = Person.objects.get(sub=m)
+            members.append({'sub': p.sub, 'first_name': p.first_name, 'last_name': p.last_name})
+        except Exception:
+            continue
+    return members
+
+
+connect()
+Person.objects.insert([Person(sub=f'bench-{i}', first_name=f'First{i}', last_name=f'Last{i}',
+                              email=f'bench{i}@example.com') for i in range(max(SIZES))])
+
+rows = []
+for size in SIZES:
+    subs = [f'bench-{i}' for i in range(size)]
+    for name, func in [('legacy', legacy_resolve_members), ('batched', _resolve_members)]:
+        queries, latencies = measure(lambda: func(subs), REPEAT)
+        rows.append([size, name, queries, f'{percentile(latencies, 50) * 1000:.2f}',
+                     f'{percentile(latencies, 95) * 1000:.2f}'])
+
+report('group/info member resolution', ['members', 'impl', 'queries', 'p50 ms', 'p95 ms'], rows)
+drop()
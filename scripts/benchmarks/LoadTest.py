@@ -0,0 +1,100 @@
+"""
+LoadTest: requests per second and latency percentiles of the API served by gunicorn with each worker class.
+
+Starts gunicorn with gunicorn.conf.py once per worker class, sends requests from concurrent keep-alive
+clients for a fixed duration and compares the modes. Rate limiting is disabled for the run.
+Set BENCH_TOKEN to a valid id token to load authenticated routes (e.g. --path /user/info).
+"""
+import os
+import time
+import json
+import argparse
+import threading
+import http.client
+
+from BenchUtils import free_port, start_server, worker_class_available, percentile, report
+
+parser = argparse.ArgumentParser(description='Compare the gunicorn worker classes under load.')
+parser.add_argument('--modes', default='sync,gthread,gevent', help='comma separated worker classes')
+parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+parser.add_argument('--clients', type=int, default=32, help='concurrent client connections')
+parser.add_argument('--duration', type=float, default=10.0, help='seconds of load per mode')
+parser.add_argument('--path', action='append', help='route to request, GET unless a json body is given '
+                                                    'as /route=json (repeatable, default /test_get)')
+args = parser.parse_args()
+
+requests = []
+for spec in args.path or ['/test_get']:
+    route, _, body = spec.partition('=')
+    requests.append(('POST', route, body.encode()) if body else ('GET', route, None))
+
+headers = {'Content-Type': 'application/json'}
+if os.environ.get('BENCH_TOKEN'):
+    headers['Authorization'] = f"Bearer {os.environ['BENCH_TOKEN']}"
+
+
+def client(port, stop, latencies, errors):
+    """
+    send the requests in a loop over one keep-alive connection until stop is set
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    i = 0
+    while not stop.is_set():
+        method, route, body = requests[i % len(requests)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request(method, route, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException):
+            errors.append(0)
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def run(mode):
+    """
+    load one worker class
+    :return: result row
+    """
+    port = free_port()
+    server = start_server(port, args.workers, mode)
+    latencies, errors = [], []
+    stop = threading.Event()
+    threads = [threading.Thread(target=client, args=(port, stop, latencies, errors)) for _ in range(args.clients)]
+    try:
+        for t in threads:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in threads:
+            t.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    ms = lambda s: round(s * 1000, 2)
+    return [mode, args.workers, args.clients, len(latencies), round(len(latencies) / args.duration, 1),
+            ms(percentile(latencies, 50)), ms(percentile(latencies, 95)), ms(percentile(latencies, 99)),
+            len(errors)]
+
+
+# a missing gevent would silently be measured as gthread under the gevent label
+modes = []
+for mode in args.modes.split(','):
+    if worker_class_available(mode):
+        modes.append(mode)
+    else:
+        print(f"# skipping {mode}: it is not installed, gunicorn would run gthread workers instead")
+
+if not modes:
+    parser.error('none of the worker classes can be run')
+
+rows = [run(mode) for mode in modes]
+report(f"LoadTest {json.dumps([r for _, r, _ in requests])}",
+       ['worker class', 'workers', 'clients', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'], rows)
@@ -0,0 +1,81 @@
+"""
+ReceiptMemoryBench: peak Python memory of the base64 and streaming receipt routes against the receipt size.
+"""
+import io
+import os
+import sys
+import base64
+import tracemalloc
+from BenchUtils import api_client, connect, drop, post, report
+
+SIZES_MB = [1, 5, 10]
+REPEAT = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+App, client = api_client()
+connect()
+
+# one person with one transaction to attach the receipts to
+post(client, '/register', {}, 'bench-a')
+_, group = post(client, '/group/create', {'data': {'name': 'bench'}}, 'bench-a')
+group_id = group['data']['_id']['$oid']
+items = [{'name': 'item', 'desc': 'bench', 'quantity': 1, 'unit_price': 1.0, 'owed_by': 'bench-a'}]
+post(client, '/transaction/create', {'id': group_id, 'title': 'bench', 'items': items}, 'bench-a')
+_, page = post(client, '/group/transactions', {'id': group_id}, 'bench-a')
+transaction_id = page['data'][0]['_id']['$oid']
+headers = {'Authorization': 'Bearer bench-a'}
+
+
+def peak(func):
+    """
+    run a function and get the peak memory it allocated, the request payload is built beforehand
+    :return: peak in MiB
+    """
+    result = 0
+    for _ in range(REPEAT):
+        tracemalloc.start()
+        func()
+        result = max(result, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return result / 1024 / 1024
+
+
+def upload_base64(payload):
+    response = client.post('/receipt/add', data=payload, headers={**headers, 'Content-Type': 'application/json'})
+    assert response.status_code == 200, response.get_json()
+
+
+def upload_stream(data):
+    data.seek(0)
+    response = client.post(f'/receipt/upload?id={transaction_id}', input_stream=data,
+                           headers={**headers, 'Content-Type': 'image/jpeg',
+                                    'Content-Length': str(len(data.getbuffer()))})
+    assert response.status_code == 200, response.get_json()
+
+
+def download_base64():
+    response = client.post('/receipt/get', json={'id': transaction_id}, headers=headers)
+    assert response.status_code == 200, response.get_json()
+
+
+def download_stream():
+    response = client.get(f'/receipt/download?id={transaction_id}', headers=headers, buffered=False)
+    assert response.status_code == 200
+    # consume the body chunk by chunk like a socket would
+    for _ in response.response:
+        pass
+    response.close()
+
+
+rows = []
+for size in SIZES_MB:
+    data = os.urandom(size * 1024 * 1024)
+    payload = ('{"id": "%s", "receipt": "%s"}' % (transaction_id, base64.b64encode(data).decode())).encode()
+    stream = io.BytesIO(data)
+
+    rows.append([size, 'base64 upload', f'{peak(lambda: upload_base64(payload)):.1f}'])
+    rows.append([size, 'base64 download', f'{peak(download_base64):.1f}'])
+    rows.append([size, 'stream upload', f'{peak(lambda: upload_stream(stream)):.1f}'])
+    rows.append([size, 'stream download', f'{peak(download_stream):.1f}'])
+
+report('receipt memory', ['receipt MiB', 'route', 'peak MiB'], rows)
+drop()
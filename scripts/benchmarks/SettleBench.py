@@ -0,0 +1,34 @@
+"""
+SettleBench: transfers produced and latency of /group/settle against group size (no database needed).
+"""
+import random
+import sys
+
+from BenchUtils import measure, percentile, report
+from Utils import Settlement
+
+GREEDY_SIZES = [10, 50, 100, 250, 500, 1000]
+EXACT_SIZES = [5, 10, Settlement.EXACT_MAX_MEMBERS]
+REPEAT = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+
+def random_ledger(size):
+    """
+    build a ledger of the given size that sums to zero
+    """
+    ledger = {f'member-{i}': round(random.uniform(-500, 500), 2) for i in range(size - 1)}
+    ledger[f'member-{size - 1}'] = -round(sum(ledger.values()), 2)
+    return ledger
+
+
+random.seed(0)
+rows = []
+for exact, sizes in [(False, GREEDY_SIZES), (True, EXACT_SIZES)]:
+    for size in sizes:
+        ledger = random_ledger(size)
+        transfers, mode = Settlement.settle(ledger, exact=exact)
+        _, latencies = measure(lambda: Settlement.settle(ledger, exact=exact), REPEAT)
+        rows.append([size, mode, len(transfers), f'{percentile(latencies, 50) * 1000:.2f}',
+                     f'{percentile(latencies, 95) * 1000:.2f}'])
+
+report('group/settle', ['members', 'mode', 'transfers', 'p50 ms', 'p95 ms'], rows)
@@ -105,10 +105,8 @@ class BalanceTests:
         # make sure the group has been joined and invites are clear
         response = self.do_post('/group/info', {'id': self.group['_id']['$oid']}, self.header1)
         assert response.status_code == 200
-        assert response.json()['data']['restricted']['balances'][self.user1['data']['sub']][
-                   self.user2['data']['sub']] == 0
-        assert response.json()['data']['restricted']['balances'][self.user2['data']['sub']][
-                   self.user1['data']['sub']] == 0
+        assert self.balance(response, self.user1, self.user2) == 0
+        assert self.balance(response, self.user2, self.user1) == 0
 
         ####################################################################################
         ## Transaction 2
@@ -128,10 +126,8 @@ class BalanceTests:
         # make sure the group has been joined and invites are clear
         response = self.do_post('/group/info', {'id': self.group['_id']['$oid']}, self.header1)
         assert response.status_code == 200
-        assert response.json()['data']['restricted']['balances'][self.user1['data']['sub']][
-                   self.user2['data']['sub']] == 40
-        assert response.json()['data']['restricted']['balances'][self.user2['data']['sub']][
-                   self.user1['data']['sub']] == -40
+        assert self.balance(response, self.user1, self.user2) == 40
+        assert self.balance(response, self.user2, self.user1) == -40
 
         ####################################################################################
         ## Transaction 3
@@ -152,10 +148,8 @@ class BalanceTests:
         response = self.do_post('/group/info', {'id': self.group['_id']['$oid']}, self.header1)
 
         assert response.status_code == 200
-        assert response.json()['data']['restricted']['balances'][self.user1['data']['sub']][
-                   self.user2['data']['sub']] == 0
-        assert response.json()['data']['restricted']['balances'][self.user2['data']['sub']][
-                   self.user1['data']['sub']] == 0
+        assert self.balance(response, self.user1, self.user2) == 0
+        assert self.balance(response, self.user2, self.user1) == 0
         ####################################################################################
         ## Transaction 4
         who_paid = {self.user1['data']['sub']: 40}
@@ -176,10 +170,8 @@ class BalanceTests:
         response = self.do_post('/group/info', {'id': self.group['_id']['$oid']}, self.header1)
 
         assert response.status_code == 200
-        assert response.json()['data']['restricted']['balances'][self.user1['data']['sub']][
-                   self.user2['data']['sub']] == 20
-        assert response.json()['data']['restricted']['balances'][self.user2['data']['sub']][
-                   self.user1['data']['sub']] == -20
+        assert self.balance(response, self.user1, self.user2) == 20
+        assert self.balance(response, self.user2, self.user1) == -20
 
         ####################################################################################
         ## Transaction 4
@@ -201,10 +193,8 @@ class BalanceTests:
         response = self.do_post('/group/info', {'id': self.group['_id']['$oid']}, self.header1)
 
         assert response.status_code == 200
-        assert response.json()['data']['restricted']['balances'][self.user1['data']['sub']][
-                   self.user2['data']['sub']] == 0
-        assert response.json()['data']['restricted']['balances'][self.user2['data']['sub']][
-                   self.user1['data']['sub']] == 0
+        assert self.balance(response, self.user1, self.user2) == 0
+        assert self.balance(response, self.user2, self.user1) == 0
 
 
     def test_update_transaction(self):
@@ -249,7 +239,11 @@ class BalanceTests:
         # make sure the group has been joined and invites are clear
         response = self.do_post('/group/info', {'id': self.group['_id']['$oid']}, self.header1)
         assert response.status_code == 200
-        assert {'$oid': t1_id} in response.json()['data']['restricted']['transactions']
+
+        # make sure the transaction is listed in the group
+        response = self.do_post('/group/transactions', {'id': self.group['_id']['$oid']}, self.header1)
+        assert response.status_code == 200
+        assert {'$oid': t1_id} in [t['_id'] for t in response.json()['data']]
         ## Update Transaction 1
         who_paid = {self.user2['data']['sub']: 40}
         t1_update = {
@@ -271,6 +265,56 @@ class BalanceTests:
         # assert response.json()['data']['restricted']['balances'][self.user2['data']['sub']][
         #            self.user1['data']['sub']] == 0
 
+    def test_deleted_transaction_leaves_no_pairs(self):
+        # create a group and join it with the second user
+        data = {
+            'name': 'test group name',
+            'desc': 'test group description',
+            'invites': [self.user2['data']['email']]
+        }
+        response = self.do_post('/group/create', {'data': data}, self.header1)
+        assert response.status_code == 200
+        self.group = response.json()['data']
+
+        response = self.do_post('/group/join', {'id': self.group['_id']['$oid']}, self.header2)
+        assert response.status_code == 200
+
+        # the first user pays for an item used by the second user
+        t1 = {
+            'id': self.group['_id']['$oid'],
+            'title': 'transaction1',
+            'who_paid': {self.user1['data']['sub']: 40},
+            'items': [{'owed_by': self.user2['data']['sub'], 'name': 'item1', 'desc': 'item1', 'unit_price': 40,
+                       'quantity': 1}]
+        }
+        response = self.do_post('/transaction/create', t1, self.header1)
+        assert response.status_code == 200
+        t1_id = response.json()['id']
+
+        response = self.do_post('/group/info', {'id': self.group['_id']['$oid']}, self.header1)
+        assert response.status_code == 200
+        assert self.balance(response, self.user1, self.user2) == 40
+
+        # deleting it brings the pairs back to zero, the stored balances must not keep them
+        response = self.do_post('/transaction/delete', {'id': t1_id}, self.header1)
+        assert response.status_code == 200
+
+        response = self.do_post('/group/info', {'id': self.group['_id']['$oid']}, self.header1)
+        assert response.status_code == 200
+        assert response.json()['data']['restricted']['balances'] == {}
+
+        # delete the group
+        response = self.do_post('/group/delete', {'id': self.group['_id']['$oid']}, self.header1)
+        assert response.status_code == 200
+
+    @staticmethod
+    def balance(response, user1, user2):
+        """
+        read how much user2 owes user1 from a /group/info response, missing pairs are zero
+        """
+        balances = response.json()['data']['restricted']['balances']
+        return balances.get(user1['data']['sub'], {}).get(user2['data']['sub'], 0)
+
     @classmethod
     def do_post(cls, endpoint, data, header):
         """
@@ -286,3 +330,4 @@ if '__main__' == __name__:
     test = BalanceTests()
     test.setup_class()
     test.test_update_transaction()
+    test.test_deleted_transaction_leaves_no_pairs()
@@ -0,0 +1,105 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# number of transactions posted in parallel and how many requests are in flight at once
+NUM_TRANSACTIONS = 50
+NUM_WORKERS = 10
+
+
+class TestConcurrency:
+    """
+    Stress tests for concurrent writes to one group.
+    """
+
+    @classmethod
+    def setup_class(cls):
+        """
+        This method is run once before any of the class' test methods are run.
+        It sets up the environment for the tests, and checks that both tokens are provided and the API is up.
+        """
+
+        cls.base_url = 'http://localhost:5000'
+
+        # Verify that the API is up and running
+        try:
+            response = requests.get(f'{cls.base_url}/test_get')
+            is_api_ok = response.status_code == 200
+        except requests.exceptions.ConnectionError:
+            is_api_ok = False
+
+        assert is_api_ok, '/test_get endpoint reported a Connection Error. Is the API running?'
+
+        cls.headers = []
+        cls.users = []
+        for token_file in ['token.txt', 'token2.txt']:
+            assert os.path.isfile(token_file) == True, f'Token file not found ({token_file}). ' \
+                                                       f'Please create this file and fill it with your ' \
+                                                       f'OAuth token from Front-End.'
+
+            # Read token from file and assign it to the header of the requests
+            with open(token_file, 'r') as file:
+                token = file.readline().strip()
+            header = {'Authorization': f'Bearer {token}'}
+            cls.headers.append(header)
+            cls.users.append(cls.do_post('/register', {}, header).json()['data'])
+
+    def test_parallel_creates(self):
+        """
+        post many transactions to the same group at once and make sure no balance update is lost
+        """
+        payer, user = self.users[0]['sub'], self.users[1]['sub']
+
+        # create a group and join it with the second user
+        response = self.do_post('/group/create', {'data': {'name': 'concurrency test'}}, self.headers[0])
+        assert response.status_code == 200
+        group_id = response.json()['data']['_id']['$oid']
+        response = self.do_post('/group/join', {'id': group_id}, self.headers[1])
+        assert response.status_code == 200
+
+        # the first user pays 10 for an item used by the second user
+        data = {
+            'id': group_id,
+            'title': 'concurrency test',
+            'who_paid': {payer: 10},
+            'items': [{'name': 'concurrency item', 'desc': '', 'quantity': 1, 'unit_price': 10, 'owed_by': user}]
+        }
+
+        with ThreadPoolExecutor(max_workers=NUM_WORKERS) as pool:
+            responses = list(pool.map(lambda _: self.do_post('/transaction/create', data, self.headers[0]),
+                                      range(NUM_TRANSACTIONS)))
+        assert all(r.status_code == 200 for r in responses), [r.status_code for r in responses]
+
+        # every transaction must be reflected in the group
+        response = self.do_post('/group/info', {'id': group_id}, self.headers[0])
+        assert response.status_code == 200
+        restricted = response.json()['data']['restricted']
+        assert restricted['ledger'][payer] == 10 * NUM_TRANSACTIONS
+        assert restricted['ledger'][user] == -10 * NUM_TRANSACTIONS
+        assert restricted['balances'].get(payer, {}).get(user, 0) == 10 * NUM_TRANSACTIONS
+        assert restricted['balances'].get(user, {}).get(payer, 0) == -10 * NUM_TRANSACTIONS
+
+        response = self.do_post('/group/transactions', {'id': group_id, 'limit': NUM_TRANSACTIONS + 1},
+                                self.headers[0])
+        assert response.status_code == 200
+        assert len(response.json()['data']) == NUM_TRANSACTIONS
+
+        # delete the group
+        response = self.do_post('/group/delete', {'id': group_id}, self.headers[0])
+        assert response.status_code == 200
+
+    @classmethod
+    def do_post(cls, endpoint, data, header):
+        """
+        post to the API with the given header
+        """
+        return requests.post(
+            f'{cls.base_url}{endpoint}', json=data, headers=header
+        )
+
+
+if '__main__' == __name__:
+    test = TestConcurrency()
+    test.setup_class()
+    test.test_parallel_creates()
@@ -0,0 +1,96 @@
+import os
+import sys
+
+import mongoengine
+from bson.objectid import ObjectId
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Models import Person, Group, Item, Transaction, ensure_indexes
+
+
+def plan_stages(plan):
+    """
+    collect every stage name of an explain() query plan
+    :param plan: the winning plan or one of its input stages
+    :return: list of stage names
+    """
+    stages = [plan.get('stage')]
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get('inputStages', []):
+        stages += plan_stages(child)
+    return stages
+
+
+class TestIndexes:
+    """
+    Checks that the hot queries of the API are served by an index.
+    Needs a MongoDB reachable with the same environment variables as the API.
+    """
+
+    @classmethod
+    def setup_class(cls):
+        """
+        Connect to a scratch database, build the indexes and insert a few documents.
+        """
+        mongoengine.disconnect_all()
+        mongoengine.connect(db='smart-ledger-index-test',
+                            host=os.environ.get('MONGO_HOST', 'localhost'),
+                            username=os.environ.get('API_USERNAME'),
+                            password=os.environ.get('API_PASSWORD'),
+                            authSource='smart-ledger')
+
+        try:
+            is_db_ok = mongoengine.get_connection().server_info() is not None
+        except Exception:
+            is_db_ok = False
+        assert is_db_ok, 'Could not connect to MongoDB. Is the database running?'
+
+        assert ensure_indexes() == [], 'Could not create the indexes.'
+
+        cls.group_id = ObjectId()
+        for i in range(20):
+            Person(sub=f'sub-{i}', first_name='first', last_name='last', email=f'user{i}@example.com').save()
+            Item(name=f'item {i}', desc='desc', unit_price=i + 1.0).save()
+            Transaction(title=f'transaction {i}', group=cls.group_id if i % 2 else ObjectId(),
+                        created_by='sub-0', modified_by='sub-0').save()
+        Group(name='group', admin='sub-0', members=['sub-0', 'sub-1']).save()
+
+    @classmethod
+    def teardown_class(cls):
+        """
+        Drop the scratch database.
+        """
+        mongoengine.get_connection().drop_database('smart-ledger-index-test')
+        mongoengine.disconnect_all()
+
+    def ensure_no_collscan(self, queryset):
+        stages = plan_stages(queryset.explain()['queryPlanner']['winningPlan'])
+        assert 'COLLSCAN' not in stages, f'Query did a collection scan: {stages}'
+
+    def test_person_by_sub(self):
+        self.ensure_no_collscan(Person.objects(sub='sub-3'))
+
+    def test_person_by_email(self):
+        self.ensure_no_collscan(Person.objects(email='user3@example.com'))
+
+    def test_group_by_member(self):
+        self.ensure_no_collscan(Group.objects(members='sub-1'))
+
+    def test_item_lookup(self):
+        self.ensure_no_collscan(Item.objects(name='item 3', desc='desc', unit_price=4.0))
+
+    def test_transactions_by_group(self):
+        self.ensure_no_collscan(Transaction.objects(group=self.group_id).order_by('-date_purchased', '-id'))
+
+
+if '__main__' == __name__:
+    test = TestIndexes()
+    test.setup_class()
+    test.test_person_by_sub()
+    test.test_person_by_email()
+    test.test_group_by_member()
+    test.test_item_lookup()
+    test.test_transactions_by_group()
+    test.teardown_class()
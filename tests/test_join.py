@@ -135,6 +135,43 @@ class BalanceTests:
         response = self.do_post('/group/delete', {'id': self.group['_id']['$oid']}, self.header1)
         assert response.status_code == 200
 
+    def test_remove_other_member(self):
+        # create a group and join it with the second user
+        data = {
+            'name': 'test group name',
+            'desc': 'test group description',
+            'invites': [self.user2['data']['email']]
+        }
+        response = self.do_post('/group/create', {'data': data}, self.header1)
+        assert response.status_code == 200
+        self.group = response.json()['data']
+
+        response = self.do_post('/group/join', {'id': self.group['_id']['$oid']}, self.header2)
+        assert response.status_code == 200
+
+        # a member other than the admin can not remove the admin
+        data = {'id': self.group['_id']['$oid'], 'userid': self.user1['data']['sub']}
+        response = self.do_post('/group/remove-member', data, self.header2)
+        assert response.status_code == 404
+
+        # the admin removes the second user
+        data = {'id': self.group['_id']['$oid'], 'userid': self.user2['data']['sub']}
+        response = self.do_post('/group/remove-member', data, self.header1)
+        assert response.status_code == 200
+
+        response = self.do_post('/group/info', {'id': self.group['_id']['$oid']}, self.header1)
+        assert response.status_code == 200
+        assert [m['sub'] for m in response.json()['data']['members']] == [self.user1['data']['sub']]
+
+        # the group is unlinked from the removed user
+        response = self.do_post('/user/info', {}, self.header2)
+        assert response.status_code == 200
+        assert self.group['_id'] not in response.json()['data']['groups']
+
+        # delete the group
+        response = self.do_post('/group/delete', {'id': self.group['_id']['$oid']}, self.header1)
+        assert response.status_code == 200
+
     @classmethod
     def do_post(cls, endpoint, data, header):
         """
@@ -151,3 +188,4 @@ if '__main__' == __name__:
     test.setup_class()
     test.test_invite_through_create()
     test.test_invite_through_invite()
+    test.test_remove_other_member()
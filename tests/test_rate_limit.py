@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import uuid
+import importlib.util
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'App.py')
+
+# shared storage both app instances count in: a local redis://, memcached:// or mongodb:// server
+STORAGE_URI = os.environ.get('RATELIMIT_TEST_STORAGE_URI', 'mongodb://localhost:27017')
+
+# requests allowed on the test route per minute, across both instances
+LIMIT = 5
+
+
+def load_app(name):
+    """
+    import App.py as a separate module, i.e. a second API process with its own Limiter
+    :param name: module name of the instance
+    :return: the loaded module
+    """
+    spec = importlib.util.spec_from_file_location(name, APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def limited():
+    """
+    route limited by the test
+    """
+    return 'ok'
+
+
+def limited_by_sub():
+    """
+    route limited by the test with the API's key function, a view of its own so the limits of the routes stay apart
+    """
+    return 'ok'
+
+
+class TestRateLimitStorage:
+    """
+    Checks that API instances configured with the same RATELIMIT_STORAGE_URI count requests in one shared counter,
+    like gunicorn workers or replicas behind a load balancer.
+    Needs the storage server to be reachable.
+    """
+
+    @classmethod
+    def setup_class(cls):
+        """
+        Load two instances of the API on the shared storage and add the same limited route to both.
+        """
+        os.environ['RATELIMIT_STORAGE_URI'] = STORAGE_URI
+        os.environ['RATELIMIT_ENABLED'] = '1'
+
+        # a key of its own per run, so counters left by a previous run are never hit
+        run_key = f'rate-limit-test-{uuid.uuid4()}'
+
+        cls.instances, cls.clients = [], []
+        for name in ('app_instance_a', 'app_instance_b'):
+            instance = load_app(name)
+            storage = instance.limiter._storage
+            assert storage is not None and storage.check(), f'Could not reach {STORAGE_URI}. Is the storage running?'
+
+            route = instance.limiter.limit(f'{LIMIT}/minute', key_func=lambda: run_key)(limited)
+            instance.app.add_url_rule('/rate-limit-test', 'rate_limit_test', route)
+
+            # the same route keyed like the API's own routes, by subject once the token is verified
+            route = instance.limiter.limit(f'{LIMIT}/minute')(limited_by_sub)
+            instance.app.add_url_rule('/rate-limit-sub-test', 'rate_limit_sub_test', route)
+            cls.instances.append(instance)
+            cls.clients.append(instance.app.test_client())
+
+        # two users behind the same client address, their tokens verified by both instances
+        cls.headers = []
+        for user in ('a', 'b'):
+            token = f'{run_key}-token-{user}'
+            for instance in cls.instances:
+                instance.token_cache.put_claims(instance.token_cache.key(token),
+                                                {'sub': f'{run_key}-{user}', 'exp': time.time() + 600})
+            cls.headers.append({'Authorization': f'Bearer {token}'})
+
+    def test_instances_share_one_counter(self):
+        # alternate between the instances, neither of them alone reaches the limit
+        statuses = [self.clients[i % 2].get('/rate-limit-test').status_code for i in range(LIMIT + 1)]
+
+        assert statuses[:LIMIT] == [200] * LIMIT, f'Requests under the limit were refused: {statuses}'
+        assert statuses[LIMIT] == 429, f'The instances did not share the counter: {statuses}'
+
+        # the requests were counted in the shared storage, not in the in-memory fallback
+        assert not any(instance.limiter._storage_dead for instance in self.instances)
+
+    def test_subjects_limited_apart(self):
+        # the first user uses up the limit from the shared address
+        statuses = [self.clients[i % 2].get('/rate-limit-sub-test', headers=self.headers[0]).status_code
+                    for i in range(LIMIT + 1)]
+        assert statuses == [200] * LIMIT + [429], f'The first user was not limited on its own: {statuses}'
+
+        # the second user on the same address still has its own limit
+        statuses = [self.clients[i % 2].get('/rate-limit-sub-test', headers=self.headers[1]).status_code
+                    for i in range(LIMIT)]
+        assert statuses == [200] * LIMIT, f'The second user was counted with the first one: {statuses}'